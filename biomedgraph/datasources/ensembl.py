@@ -285,3 +285,43 @@ class Ensembl(ManyVersionsRemoteDataSource):
         tsv_file_path = os.path.join(instance.instance_dir, 'tsv', organism_subpath, tsv_file_name)
 
         return tsv_file_path
+
+    @staticmethod
+    def get_locus_keys_file_path(taxid, instance):
+        """
+        Return the path to the file with all Locus keys parsed from an instance for a given taxid.
+
+        The file is written by the EnsemblLocusParser and used to compute changed loci between releases.
+
+        :param taxid: The taxid
+        :param instance: The DataSource instance
+        :return: The Locus keys file path
+        """
+        return os.path.join(instance.instance_dir, 'locus_keys', '{}.txt.gz'.format(taxid))
+
+    @staticmethod
+    def get_removed_locus_keys_file_path(taxid, instance):
+        """
+        Return the path to the file with the keys of loci that were removed since the previous instance.
+
+        The file is written by the EnsemblLocusParser in incremental mode, the loci can be deleted from the
+        database.
+
+        :param taxid: The taxid
+        :param instance: The DataSource instance
+        :return: The removed Locus keys file path
+        """
+        return os.path.join(instance.instance_dir, 'locus_keys', '{}.removed.txt.gz'.format(taxid))
+
+    @staticmethod
+    def get_interval_index_path(taxid, instance):
+        """
+        Return the path to the interval index directory of an instance for a given taxid.
+
+        The index is written by the EnsemblLocusParser, see `biomedgraph.parser.helper.intervals.IntervalIndex`.
+
+        :param taxid: The taxid
+        :param instance: The DataSource instance
+        :return: The interval index directory path
+        """
+        return os.path.join(instance.instance_dir, 'interval_index', str(taxid))
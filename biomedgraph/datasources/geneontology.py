@@ -1,8 +1,11 @@
 import logging
+import os
 
 from graphpipeline.datasource import RollingReleaseRemoteDataSource
 from graphpipeline.datasource.helper import downloader
 
+from biomedgraph.datasources.partition import shard_file
+
 log = logging.getLogger(__name__)
 
 # GeneOntology association subsets are available for some organisms
@@ -18,6 +21,18 @@ TAXID_2_ORG_FILE_NAME = {
 }
 
 
+def gaf_taxid_key(line):
+    """
+    Shard key of a GAF line, the taxid in column 13 (e.g. 'taxon:9606'). For interactions the column contains
+    two taxids ('taxon:9606|taxon:11676'), the first one is used.
+    """
+    flds = line.split(b'\t')
+    if len(flds) > 12:
+        taxid = flds[12].split(b'|', 1)[0].rsplit(b':', 1)[-1]
+        if taxid.isdigit():
+            return taxid.decode()
+
+
 class GeneOntology(RollingReleaseRemoteDataSource):
 
 
@@ -29,14 +44,16 @@ class GeneOntology(RollingReleaseRemoteDataSource):
         """
         super(GeneOntology, self).__init__(root_dir)
 
-    def download_function(self, instance, taxids=None):
+    def download_function(self, instance, taxids=None, shard=True):
         """
         Download a specific version.
 
-        There are subsets of the data for some key organisms.
+        There are subsets of the data for some key organisms. For all other organisms the file with all
+        associations is downloaded and split into one file per taxid.
 
         :param version: The version.
         :param taxids: List of taxIDs to download files for
+        :param shard: Split the GAF file with all associations into one file per taxid.
         :type version: DataSourceVersion
         """
         log.debug("Download GO Annotation")
@@ -66,3 +83,7 @@ class GeneOntology(RollingReleaseRemoteDataSource):
 
             for file in files:
                 downloader.download_file_to_dir(file, instance.process_instance_dir)
+
+            if shard:
+                shard_file(os.path.join(instance.process_instance_dir, 'goa_uniprot_all.gaf.gz'), gaf_taxid_key,
+                           keys=taxids)
@@ -1,16 +1,28 @@
 from datetime import datetime
+import os
 
 from graphpipeline.datasource import ManyVersionsRemoteDataSource
 from graphpipeline.datasource import DataSourceVersion
 from graphpipeline.datasource.helper import downloader
 from graphpipeline.datasource import DataSourceInstance
 
+from biomedgraph.datasources.partition import shard_file, get_shard_file
+
 VERSION_2_URL = {'6': 'http://mirdb.org/download/miRDB_v6.0_prediction_result.txt.gz',
                  '5': 'http://mirdb.org/download/miRDB_v5.0_prediction_result.txt.gz'}
 VERSION_2_FILENAME = {'6': 'miRDB_v6.0_prediction_result.txt.gz',
                       '5': 'miRDB_v5.0_prediction_result.txt.gz'}
 
 
+def mirna_prefix_key(line):
+    """
+    Shard key of a prediction line, the species prefix of the miRNA name (e.g. 'hsa' for 'hsa-miR-1-3p').
+    """
+    prefix = line.split(b'-', 1)[0]
+    if prefix.isalpha():
+        return prefix.decode()
+
+
 class Mirdb(ManyVersionsRemoteDataSource):
     """
     ftp://mirbase.org/pub/mirbase/21/
@@ -32,10 +44,24 @@ class Mirdb(ManyVersionsRemoteDataSource):
         versions = [DataSourceVersion(x) for x in VERSION_2_URL]
         return versions
 
-    def download_function(self, instance, version):
+    def download_function(self, instance, version, shard=True):
+        """
+        :param shard: Split the prediction file into one file per species prefix.
+        """
         downloader.download_file_to_dir(VERSION_2_URL[str(version)], instance.process_instance_dir)
 
+        if shard:
+            shard_file(os.path.join(instance.process_instance_dir, VERSION_2_FILENAME[str(version)]),
+                       mirna_prefix_key)
+
     @staticmethod
-    def get_prediction_file(instance):
+    def get_prediction_file(instance, mir_prefix=None):
+        """
+        :param mir_prefix: Species prefix (e.g. 'hsa'), return the shard of the species if available.
+        :return: Path of the file, None if the file is sharded and has no predictions for the species.
+        """
         version_string = instance.version
-        return instance.get_file(VERSION_2_FILENAME[version_string])
+        prediction_file = instance.get_file(VERSION_2_FILENAME[version_string])
+        if mir_prefix:
+            return get_shard_file(prediction_file, mir_prefix)
+        return prediction_file
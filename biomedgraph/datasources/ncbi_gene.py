@@ -1,9 +1,15 @@
 from datetime import datetime
+import os
 
 from graphpipeline.datasource import RollingReleaseRemoteDataSource
 from graphpipeline.datasource import DataSourceInstance
 from graphpipeline.datasource.helper import downloader
 
+from biomedgraph.datasources.partition import shard_file, first_column_key
+
+# large multi-species files that are split into one shard per taxid after download
+SHARDED_FILES = ['gene_info.gz', 'gene2ensembl.gz', 'gene2accession.gz', 'gene_history.gz']
+
 
 class NcbiGene(RollingReleaseRemoteDataSource):
 
@@ -15,7 +21,11 @@ class NcbiGene(RollingReleaseRemoteDataSource):
         """
         super(NcbiGene, self).__init__(root_dir)
 
-    def download_function(self, instance):
+    def download_function(self, instance, taxids=None, shard=True):
+        """
+        :param taxids: Optional list of taxids, only shards for these taxids are written.
+        :param shard: Split the large multi-species files into one file per taxid (see SHARDED_FILES).
+        """
         files = [
             'ftp://ftp.ncbi.nih.gov/gene/DATA/GENE_INFO/Mammalia/Homo_sapiens.gene_info.gz',
             'ftp://ftp.ncbi.nih.gov/gene/DATA/GENE_INFO/Mammalia/Mus_musculus.gene_info.gz',
@@ -28,3 +38,19 @@ class NcbiGene(RollingReleaseRemoteDataSource):
 
         for file in files:
             downloader.download_file_to_dir(file, instance.process_instance_dir)
+
+        if shard:
+            for file_name in SHARDED_FILES:
+                shard_file(os.path.join(instance.process_instance_dir, file_name), first_column_key, keys=taxids)
+
+    @staticmethod
+    def get_symbol_index_path(taxid, instance):
+        """
+        Return the path of the gene symbol index written by the NcbiGeneParser.
+
+        :param taxid: The taxid
+        :type taxid: str
+        :param instance: The DataSourceInstance
+        :type instance: DataSourceInstance
+        """
+        return os.path.join(instance.instance_dir, 'symbol_index', taxid)
@@ -0,0 +1,254 @@
+import gzip
+import json
+import logging
+import os
+from collections import OrderedDict
+
+log = logging.getLogger(__name__)
+
+INDEX_FILE = 'index.json'
+
+
+class PartitionWriter:
+    """
+    Write lines into one gzipped file per partition key (e.g. per taxid).
+
+    Large multi-species files can contain thousands of partitions. Lines are buffered per key and only a
+    bounded number of files is open at the same time. A file that was closed is re-opened in append
+    mode, which adds a new gzip member (concatenated gzip members are read transparently by `gzip`).
+
+        with PartitionWriter(target_dir) as writer:
+            for line in lines:
+                writer.write(line.split(b'\t', 1)[0], line)
+        writer.partitions
+        > {'9606': {'file': '9606.gz', 'lines': 1234}, ...}
+    """
+
+    def __init__(self, directory, max_open_files=64, buffer_size=64 * 1024, max_buffered=64 * 1024 * 1024,
+                 compresslevel=1):
+        """
+        :param directory: Target directory.
+        :param max_open_files: Maximum number of open files.
+        :param buffer_size: Bytes buffered per key before they are written.
+        :param max_buffered: Bytes buffered in total before all buffers are written.
+        :param compresslevel: gzip compression level.
+        """
+        self.directory = directory
+        self.max_open_files = max_open_files
+        self.buffer_size = buffer_size
+        self.max_buffered = max_buffered
+        self.compresslevel = compresslevel
+
+        self.partitions = {}
+        self._buffers = {}
+        self._buffer_sizes = {}
+        self._buffered = 0
+        self._open_files = OrderedDict()
+
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def file_name(key):
+        return '{}.gz'.format(key)
+
+    def write(self, key, line):
+        """
+        Add a line to a partition.
+
+        :param key: The partition key (str).
+        :param line: The line (bytes, including the line break).
+        """
+        if key not in self._buffers:
+            self._buffers[key] = []
+            self._buffer_sizes[key] = 0
+        if key not in self.partitions:
+            self.partitions[key] = {'file': self.file_name(key), 'lines': 0}
+
+        self._buffers[key].append(line)
+        self._buffer_sizes[key] += len(line)
+        self._buffered += len(line)
+        self.partitions[key]['lines'] += 1
+
+        if self._buffer_sizes[key] >= self.buffer_size:
+            self._flush(key)
+        if self._buffered >= self.max_buffered:
+            self.flush()
+
+    def flush(self):
+        for key in list(self._buffers):
+            self._flush(key)
+
+    def _flush(self, key):
+        lines = self._buffers.pop(key, None)
+        if not lines:
+            return
+        self._buffered -= self._buffer_sizes.pop(key)
+        self._get_file(key).write(b''.join(lines))
+
+    def _get_file(self, key):
+        if key in self._open_files:
+            self._open_files.move_to_end(key)
+            return self._open_files[key]
+
+        if len(self._open_files) >= self.max_open_files:
+            _, oldest = self._open_files.popitem(last=False)
+            oldest.close()
+
+        path = os.path.join(self.directory, self.file_name(key))
+        # the first write to a partition truncates files left by an earlier run
+        mode = 'ab' if self.partitions[key].get('opened') else 'wb'
+        self.partitions[key]['opened'] = True
+        f = gzip.open(path, mode, compresslevel=self.compresslevel)
+        self._open_files[key] = f
+        return f
+
+    def close(self):
+        """
+        Write all buffers and close all files.
+
+        :return: Dictionary of partition key -> {'file': file name, 'lines': number of lines}
+        """
+        self.flush()
+        for f in self._open_files.values():
+            f.close()
+        self._open_files = OrderedDict()
+        for partition in self.partitions.values():
+            partition.pop('opened', None)
+        return self.partitions
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def write_index(directory, index):
+    """
+    Write the index of a partitioned store.
+
+    :param directory: The store directory.
+    :param index: JSON serializable index.
+    """
+    with open(os.path.join(directory, INDEX_FILE), 'wt') as f:
+        json.dump(index, f, indent=1)
+
+
+def read_index(directory):
+    """
+    Read the index of a partitioned store.
+
+    :param directory: The store directory.
+    :return: The index or None if the store does not exist.
+    """
+    index_file = os.path.join(directory, INDEX_FILE)
+    if not os.path.exists(index_file):
+        return None
+    with open(index_file, 'rt') as f:
+        return json.load(f)
+
+
+def shard_directory(path):
+    """
+    Directory of the shards of a file, e.g. gene_info.gz -> gene_info.gz.shards
+
+    :param path: Path of the original file.
+    """
+    return path + '.shards'
+
+
+def first_column_key(line):
+    """
+    Shard key for files that start with the taxid (e.g. NCBI gene_info). Lines without a numeric
+    first column are skipped.
+    """
+    key = line.split(b'\t', 1)[0]
+    if key.isdigit():
+        return key.decode()
+
+
+def shard_file(path, key_function, keys=None, header_prefixes=(b'#', b'!'), compresslevel=1):
+    """
+    Split a large multi-species file into one gzipped shard per key (e.g. per taxid).
+
+    The header lines at the beginning of the file are copied to every shard, parsers can read a shard like
+    the original file. The shards and the manifest `index.json` are written to `shard_directory(path)`.
+    The manifest is written last, a directory without manifest is ignored by `get_shard_file`.
+
+    :param path: Path of the gzipped file.
+    :param key_function: Function that returns the key of a line (bytes) or None to skip the line.
+    :param keys: Only write shards for these keys, all keys if None.
+    :param header_prefixes: Header lines start with one of these prefixes.
+    :param compresslevel: gzip compression level.
+    :return: The manifest.
+    """
+    directory = shard_directory(path)
+    os.makedirs(directory, exist_ok=True)
+    index_file = os.path.join(directory, INDEX_FILE)
+    if os.path.exists(index_file):
+        os.remove(index_file)
+
+    keys = set(keys) if keys is not None else None
+    header = []
+    in_header = True
+    log.info("Shard {}".format(path))
+
+    with gzip.open(path, 'rb') as f, PartitionWriter(directory, compresslevel=compresslevel) as writer:
+        for line in f:
+            if in_header:
+                if line.startswith(header_prefixes):
+                    header.append(line)
+                    continue
+                in_header = False
+
+            key = key_function(line)
+            if key is None or (keys is not None and key not in keys):
+                continue
+
+            if key not in writer.partitions:
+                for header_line in header:
+                    writer.write(key, header_line)
+            writer.write(key, line)
+
+    manifest = {'source': os.path.basename(path), 'header_lines': len(header), 'shards': writer.partitions}
+    write_index(directory, manifest)
+    log.info("Wrote {} shards of {}".format(len(manifest['shards']), path))
+
+    return manifest
+
+
+def get_shard_file(path, key):
+    """
+    Get the file to read for one key of a file that may be sharded with `shard_file`.
+
+    :param path: Path of the original file.
+    :param key: The key (e.g. a taxid).
+    :return: The path of the shard, None if the file is sharded but has no lines for the key or the path
+        of the original file if it is not sharded.
+    """
+    directory = shard_directory(path)
+    manifest = read_index(directory)
+    if manifest is None:
+        return path
+    shard = manifest['shards'].get(key)
+    if shard is None:
+        return None
+    return os.path.join(directory, shard['file'])
+
+
+def get_shard_files(path, keys):
+    """
+    Get the files to read for a list of keys from a file that may be sharded with `shard_file`.
+
+    :param path: Path of the original file.
+    :param keys: List of keys (e.g. taxids).
+    :return: Dictionary file -> list of keys in the file (the original file has all keys).
+    """
+    files = {}
+    for key in keys:
+        file = get_shard_file(path, key)
+        if file is None:
+            log.info("No lines for {} in {}".format(key, path))
+            continue
+        files.setdefault(file, []).append(key)
+    return files
@@ -1,7 +1,12 @@
 import posixpath
 import os
 import gzip
+import shutil
+import subprocess
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from urllib.request import urlopen
 import zlib
 import logging
 
@@ -11,44 +16,173 @@ from graphpipeline.datasource import ManyVersionsRemoteDataSource
 from graphpipeline.datasource import DataSourceVersion
 from graphpipeline.datasource.helper import downloader
 
+from biomedgraph.datasources.partition import PartitionWriter, write_index, read_index, INDEX_FILE
+
 log = logging.getLogger(__name__)
 
+# filtered files are written once and read a few times, favour compression speed
+FILTERED_FILE_COMPRESSLEVEL = 1
+# bytes read from the remote file per iteration
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+# seconds without data before a download fails
+DOWNLOAD_TIMEOUT = 300
+# number of archived release files downloaded in parallel (NCBI limits concurrent FTP connections)
+ARCHIVE_DOWNLOAD_WORKERS = 4
+# directory of the taxid-partitioned store of all removed-records and accession2geneid files
+ARCHIVE_STORE_DIR = 'archive_by_taxid'
+ARCHIVE_FILE_TYPES = ['removed-records', 'accession2geneid']
+
+
+@contextmanager
+def gzip_writer(path: str, compresslevel: int = FILTERED_FILE_COMPRESSLEVEL):
+    """
+    Open a binary gzip writer. Uses a multi-threaded `pigz` process if available, `gzip` otherwise.
+
+    :param path: Path of the output file.
+    :param compresslevel: Compression level.
+    """
+    pigz = shutil.which('pigz')
+    if pigz:
+        with open(path, 'wb') as target:
+            process = subprocess.Popen([pigz, '-c', f'-{compresslevel}'], stdin=subprocess.PIPE, stdout=target)
+            try:
+                yield process.stdin
+            finally:
+                process.stdin.close()
+                if process.wait() != 0:
+                    raise IOError(f"pigz failed writing {path}")
+    else:
+        with gzip.open(path, 'wb', compresslevel=compresslevel) as output:
+            yield output
+
 
 def download_and_filter_data_file(url: str, path: str, taxids: List[str]) -> str:
     """
     Most RefSeq data files start with the Taxonomy ID. This function downloads a gzipped
-    data file, filters all records for a list of Taxonomy IDs and deletes the original file.
+    data file and filters all records for a list of Taxonomy IDs while downloading.
+
+    The byte stream is decompressed and filtered as it arrives, the full size file is never written
+    to disk. Lines are compared as bytes, they are not decoded.
 
     :param url: URL to download.
     :param path: Local download path.
     :param taxids: List of Taxonomy IDs to filter.
     :return: Path of filtered file.
     """
-    taxids = set(taxids)
-
-    downloaded_file = downloader.download_file_to_dir(url, path)
+    line_prefixes = tuple(f'{taxid}\t'.encode() for taxid in set(taxids))
 
-    original_filename = downloaded_file.split('/')[-1]
-    downloaded_path = downloaded_file.rsplit('/', 1)[0]
+    os.makedirs(path, exist_ok=True)
+    original_filename = url.rstrip('/').split('/')[-1]
 
-    # release10.removed-records.gz -> release10.removed-records_filtered.gz
+    # release10.removed-records.gz -> release10.removed-records.filtered.gz
     new_filename = f"{original_filename.rsplit('.', 1)[0]}.filtered.gz"
-    new_filepath = os.path.join(downloaded_path, new_filename)
+    new_filepath = os.path.join(path, new_filename)
+    # write to a temporary file, an interrupted download does not leave a valid looking file
+    temp_filepath = new_filepath + '.part'
+
+    log.debug(f"Download and filter {url} to {new_filepath}")
+
+    try:
+        with gzip_writer(temp_filepath) as output:
+            with urlopen(url, timeout=DOWNLOAD_TIMEOUT) as response:
+                # 16 + MAX_WBITS: expect a gzip header
+                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                rest = b''
+                while True:
+                    chunk = response.read(DOWNLOAD_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    data = decompressor.decompress(chunk)
+                    # files can consist of several concatenated gzip members
+                    while decompressor.eof and decompressor.unused_data:
+                        unused_data = decompressor.unused_data
+                        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                        data += decompressor.decompress(unused_data)
+
+                    lines = (rest + data).split(b'\n')
+                    rest = lines.pop()
+                    output.write(b''.join(l + b'\n' for l in lines if l.startswith(line_prefixes)))
+
+                # a stream that stops early ends within a gzip member
+                if not decompressor.eof:
+                    raise IOError(f"File {url} is truncated, corrupted download.")
+
+                rest += decompressor.flush()
+                if rest.startswith(line_prefixes):
+                    output.write(rest + b'\n')
+    except Exception as e:
+        # never publish a partial file
+        if os.path.exists(temp_filepath):
+            os.remove(temp_filepath)
+        if isinstance(e, zlib.error):
+            raise IOError(f"File {url} not readable, corrupted download.") from e
+        raise
+
+    os.replace(temp_filepath, new_filepath)
+    return new_filepath
 
-    with gzip.open(new_filepath, 'wt') as output:
 
-        with gzip.open(downloaded_file, 'rt') as f:
-            try:
-                for l in f:
-                    this_taxid = l.strip().split('\t')[0]
-                    if this_taxid in taxids:
-                        output.write(l)
-            except zlib.error as e:
-                log.error(e)
-                log.error(f"File {downloaded_file} not readable, corrupted download.")
-
-    os.remove(downloaded_file)
-    return new_filepath
+def get_release_number(filename: str) -> int:
+    """
+    release98.accession2geneid.gz -> 98
+
+    :param filename: Name of a release file.
+    :return: The release number.
+    """
+    return int(os.path.basename(filename).split('.')[0].replace('release', ''))
+
+
+def consolidate_archived_releases(path: str) -> str:
+    """
+    Merge all removed-records and accession2geneid files in a directory into a taxid-partitioned store.
+
+    The store contains one directory per file type with one gzipped file per taxid. Each line is the
+    original line prefixed with the release number, lines are sorted by release:
+
+        archive_by_taxid/removed-records/9606.gz
+        > 11    9606    Homo sapiens    NM_001001.1    ...
+
+    The index file `index.json` lists the releases and the partitions per file type. It is written last,
+    a store without index is incomplete and ignored by the parsers.
+
+    :param path: Directory with the release files.
+    :return: Path of the store.
+    """
+    store_path = os.path.join(path, ARCHIVE_STORE_DIR)
+    os.makedirs(store_path, exist_ok=True)
+    index_file = os.path.join(store_path, INDEX_FILE)
+    if os.path.exists(index_file):
+        os.remove(index_file)
+
+    index = {'releases': set(), 'files': {}}
+
+    for file_type in ARCHIVE_FILE_TYPES:
+        files = sorted(
+            (os.path.join(path, name) for name in os.listdir(path)
+             if name.startswith('release') and file_type in name and name.endswith('.gz')),
+            key=get_release_number
+        )
+        log.info(f"Consolidate {len(files)} {file_type} files in {store_path}")
+
+        with PartitionWriter(os.path.join(store_path, file_type),
+                             compresslevel=FILTERED_FILE_COMPRESSLEVEL) as writer:
+            for file in files:
+                release = str(get_release_number(file))
+                index['releases'].add(release)
+                prefix = release.encode() + b'\t'
+                with gzip.open(file, 'rb') as f:
+                    for line in f:
+                        taxid = line.split(b'\t', 1)[0]
+                        # skip empty lines and headers
+                        if taxid.isdigit():
+                            writer.write(taxid.decode(), prefix + line)
+
+        index['files'][file_type] = writer.partitions
+
+    index['releases'] = sorted(index['releases'], key=int)
+    write_index(store_path, index)
+
+    return store_path
 
 
 def get_list_of_archived_releases() -> defaultdict:
@@ -152,26 +286,38 @@ class Refseq(ManyVersionsRemoteDataSource):
             downloader.download_file_to_dir(accession2geneid, instance.process_instance_dir)
             downloader.download_file_to_dir(removed_records, instance.process_instance_dir)
 
+        consolidate_archived_releases(instance.process_instance_dir)
+
+    def download_archived_releases(self, path, taxids=None, max_workers=ARCHIVE_DOWNLOAD_WORKERS):
+        """
+        Download the accession2geneid and removed-records files of all archived releases.
+
+        The files are downloaded in parallel with a bounded number of workers.
 
-    def download_archived_releases(self, path, taxids=None):
+        :param path: Local download path.
+        :param taxids: Optional list of taxonomy IDs, files are filtered while downloading.
+        :param max_workers: Maximum number of parallel downloads.
+        """
         archive_files = get_list_of_archived_releases()
 
+        urls = []
         for release, files in archive_files.items():
             # only download if accession2geneid and removed-records are available
+            for file_type in ['accession2geneid', 'removed-records']:
+                if file_type in files:
+                    urls.append(files[file_type])
+
+        log.info(f"Download {len(urls)} archived RefSeq files with {max_workers} workers.")
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
             if taxids:
-                try:
-                    download_and_filter_data_file(files['accession2geneid'], path, taxids)
-                except KeyError: pass
-                try:
-                    download_and_filter_data_file(files['removed-records'], path, taxids)
-                except KeyError: pass
+                futures = [executor.submit(download_and_filter_data_file, url, path, taxids) for url in urls]
             else:
-                try:
-                    downloader.download_file_to_dir(files['accession2geneid'], path)
-                except KeyError: pass
-                try:
-                    downloader.download_file_to_dir(files['removed-records'], path)
-                except KeyError: pass
+                futures = [executor.submit(downloader.download_file_to_dir, url, path) for url in urls]
+
+            # raise the first download error
+            for future in futures:
+                future.result()
 
     @staticmethod
     def get_catalog_file_path(instance):
@@ -215,3 +361,32 @@ class Refseq(ManyVersionsRemoteDataSource):
             file_name = 'release{0}.accession2geneid.filtered.gz'.format(version)
             file_path = os.path.join(instance.instance_dir, file_name)
             return file_path
+
+    @staticmethod
+    def get_archive_store_path(instance):
+        """
+        Return the path to the taxid-partitioned store of the archived releases for a given instance.
+
+        :param instance: The DataSource instance
+        :return: The store path
+        """
+        return os.path.join(instance.instance_dir, ARCHIVE_STORE_DIR)
+
+    @staticmethod
+    def get_archive_partition_files(instance, file_type, taxids):
+        """
+        Return the partition files of the archive store for a file type and a list of taxids.
+
+        :param instance: The DataSource instance
+        :param file_type: 'removed-records' or 'accession2geneid'
+        :param taxids: List of taxids
+        :return: List of file paths (taxids without data have no file), None if the instance has no store.
+        """
+        store_path = Refseq.get_archive_store_path(instance)
+        index = read_index(store_path)
+        if index is None:
+            return None
+        partitions = index['files'][file_type]
+        return [
+            os.path.join(store_path, file_type, partitions[taxid]['file']) for taxid in taxids if taxid in partitions
+        ]
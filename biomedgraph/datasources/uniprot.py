@@ -1,4 +1,5 @@
 from datetime import datetime, date
+import os
 import posixpath
 from xml.etree import ElementTree
 
@@ -12,6 +13,12 @@ TAXID_KB_FILE_NAME = {
     '10090': 'rodents'
 }
 
+# prefix of the files in knowledgebase/idmapping/by_organism
+TAXID_IDMAPPING_FILE_NAME = {
+    '9606': 'HUMAN_9606',
+    '10090': 'MOUSE_10090'
+}
+
 
 class Uniprot(SingleVersionRemoteDataSource):
     UNIPROT_BASEURL = 'ftp://ftp.ebi.ac.uk'
@@ -78,10 +85,15 @@ class Uniprot(SingleVersionRemoteDataSource):
     #
     #     return versions
 
-    def download_function(self, instance, version):
+    def download_function(self, instance, version, idmapping=False):
+        """
+        :param idmapping: Also download the ID mapping files of all organisms in TAXID_IDMAPPING_FILE_NAME.
+        """
 
         if self.version_downloadable(version):
             self._download_latest_taxonomic_division(instance)
+            if idmapping:
+                self._download_latest_idmapping(instance)
 
     # TODO refactor
     # def _download_latest_complete(self, version):
@@ -111,6 +123,17 @@ class Uniprot(SingleVersionRemoteDataSource):
                     division),
                 instance.process_instance_dir)
 
+    def _download_latest_idmapping(self, instance):
+        # download ID mapping files by organism
+        for organism in TAXID_IDMAPPING_FILE_NAME.values():
+            for file_name in ['{}_idmapping_selected.tab.gz', '{}_idmapping.dat.gz']:
+                downloader.download_file_to_dir(
+                    '{}/{}knowledgebase/idmapping/by_organism/{}'.format(
+                        self.UNIPROT_BASEURL,
+                        self.UNIPROT_CURRENT_BASEPATH,
+                        file_name.format(organism)),
+                    instance.process_instance_dir)
+
     # previous versions are packed into a single file and cannot be handled like the current version
     # this function downloads the main file for a specific previous version but the file is useless for now
     # def _download_previous_all(self, version):
@@ -150,3 +173,31 @@ class Uniprot(SingleVersionRemoteDataSource):
         trembl_file_name = 'uniprot_trembl_{}.dat.gz'.format(TAXID_KB_FILE_NAME[taxid])
 
         return [instance.get_file(sprot_file_name), instance.get_file(trembl_file_name)]
+
+    @staticmethod
+    def get_idmapping_files_for_taxid(taxid, instance):
+        """
+        Return the ID mapping files of an organism: the tabular file with selected mappings and the full
+        3 column mapping file.
+
+        :param taxid: The reference taxid
+        :type taxid: str
+        :param instance: The DataSourceInstance
+        :type instance: DataSourceInstance
+        """
+        selected_file_name = '{}_idmapping_selected.tab.gz'.format(TAXID_IDMAPPING_FILE_NAME[taxid])
+        idmapping_file_name = '{}_idmapping.dat.gz'.format(TAXID_IDMAPPING_FILE_NAME[taxid])
+
+        return instance.get_file(selected_file_name), instance.get_file(idmapping_file_name)
+
+    @staticmethod
+    def get_secondary_accession_index_path(taxid, instance):
+        """
+        Return the path of the secondary -> primary accession index written by the UniprotKnowledgebaseParser.
+
+        :param taxid: The reference taxid
+        :type taxid: str
+        :param instance: The DataSourceInstance
+        :type instance: DataSourceInstance
+        """
+        return os.path.join(instance.instance_dir, 'secondary_accessions', taxid)
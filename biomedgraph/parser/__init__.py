@@ -1,7 +1,8 @@
 from .ncbigene import NcbiGeneParser
-from .ensembl import EnsemblEntityParser, EnsemblMappingParser, EnsemblLocusParser
+from .ensembl import EnsemblEntityParser, EnsemblMappingParser, EnsemblLocusParser, EnsemblGtfParser, \
+    EnsemblTranscriptStructureParser
 from .refseq import RefseqEntityParser, RefseqCodesParser, RefseqRemovedRecordsParser
-from .uniprot import UniprotKnowledgebaseParser
+from .uniprot import UniprotKnowledgebaseParser, UniprotMappingParser
 from .mirbase import MirbaseParser
 from .mirdb import MirdbParser
 from .mirtarbase import MirtarbaseParser
@@ -10,7 +11,8 @@ from .mesh import MeshParser
 from .big_word_list import BigWordListParser
 from .dummyparser import DummyParser
 from .ncbi_homologene import NcbiHomoloGeneParser
-from .ncbigene import NcbiGeneOrthologParser, NcbiGeneParser, NcbiLegacyGeneParser
+from .ncbigene import NcbiGeneOrthologParser, NcbiGeneParser, NcbiLegacyGeneParser, NcbiGene2EnsemblParser, \
+    NcbiGene2AccessionParser
 from .geneontology import GeneOntologyAssociationParser
 from .gtex import GtexMetadataParser, GtexDataParser
 from .hgnc import HGNCParser
@@ -1,3 +1,4 @@
+import io
 import pronto
 import os
 import logging
@@ -7,7 +8,8 @@ import re
 from graphpipeline.parser import ReturnParser
 from graphio import NodeSet, RelationshipSet
 
-from biomedgraph.parser.helper.obo import clean_obo_file
+from biomedgraph.parser.helper.obo import open_clean_obo, read_obo, read_pronto_ontology
+from biomedgraph.parser.helper.obocache import cached_ontology, cache_key_prefix
 
 log = logging.getLogger(__name__)
 
@@ -22,6 +24,11 @@ class ChebiParser(ReturnParser):
         self.metabolite_rel_metabolite = RelationshipSet('CHEBI_REL', ['Metabolite'], ['Metabolite'], ['sid'], ['sid'], default_props={'source': 'chebi'})
         self.metabolite_maps_metabolite = RelationshipSet('MAPS', ['Metabolite'], ['Metabolite'], ['sid'], ['sid'], default_props={'source': 'chebi'})
 
+        # 'pronto' or 'native' (stream the OBO file with `biomedgraph.parser.helper.obo.read_obo`)
+        self.obo_backend = 'pronto'
+        # directory of the parsed ontology cache (see `biomedgraph.parser.helper.obocache`), no cache if None
+        self.cache_dir = None
+
     def run_with_mounted_arguments(self):
         self.run()
 
@@ -30,42 +37,52 @@ class ChebiParser(ReturnParser):
 
         obo_file = chebi_instance.get_file('chebi.obo')
 
-        cleaned_obo_file = clean_obo_file(obo_file)
-
-        chebi_ontology = pronto.Ontology(cleaned_obo_file)
-
-        reltypes = set()
-
-        # iterate terms
-        for term in chebi_ontology.terms():
-
-            term_sid = (term.id).split(':')[1]
-            ontology_id = term.id
-            self.metabolites.add_node(
-                {'name': (term.name), 'sid': term_sid, 'ontology_id': ontology_id,
-                 'definition': term.definition, 'alt_ids': list(term.alternate_ids)}
+        if self.cache_dir:
+            _, terms = cached_ontology(self.cache_dir, obo_file, cache_key_prefix('ChebiParser', self.obo_backend),
+                                       self.read_ontology)
+            for term in terms:
+                self.add_term(term)
+            return
+
+        # the file is cleaned while it is read
+        with open_clean_obo(obo_file) as cleaned_obo_file:
+            _, terms = self.read_ontology(cleaned_obo_file)
+            for term in terms:
+                self.add_term(term)
+
+    def read_ontology(self, cleaned_obo_file):
+        """
+        :param cleaned_obo_file: Binary file handle from `open_clean_obo`.
+        :return: Tuple (header, iterator of terms), see `biomedgraph.parser.helper.obo.read_obo`.
+        """
+        if self.obo_backend == 'native':
+            return read_obo(io.TextIOWrapper(cleaned_obo_file, encoding='utf-8'))
+        return read_pronto_ontology(pronto.Ontology(cleaned_obo_file))
+
+    def add_term(self, term):
+        """
+        :param term: Term dictionary from `read_obo` or `read_pronto_ontology`, e.g. with id 'CHEBI:15377'.
+        """
+        ontology_id = term['id']
+        term_sid = ontology_id.split(':')[1]
+        self.metabolites.add_node(
+            {'name': term['name'], 'sid': term_sid, 'ontology_id': ontology_id,
+             'definition': term['definition'], 'alt_ids': term['alt_ids']}
+        )
+
+        for parent in term['is_a']:
+            self.metabolite_isa_metabolite.add_relationship(
+                {'sid': term_sid}, {'sid': parent}, {}
             )
 
-            for parent in term.superclasses(distance=1, with_self=False):
-                self.metabolite_isa_metabolite.add_relationship(
-                    {'sid': term_sid}, {'sid': parent.id}, {}
-                )
+        for reltype, target in term['relationships']:
+            self.metabolite_rel_metabolite.add_relationship(
+                {'sid': term_sid}, {'sid': target}, {'type': reltype})
 
-            ## other named relationships
-            try:
-                for reltype, targets in term.relationships.items():
-
-                    for target in targets:
-                        self.metabolite_rel_metabolite.add_relationship(
-                            {'sid': term_sid}, {'sid': target.id}, {'type': reltype.id})
-            except KeyError as e:
-                log.error(f"Cannot iterate relationshis of term {term_sid}")
-                log.error(e)
-
-            # metabolite-MAPS-metabolite
-            for xref in term.xrefs:
-                if 'HMDB:' in xref.id:
-                    hmdb_id = xref.id.strip().split('HMDB:')[1]
-                    self.metabolite_maps_metabolite.add_relationship(
-                        {'sid': term_sid}, {'sid': hmdb_id}, {}
-                    )
+        # metabolite-MAPS-metabolite
+        for xref in term['xrefs']:
+            if 'HMDB:' in xref:
+                hmdb_id = xref.strip().split('HMDB:')[1]
+                self.metabolite_maps_metabolite.add_relationship(
+                    {'sid': term_sid}, {'sid': hmdb_id}, {}
+                )
@@ -1,19 +1,91 @@
 import gzip
+import hashlib
 import logging
 import os
-from uuid import uuid4
 
 from graphio import NodeSet, RelationshipSet
 
 from biomedgraph.datasources.ensembl import Ensembl
-from graphpipeline.parser import GffReader
+from biomedgraph.parser.helper.gtf import GtfScan
+from biomedgraph.parser.helper.intervals import IntervalIndexBuilder
+from biomedgraph.parser.helper.uniprot import resolve_accessions
 from graphpipeline.parser import ReturnParser
 
 log = logging.getLogger(__name__)
 
 
+def get_gtf_file_path(taxid, ensembl_instance):
+    """
+    Return the path to the GTF file of an instance, the patched file is used if available.
+
+    :param taxid: The taxid
+    :param ensembl_instance: The ENSEMBL DataSource instance.
+    :return: The GTF file path
+    """
+    ensembl_gtf_file_path = Ensembl.get_gtf_file_path(taxid, ensembl_instance, patched=True)
+    if not os.path.exists(ensembl_gtf_file_path):
+        ensembl_gtf_file_path = Ensembl.get_gtf_file_path(taxid, ensembl_instance, patched=False)
+    return ensembl_gtf_file_path
+
+
+def locus_key(chr, start, end, strand, feature_type, gene_id, transcript_id, ref):
+    """
+    Deterministic key of a Locus derived from its content.
+
+    The same GTF line gives the same key in every release, the key can thus be used to MERGE onto
+    existing Locus nodes.
+
+    :return: 16 character hex string.
+    """
+    content = '\t'.join([chr, str(start), str(end), strand, feature_type, gene_id or '', transcript_id or '', ref])
+    return hashlib.blake2b(content.encode(), digest_size=8).hexdigest()
+
+
+def locus_digest(props):
+    """
+    Digest of all properties of a Locus, changes if a property that is not part of the key changes
+    (e.g. gene_name or a version).
+
+    :param props: Dictionary of Locus properties.
+    :return: 16 character hex string.
+    """
+    content = '\t'.join('{}={}'.format(k, v) for k, v in sorted(props.items()))
+    return hashlib.blake2b(content.encode(), digest_size=8).hexdigest()
+
+
+def read_locus_keys(path):
+    """
+    Read a file with Locus keys and property digests.
+
+    :param path: Path to the gzipped file with one key and digest per line.
+    :return: Dictionary key -> digest, the digest is '' for files without digests.
+    """
+    keys = {}
+    with gzip.open(path, 'rt') as f:
+        for l in f:
+            key, _, digest = l.rstrip('\n').partition('\t')
+            keys[key] = digest
+    return keys
+
+
+def write_locus_keys(path, keys):
+    """
+    Write Locus keys to a file, one key and property digest per line.
+
+    :param path: Path to the gzipped file.
+    :param keys: Dictionary key -> digest.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with gzip.open(path, 'wt', compresslevel=1) as f:
+        for key in sorted(keys):
+            f.write('{}\t{}\n'.format(key, keys[key]))
+
+
 class EnsemblEntityParser(ReturnParser):
 
+    # GTF feature types and attributes needed by this parser
+    GTF_TYPES = ['gene', 'transcript', 'CDS']
+    GTF_ATTRIBUTES = ['gene_id', 'gene_name', 'transcript_id', 'protein_id']
 
     def __init__(self):
         """
@@ -33,81 +105,109 @@ class EnsemblEntityParser(ReturnParser):
         self.gene_codes_transcript = RelationshipSet('CODES', ['Gene'], ['Transcript'], ['sid'], ['sid'], default_props={'source': 'ensembl'})
         self.transcript_codes_protein = RelationshipSet('CODES', ['Transcript'], ['Protein'], ['sid'], ['sid'], default_props={'source': 'ensembl'})
 
+        # check sets, kept on the instance to be shared across batches
+        self.check_gene_ids = set()
+        self.check_transcript_ids = set()
+        self.check_protein_ids = set()
+        self.check_gene_transcript_rels = set()
+        self.check_transcript_protein_rels = set()
+
     def run_with_mounted_arguments(self):
         self.run(self.taxid)
 
     def run(self, taxid):
         ensembl_instance = self.get_instance_by_name('Ensembl')
-        datasource_name = ensembl_instance.datasource.name
 
         # try patched path, if not available take flat
-        ensembl_gtf_file_path = Ensembl.get_gtf_file_path(taxid, ensembl_instance, patched=True)
-        if not os.path.exists(ensembl_gtf_file_path):
-            ensembl_gtf_file_path = Ensembl.get_gtf_file_path(taxid, ensembl_instance, patched=False)
-
-        annotation = GffReader(ensembl_gtf_file_path)
+        ensembl_gtf_file_path = get_gtf_file_path(taxid, ensembl_instance)
 
-        check_gene_ids = set()
-        check_transcript_ids = set()
-        check_protein_ids = set()
-        check_gene_transcript_rels = set()
-        check_transcript_protein_rels = set()
         log.info("Start parsing ENSEMBL gtf file, taxid {}, {}".format(taxid, ensembl_gtf_file_path))
-        for r in annotation.records:
+        scan = GtfScan(ensembl_gtf_file_path)
+        self.register(scan, taxid)
+        scan.run()
+        log.info("Finished parsing ENSEMBL gtf file.")
+
+    def register(self, scan, taxid):
+        """
+        Register this parser as consumer of a GtfScan.
+
+        :param scan: The GtfScan.
+        :param taxid: The taxid
+        """
+        scan.register(self.__class__.__name__, lambda batch: self.parse_batch(batch, taxid),
+                      types=self.GTF_TYPES, attributes=self.GTF_ATTRIBUTES)
+
+    def parse_batch(self, batch, taxid):
+        """
+        Add Gene, Transcript and Protein data from a batch of GTF records.
+
+        Only genes, transcripts and CDS records are used. Each gene has a 'gene' record and each
+        transcript has a 'transcript' record, all other records only repeat the same IDs.
+
+        :param batch: Batch of GTF records from a GtfColumnReader.
+        :param taxid: The taxid
+        """
+        for feature_type, gene_id, gene_name, transcript_id, protein_id in zip(
+                batch['type'], batch['gene_id'], batch['gene_name'], batch['transcript_id'], batch['protein_id']):
+
+            if feature_type not in self.GTF_TYPES:
+                continue
 
             # add gene node
-            gene_id = r.attributes['gene_id']
-            if gene_id not in check_gene_ids:
-                props = {'sid': gene_id, 'name': r.attributes['gene_name'], 'taxid': taxid}
+            if gene_id not in self.check_gene_ids:
+                props = {'sid': gene_id, 'name': gene_name, 'taxid': taxid}
 
                 self.genes.add_node(props)
-                check_gene_ids.add(gene_id)
+                self.check_gene_ids.add(gene_id)
 
-            # add transcript node
-            if r.type == 'transcript':
-                transcript_id = r.attributes['transcript_id']
-                if transcript_id not in check_transcript_ids:
+            if feature_type == 'transcript':
+                # add transcript node
+                if transcript_id not in self.check_transcript_ids:
                     props = {'sid': transcript_id, 'taxid': taxid}
 
                     self.transcripts.add_node(props)
-                    check_transcript_ids.add(transcript_id)
+                    self.check_transcript_ids.add(transcript_id)
 
-            # add protein node
-            if r.type == 'CDS':
-                protein_id = r.attributes['protein_id']
-                if protein_id not in check_protein_ids:
-                    props = {'sid': protein_id, 'taxid': taxid}
-
-                    self.proteins.add_node(props)
-                    check_protein_ids.add(protein_id)
-
-            # Gene-CODES-Transcript
-            if r.type == 'transcript':
-                transcript_id = r.attributes['transcript_id']
-                gene_id = r.attributes['gene_id']
-
-                # add gene-transcript rel
-                if gene_id + transcript_id not in check_gene_transcript_rels:
+                # Gene-CODES-Transcript
+                if gene_id + transcript_id not in self.check_gene_transcript_rels:
                     self.gene_codes_transcript.add_relationship({'sid': gene_id}, {'sid': transcript_id},
                                                                 {})
-                    check_gene_transcript_rels.add(gene_id + transcript_id)
+                    self.check_gene_transcript_rels.add(gene_id + transcript_id)
 
-            # Transcript-CODES-Protein
-            if r.type == 'CDS':
-                protein_id = r.attributes['protein_id']
-                transcript_id = r.attributes['transcript_id']
+            elif feature_type == 'CDS':
+                # add protein node
+                if protein_id not in self.check_protein_ids:
+                    props = {'sid': protein_id, 'taxid': taxid}
+
+                    self.proteins.add_node(props)
+                    self.check_protein_ids.add(protein_id)
 
-                # add transcript-protein rel
-                if transcript_id + protein_id not in check_transcript_protein_rels:
+                # Transcript-CODES-Protein
+                if transcript_id + protein_id not in self.check_transcript_protein_rels:
                     self.transcript_codes_protein.add_relationship({'sid': transcript_id}, {'sid': protein_id},
                                                                    {})
-                    check_transcript_protein_rels.add(transcript_id + protein_id)
-
-        log.info("Finished parsing ENSEMBL gtf file.")
+                    self.check_transcript_protein_rels.add(transcript_id + protein_id)
 
 
 class EnsemblLocusParser(ReturnParser):
-
+    """
+    Extract one Locus per line of the ENSEMBL GTF file.
+
+    Loci are merged on a deterministic key derived from chr/start/end/strand/type/gene_id/transcript_id/ref
+    (see `locus_key`), the same line thus maps to the same Locus node in every release.
+
+    The keys of all loci of an instance are written to `Ensembl.get_locus_keys_file_path` together with a
+    digest of the Locus properties (see `locus_digest`). For an incremental reload set `previous_keys_file`
+    to the key file of the previous instance: only loci that are new in this instance or whose properties
+    changed are returned in `locus`. The keys of loci that were removed since the previous instance are
+    collected in `removed_locus_keys` and written to `Ensembl.get_removed_locus_keys_file_path`, these loci
+    can be deleted from the database. The removed keys are deliberately not returned as a NodeSet, the
+    pipeline would merge them back as Locus nodes.
+
+    If `build_interval_index` is set, the genes and transcripts are also written to an interval index at
+    `Ensembl.get_interval_index_path` during the same pass over the GTF file. The index answers overlap
+    queries without the database (see `biomedgraph.parser.helper.intervals.IntervalIndex`).
+    """
 
     def __init__(self):
         """
@@ -118,31 +218,284 @@ class EnsemblLocusParser(ReturnParser):
         # arguments
         self.arguments = ['taxid']
 
+        # optional key file of the previous instance, enables the incremental mode
+        self.previous_keys_file = None
+        # write an interval index of genes and transcripts
+        self.build_interval_index = False
+        self.interval_index_builder = None
+
         # NodeSets
-        self.locus = NodeSet(['Locus'], merge_keys=['uuid'], default_props={'source': 'ensembl'})
+        self.locus = NodeSet(['Locus'], merge_keys=['sid'], default_props={'source': 'ensembl'})
+
+        # keys of all loci in this instance -> property digest
+        self.locus_keys = {}
+        # keys of the previous instance that are not in this instance (incremental mode)
+        self.removed_locus_keys = set()
+        self.previous_keys = None
 
     def run_with_mounted_arguments(self):
         self.run(self.taxid)
 
     def run(self, taxid):
         ensembl_instance = self.get_instance_by_name('Ensembl')
-        datasource_name = ensembl_instance.datasource.name
 
-        ensembl_gtf_file_path = Ensembl.get_gtf_file_path(taxid, ensembl_instance)
-
-        annotation = GffReader(ensembl_gtf_file_path)
+        # try patched path, if not available take flat
+        ensembl_gtf_file_path = get_gtf_file_path(taxid, ensembl_instance)
 
         log.info("Start parsing ENSEMBL gtf file, taxid {}, {}".format(taxid, ensembl_gtf_file_path))
-        for r in annotation.records:
+        scan = GtfScan(ensembl_gtf_file_path)
+        self.register(scan, taxid)
+        scan.run()
+        self.finish(taxid, ensembl_instance)
+        log.info("Finished parsing ENSEMBL gtf file.")
 
-            # one line is one unique Locus
-            props = {'chr': r.chr, 'annotation_source': r.source, 'start': int(r.start), 'end': int(r.end),
-                     'type': r.type, 'score': r.score, 'strand': r.strand, 'frame': r.frame,
-                     'taxid': taxid, 'ref': 'h38', 'uuid': str(uuid4())}
-            props.update(r.attributes)
+    def register(self, scan, taxid):
+        """
+        Register this parser as consumer of a GtfScan.
+
+        :param scan: The GtfScan.
+        :param taxid: The taxid
+        """
+        if self.previous_keys_file:
+            log.info("Incremental Locus parsing against {}".format(self.previous_keys_file))
+            self.previous_keys = read_locus_keys(self.previous_keys_file)
+
+        scan.register(self.__class__.__name__, lambda batch: self.parse_batch(batch, taxid),
+                      all_attributes=True)
+
+        if self.build_interval_index:
+            self.interval_index_builder = IntervalIndexBuilder()
+            self.interval_index_builder.register(scan)
+
+    def parse_batch(self, batch, taxid):
+        """
+        Add Locus nodes from a batch of GTF records, one line is one unique Locus.
+
+        :param batch: Batch of GTF records from a GtfColumnReader.
+        :param taxid: The taxid
+        """
+        ref = 'h38'
+
+        for chr, source, feature_type, start, end, score, strand, frame, attributes in zip(
+                batch['chr'], batch['source'], batch['type'], batch['start'], batch['end'], batch['score'],
+                batch['strand'], batch['frame'], batch['attributes']):
+
+            key = locus_key(chr, start, end, strand, feature_type, attributes.get('gene_id'),
+                            attributes.get('transcript_id'), ref)
+            if key in self.locus_keys:
+                continue
+
+            props = {'chr': chr, 'annotation_source': source, 'start': start, 'end': end,
+                     'type': feature_type, 'score': score, 'strand': strand, 'frame': frame,
+                     'taxid': taxid, 'ref': ref}
+            props.update(attributes)
+            props['sid'] = key
+
+            digest = locus_digest(props)
+            self.locus_keys[key] = digest
+
+            # incremental mode: unchanged loci from the previous instance exist already
+            if self.previous_keys is not None and self.previous_keys.get(key) == digest:
+                continue
 
             self.locus.add_node(props)
 
+    def finish(self, taxid, ensembl_instance):
+        """
+        Write the Locus keys (and the interval index) of this instance and collect removed loci in
+        incremental mode.
+
+        :param taxid: The taxid
+        :param ensembl_instance: The ENSEMBL DataSource instance.
+        """
+        write_locus_keys(Ensembl.get_locus_keys_file_path(taxid, ensembl_instance), self.locus_keys)
+
+        if self.interval_index_builder:
+            self.interval_index_builder.save(Ensembl.get_interval_index_path(taxid, ensembl_instance))
+            self.interval_index_builder = None
+
+        if self.previous_keys is not None:
+            self.removed_locus_keys.update(self.previous_keys.keys() - self.locus_keys.keys())
+            write_locus_keys(Ensembl.get_removed_locus_keys_file_path(taxid, ensembl_instance),
+                             dict.fromkeys(self.removed_locus_keys, ''))
+            log.info("Loci added or changed: {}, removed: {}".format(len(self.locus.nodes),
+                                                                     len(self.removed_locus_keys)))
+            self.previous_keys = None
+
+
+class EnsemblTranscriptStructureParser(ReturnParser):
+    """
+    Compact alternative to the EnsemblLocusParser.
+
+    Instead of one Locus node per GTF line, the exon and CDS coordinates are aggregated per transcript
+    and stored as array properties on the Transcript node. The Gene node gets the gene span and biotype.
+
+    Transcript properties: chr, start, end, strand, biotype, exon_starts, exon_ends, cds_starts, cds_ends
+    (exons and CDS sorted by start position).
+
+    Gene properties: chr, start, end, strand, biotype
+    """
+
+    GTF_TYPES = ['gene', 'transcript', 'exon', 'CDS']
+    GTF_ATTRIBUTES = ['gene_id', 'transcript_id', 'gene_biotype', 'transcript_biotype']
+
+    def __init__(self):
+        super(EnsemblTranscriptStructureParser, self).__init__()
+
+        # arguments
+        self.arguments = ['taxid']
+
+        # NodeSets
+        self.gene_structures = NodeSet(['Gene'], merge_keys=['sid'], default_props={'source': 'ensembl'})
+        self.transcript_structures = NodeSet(['Transcript'], merge_keys=['sid'], default_props={'source': 'ensembl'})
+
+        # collected data
+        self.gene_data = {}
+        self.transcript_data = {}
+
+    def run_with_mounted_arguments(self):
+        self.run(self.taxid)
+
+    def run(self, taxid):
+        ensembl_instance = self.get_instance_by_name('Ensembl')
+
+        ensembl_gtf_file_path = get_gtf_file_path(taxid, ensembl_instance)
+
+        log.info("Start parsing ENSEMBL gtf file, taxid {}, {}".format(taxid, ensembl_gtf_file_path))
+        scan = GtfScan(ensembl_gtf_file_path)
+        self.register(scan, taxid)
+        scan.run()
+        self.finish(taxid)
+        log.info("Finished parsing ENSEMBL gtf file.")
+
+    def register(self, scan, taxid):
+        """
+        Register this parser as consumer of a GtfScan.
+
+        :param scan: The GtfScan.
+        :param taxid: The taxid
+        """
+        scan.register(self.__class__.__name__, self.parse_batch, types=self.GTF_TYPES,
+                      attributes=self.GTF_ATTRIBUTES)
+
+    def parse_batch(self, batch):
+        """
+        Collect gene spans, transcript spans and exon/CDS coordinates from a batch of GTF records.
+
+        :param batch: Batch of GTF records from a GtfColumnReader.
+        """
+        for chr, feature_type, start, end, strand, gene_id, transcript_id, gene_biotype, transcript_biotype in zip(
+                batch['chr'], batch['type'], batch['start'], batch['end'], batch['strand'], batch['gene_id'],
+                batch['transcript_id'], batch['gene_biotype'], batch['transcript_biotype']):
+
+            if feature_type == 'gene':
+                self.gene_data[gene_id] = {'sid': gene_id, 'chr': chr, 'start': start, 'end': end,
+                                           'strand': strand, 'biotype': gene_biotype}
+
+            elif feature_type == 'transcript':
+                data = self._transcript(transcript_id)
+                data.update({'chr': chr, 'start': start, 'end': end, 'strand': strand,
+                             'biotype': transcript_biotype})
+
+            elif feature_type == 'exon':
+                self._transcript(transcript_id)['exons'].append((start, end))
+
+            elif feature_type == 'CDS':
+                self._transcript(transcript_id)['cds'].append((start, end))
+
+    def _transcript(self, transcript_id):
+        if transcript_id not in self.transcript_data:
+            self.transcript_data[transcript_id] = {'sid': transcript_id, 'exons': [], 'cds': []}
+        return self.transcript_data[transcript_id]
+
+    def finish(self, taxid):
+        """
+        Create the Gene and Transcript nodes from the collected data.
+
+        :param taxid: The taxid
+        """
+        for props in self.gene_data.values():
+            props['taxid'] = taxid
+            self.gene_structures.add_node(props)
+
+        for data in self.transcript_data.values():
+            exons = sorted(data.pop('exons'))
+            cds = sorted(data.pop('cds'))
+            data['exon_starts'] = [x[0] for x in exons]
+            data['exon_ends'] = [x[1] for x in exons]
+            data['cds_starts'] = [x[0] for x in cds]
+            data['cds_ends'] = [x[1] for x in cds]
+            data['taxid'] = taxid
+            self.transcript_structures.add_node(data)
+
+        self.gene_data = {}
+        self.transcript_data = {}
+
+
+class EnsemblGtfParser(ReturnParser):
+    """
+    Run EnsemblEntityParser and EnsemblLocusParser on a single pass over the ENSEMBL GTF file.
+
+    Both parsers read the same (multi-GB) GTF file. This parser registers both as consumers of one
+    GtfScan so that the file is decompressed and tokenized only once per taxid. The NodeSets and
+    RelationshipSets of both parsers are exposed on this parser.
+
+    For an incremental Locus reload set `locus_parser.previous_keys_file` (see EnsemblLocusParser), the keys
+    of removed loci are in `removed_locus_keys`.
+
+    If `transcript_structure` is set, the EnsemblTranscriptStructureParser is run instead of the
+    EnsemblLocusParser: exon/CDS coordinates end up on the Transcript nodes instead of one Locus node
+    per GTF line.
+    """
+
+    def __init__(self):
+        super(EnsemblGtfParser, self).__init__()
+
+        # arguments
+        self.arguments = ['taxid']
+
+        # use the compact transcript structure instead of Locus nodes
+        self.transcript_structure = False
+
+        self.entity_parser = EnsemblEntityParser()
+        self.locus_parser = EnsemblLocusParser()
+        self.structure_parser = EnsemblTranscriptStructureParser()
+
+        # NodeSets
+        self.genes = self.entity_parser.genes
+        self.transcripts = self.entity_parser.transcripts
+        self.proteins = self.entity_parser.proteins
+        self.locus = self.locus_parser.locus
+        self.gene_structures = self.structure_parser.gene_structures
+        self.transcript_structures = self.structure_parser.transcript_structures
+
+        # RelationshipSets
+        self.gene_codes_transcript = self.entity_parser.gene_codes_transcript
+        self.transcript_codes_protein = self.entity_parser.transcript_codes_protein
+
+        # keys of removed loci in incremental mode, not a NodeSet
+        self.removed_locus_keys = self.locus_parser.removed_locus_keys
+
+    def run_with_mounted_arguments(self):
+        self.run(self.taxid)
+
+    def run(self, taxid):
+        ensembl_instance = self.get_instance_by_name('Ensembl')
+
+        ensembl_gtf_file_path = get_gtf_file_path(taxid, ensembl_instance)
+
+        log.info("Start parsing ENSEMBL gtf file, taxid {}, {}".format(taxid, ensembl_gtf_file_path))
+        scan = GtfScan(ensembl_gtf_file_path)
+        self.entity_parser.register(scan, taxid)
+        if self.transcript_structure:
+            self.structure_parser.register(scan, taxid)
+        else:
+            self.locus_parser.register(scan, taxid)
+        scan.run()
+        if self.transcript_structure:
+            self.structure_parser.finish(taxid)
+        else:
+            self.locus_parser.finish(taxid, ensembl_instance)
         log.info("Finished parsing ENSEMBL gtf file.")
 
 
@@ -197,6 +550,9 @@ class EnsemblMappingParser(ReturnParser):
         self.transcript_maps_transcript = RelationshipSet('MAPS', ['Transcript'], ['Transcript'], ['sid'], ['sid'], default_props={'source': 'ensembl'})
         self.protein_maps_protein = RelationshipSet('MAPS', ['Protein'], ['Protein'], ['sid'], ['sid'], default_props={'source': 'ensembl'})
 
+        # optional secondary -> primary UniProt accession index (see UniprotKnowledgebaseParser)
+        self.secondary_accession_index = None
+
     # define properties that are used in multiple parsing functions
     @property
     def ensembl_instance(self):
@@ -260,20 +616,21 @@ class EnsemblMappingParser(ReturnParser):
 
         check_rels = set()
         with gzip.open(ensembl_tsv_uniprot_file_path, 'rt') as f:
-            lines = f.readlines()
-            for l in lines[1:]:
-                flds = l.strip().split()
+            lines = f.readlines()[1:]
 
-                ensembl_protein_id = flds[2]
-                xref_id = flds[3]
+        flds_list = [l.strip().split() for l in lines]
+        xref_ids = resolve_accessions(self.secondary_accession_index, [flds[3] for flds in flds_list])
+
+        for flds, xref_id in zip(flds_list, xref_ids):
+            ensembl_protein_id = flds[2]
 
-                if frozenset([ensembl_protein_id, xref_id]) not in check_rels:
-                    self.protein_maps_protein.add_relationship(
-                        {'sid': ensembl_protein_id}, {'sid': xref_id},
-                        {'taxid': self.taxid}
-                    )
+            if frozenset([ensembl_protein_id, xref_id]) not in check_rels:
+                self.protein_maps_protein.add_relationship(
+                    {'sid': ensembl_protein_id}, {'sid': xref_id},
+                    {'taxid': self.taxid}
+                )
 
-                    check_rels.add(frozenset([ensembl_protein_id, xref_id]))
+                check_rels.add(frozenset([ensembl_protein_id, xref_id]))
 
     def run_with_mounted_arguments(self):
         self.run(self.taxid)
@@ -1,17 +1,247 @@
+import csv
 import logging
 import gzip
+from collections import Counter
 
+import pandas
 from graphpipeline.parser import ReturnParser
 from graphio import NodeSet, RelationshipSet
 
+from biomedgraph.datasources.partition import get_shard_files
+from biomedgraph.parser.helper.taxid import taxid_list, taxid_sets
+from biomedgraph.parser.helper.uniprot import UniprotAccessionResolver
+
 log = logging.getLogger(__name__)
 
+# GAF columns used by the parser: DB, DB_Object_ID, Qualifier, GO ID, DB:Reference, Evidence, Taxon, Assigned_by
+GAF_USE_COLUMNS = {0: 'db', 1: 'db_id', 3: 'qualifier', 4: 'go_id', 5: 'reference', 6: 'evidence', 12: 'taxon',
+                   14: 'assigned_by'}
+# GPA columns: DB, DB_Object_ID, Qualifier, GO ID, DB:Reference, ECO evidence code, Assigned_by, Properties
+GPA_USE_COLUMNS = {0: 'db', 1: 'db_id', 2: 'qualifier', 3: 'go_id', 4: 'reference', 5: 'eco', 9: 'assigned_by',
+                   11: 'properties'}
+# GPI columns: DB, DB_Object_ID, Taxon, Parent_Object_ID
+GPI_USE_COLUMNS = {0: 'db', 1: 'db_id', 6: 'taxon', 7: 'parent'}
+
+# default ECO code -> GO evidence code (from the GO gaf-eco-mapping), used for GPA lines without go_evidence
+ECO_2_GO_EVIDENCE = {
+    'ECO:0000269': 'EXP', 'ECO:0000314': 'IDA', 'ECO:0000353': 'IPI', 'ECO:0000315': 'IMP', 'ECO:0000316': 'IGI',
+    'ECO:0000270': 'IEP', 'ECO:0006056': 'HTP', 'ECO:0007005': 'HDA', 'ECO:0007001': 'HMP', 'ECO:0007003': 'HGI',
+    'ECO:0007007': 'HEP', 'ECO:0000318': 'IBA', 'ECO:0000319': 'IBD', 'ECO:0000320': 'IKR', 'ECO:0000321': 'IRD',
+    'ECO:0000250': 'ISS', 'ECO:0000266': 'ISO', 'ECO:0000247': 'ISA', 'ECO:0000255': 'ISM', 'ECO:0000317': 'IGC',
+    'ECO:0000304': 'TAS', 'ECO:0000303': 'NAS', 'ECO:0000305': 'IC', 'ECO:0000307': 'ND', 'ECO:0000501': 'IEA'
+}
+
 TAXID_2_ORG_FILE_NAME = {
     '9606': 'human',
     '10090': 'mouse'
 }
 
 
+def count_header_lines(path, prefix='!'):
+    """
+    Count the header lines at the beginning of a gzipped file.
+    """
+    n = 0
+    with gzip.open(path, 'rt') as f:
+        for line in f:
+            if not line.startswith(prefix):
+                break
+            n += 1
+    return n
+
+
+def read_gaf_associations(gaf_file, taxids, db='UniProtKB', chunksize=1000000):
+    """
+    Read the associations of a list of taxids from a GAF file.
+
+    The file is read in chunks with pandas, only the needed columns are loaded (see GAF_USE_COLUMNS) and
+    the lines are filtered for DB and taxid with vectorized operations. For interactions the taxon column
+    contains two taxids ('taxon:9606|taxon:11676'), the first one is used.
+
+    :param gaf_file: Path of the gzipped GAF file.
+    :param taxids: List of taxids.
+    :param db: Only return associations of this DB.
+    :param chunksize: Number of lines per chunk.
+    :return: Iterator of DataFrames with the columns 'db_id', 'qualifier', 'go_id', 'reference', 'evidence',
+        'assigned_by' and 'taxid'.
+    """
+    reader = pandas.read_csv(
+        gaf_file, sep='\t', header=None, usecols=list(GAF_USE_COLUMNS),
+        skiprows=count_header_lines(gaf_file), dtype=str, keep_default_na=False, quoting=csv.QUOTE_NONE,
+        chunksize=chunksize
+    )
+
+    for df in reader:
+        df = df.rename(columns=GAF_USE_COLUMNS)
+        df = df[df['db'] == db]
+        # 'taxon:9606|taxon:11676' -> '9606'
+        taxid = df['taxon'].str.split('|', n=1).str[0].str.slice(6)
+        df = df.assign(taxid=taxid)[taxid.isin(taxids)]
+        if len(df):
+            yield df[['db_id', 'qualifier', 'go_id', 'reference', 'evidence', 'assigned_by', 'taxid']].fillna('')
+
+
+def read_gpi_taxids(gpi_file, taxids, db='UniProtKB', chunksize=1000000):
+    """
+    Get the taxids of the gene products in a GPI file and the parents of isoforms.
+
+    Only the products of the requested taxids are kept. The taxid strings are shared, the index needs one
+    dictionary entry per product.
+
+    :param gpi_file: Path of the gzipped GPI file.
+    :param taxids: List of taxids.
+    :param db: Only return products of this DB.
+    :param chunksize: Number of lines per chunk.
+    :return: Tuple of dictionaries (DB_Object_ID -> taxid, isoform DB_Object_ID -> parent DB_Object_ID).
+    """
+    reader = pandas.read_csv(
+        gpi_file, sep='\t', header=None, usecols=list(GPI_USE_COLUMNS),
+        skiprows=count_header_lines(gpi_file), dtype=str, keep_default_na=False, quoting=csv.QUOTE_NONE,
+        chunksize=chunksize
+    )
+
+    product_taxids = {}
+    product_parents = {}
+    for df in reader:
+        df = df.rename(columns=GPI_USE_COLUMNS)
+        df = df[df['db'] == db]
+        df = df[df['taxon'].str.slice(6).isin(taxids)]
+        taxid = df['taxon'].str.slice(6)
+        for this_taxid in taxids:
+            product_taxids.update(dict.fromkeys(df['db_id'][taxid == this_taxid], this_taxid))
+
+        # 'UniProtKB:Q4VCS5' -> 'Q4VCS5'
+        isoforms = df[df['parent'] != '']
+        product_parents.update(zip(isoforms['db_id'], isoforms['parent'].str.split(':', n=1).str[-1]))
+
+    log.info("Found {} products ({} isoforms) in {}".format(len(product_taxids), len(product_parents), gpi_file))
+    return product_taxids, product_parents
+
+
+def read_gpa_associations(gpa_file, product_taxids, product_parents=None, db='UniProtKB', chunksize=1000000):
+    """
+    Read the associations of a GPA file and join them with the product taxids from the GPI file.
+
+    The file is read in chunks with pandas like `read_gaf_associations`, the join is a vectorized lookup
+    of the DB_Object_ID in `product_taxids`, associations of other products are dropped. The values are
+    converted to the GAF vocabulary, the output has the same meaning as `read_gaf_associations`:
+
+    - isoforms (P12345-2) are replaced by the canonical accession (the GPI parent) like in GAF column 2
+    - qualifiers are kept as they are, GPA and GAF 2.2 both use the relation ('enables', 'NOT|located_in')
+    - the GO evidence code is taken from the annotation properties ('go_evidence=IEA'), if it is missing
+      the default GO code of the ECO code is used (see ECO_2_GO_EVIDENCE), '' if there is none
+
+    :param gpa_file: Path of the gzipped GPA file.
+    :param product_taxids: Dictionary DB_Object_ID -> taxid (see `read_gpi_taxids`).
+    :param product_parents: Dictionary isoform DB_Object_ID -> parent DB_Object_ID (see `read_gpi_taxids`).
+    :param db: Only return associations of this DB.
+    :param chunksize: Number of lines per chunk.
+    :return: Iterator of DataFrames with the same columns as `read_gaf_associations`.
+    """
+    reader = pandas.read_csv(
+        gpa_file, sep='\t', header=None, usecols=list(GPA_USE_COLUMNS),
+        skiprows=count_header_lines(gpa_file), dtype=str, keep_default_na=False, quoting=csv.QUOTE_NONE,
+        chunksize=chunksize
+    )
+
+    for df in reader:
+        df = df.rename(columns=GPA_USE_COLUMNS)
+        df = df[df['db'] == db]
+        taxid = df['db_id'].map(product_taxids)
+        df = df.assign(taxid=taxid)[taxid.notna()]
+        if len(df):
+            if product_parents:
+                df = df.assign(db_id=df['db_id'].map(product_parents).fillna(df['db_id']))
+            evidence = df['properties'].str.extract(r'go_evidence=([^|]+)', expand=False)
+            df = df.assign(evidence=evidence.fillna(df['eco'].map(ECO_2_GO_EVIDENCE)))
+            yield df[['db_id', 'qualifier', 'go_id', 'reference', 'evidence', 'assigned_by', 'taxid']].fillna('')
+
+
+def _count_values(values):
+    counts = Counter(values)
+    return list(counts), list(counts.values())
+
+
+def aggregate_associations(df):
+    """
+    Collapse the associations to one row per (taxid, protein, GO term, qualifier).
+
+    Evidence codes, references (a GAF line can have several references separated by '|') and assigned_by
+    become lists of unique values with a list of counts in the same order:
+
+        db_id   go_id       qualifier   evidence    evidence_count  references              assigned_by     count
+        P31946  GO:0005829              [IDA, TAS]  [2, 1]          [PMID:1, PMID:2, ...]   [HPA, Reactome] 3
+
+    :param df: DataFrame from `read_gaf_associations`.
+    :return: Aggregated DataFrame.
+    """
+    grouped = df.groupby(['taxid', 'db_id', 'go_id', 'qualifier'], sort=False)
+    agg = grouped.agg(evidence=('evidence', list), references=('reference', list),
+                      assigned_by=('assigned_by', list), count=('go_id', 'size')).reset_index()
+
+    evidence = agg['evidence'].map(_count_values)
+    agg['evidence'] = evidence.str[0]
+    agg['evidence_count'] = evidence.str[1]
+    references = agg['references'].map(lambda values: _count_values(r for v in values for r in v.split('|') if r))
+    agg['references'] = references.str[0]
+    agg['references_count'] = references.str[1]
+    assigned_by = agg['assigned_by'].map(_count_values)
+    agg['assigned_by'] = assigned_by.str[0]
+    agg['assigned_by_count'] = assigned_by.str[1]
+
+    return agg
+
+
+def aggregate_association_chunks(dfs):
+    """
+    Aggregate associations that are read in chunks (see `aggregate_associations`).
+
+    Each chunk is aggregated on its own and the partial groups are merged, the lines of a protein/term pair
+    can be in different chunks. Memory grows with the number of (taxid, protein, GO term, qualifier) groups,
+    not with the number of lines.
+
+    :param dfs: Iterator of DataFrames from `read_gaf_associations` or `read_gpa_associations`.
+    :return: Aggregated DataFrame with the same columns as `aggregate_associations`.
+    """
+    keys = ['taxid', 'db_id', 'go_id', 'qualifier']
+    counted = ['evidence', 'references', 'assigned_by']
+
+    # group key -> [evidence Counter, references Counter, assigned_by Counter, count]
+    groups = {}
+    for df in dfs:
+        agg = aggregate_associations(df)
+        columns = [agg[k] for k in keys] + [agg[c] for c in counted] + [agg['{}_count'.format(c)] for c in counted]
+        for row in zip(*columns, agg['count']):
+            key = row[:4]
+            partial = [Counter(dict(zip(values, counts))) for values, counts in zip(row[4:7], row[7:10])]
+            group = groups.get(key)
+            if group is None:
+                groups[key] = partial + [row[10]]
+            else:
+                for counter, other in zip(group, partial):
+                    counter.update(other)
+                group[3] += row[10]
+
+    data = {k: [key[i] for key in groups] for i, k in enumerate(keys)}
+    for i, c in enumerate(counted):
+        data[c] = [list(group[i]) for group in groups.values()]
+        data['{}_count'.format(c)] = [list(group[i].values()) for group in groups.values()]
+    data['count'] = [group[3] for group in groups.values()]
+
+    return pandas.DataFrame(data, columns=keys + counted + ['count'] + ['{}_count'.format(c) for c in counted])
+
+
+def resolve_with(resolvers, accessions):
+    """
+    :param resolvers: List of `UniprotAccessionResolver`, applied in turn.
+    :param accessions: List of accessions.
+    :return: List of resolved accessions.
+    """
+    for resolver in resolvers:
+        accessions = resolver.resolve(accessions)
+    return accessions
+
+
 class GeneOntologyAssociationParser(ReturnParser):
     """
     Parse GeneOntology Associations from the official UniProt association files.
@@ -28,9 +258,9 @@ class GeneOntologyAssociationParser(ReturnParser):
     The GAF file merges GPA and GPI (by adding the gene product information to each line with an association)
     and thus contains a lot of redundant information on the gene product.
 
-    The GAF file is parsed for the mappings because it contains the mapping as well as the taxonomy ID. It is
-    easier to iterate one file instead of generating a gene product - taxonomy ID mapping from the GPI file and
-    then read the GPA file.
+    By default the GAF file is parsed for the mappings because it contains the mapping as well as the taxonomy ID.
+    It is easier to iterate one file instead of generating a gene product - taxonomy ID mapping from the GPI file
+    and then read the GPA file.
 
     More information from the header of the GPA file:
 
@@ -74,7 +304,14 @@ class GeneOntologyAssociationParser(ReturnParser):
     !   DB_Xref(s)             optional  0 or greater  -             WB:WBGene00000035
     !   Properties             optional  0 or greater  -             db_subset=Swiss-Prot|target_set=KRUK,BHFL
 
+    With `gpa` set the parser reads the smaller GPA file instead and gets the taxids of the gene products from
+    the GPI file (see `read_gpi_taxids` and `read_gpa_associations`).
+
+    The parser can run on a list of taxids. Taxids without organism specific file are read from
+    goa_uniprot_all.gaf.gz (or its taxid shards) in one pass, each taxid gets its own RelationshipSet (see
+    `biomedgraph.parser.helper.taxid.taxid_sets`).
     """
+    SETS = ['protein_associates_goterm']
 
 
     def __init__(self):
@@ -82,48 +319,142 @@ class GeneOntologyAssociationParser(ReturnParser):
 
         self.arguments = ['taxid']
 
+        # optional secondary -> primary UniProt accession index (see UniprotKnowledgebaseParser), the index is
+        # written per taxid: for several taxids use a list with the index of each taxid, accessions of taxids
+        # without index are not resolved
+        self.secondary_accession_index = None
+        # one relationship per (protein, GO term, qualifier) with lists of evidence codes, references and
+        # assigned_by (see `aggregate_associations`) instead of one relationship per GAF line
+        self.aggregate = False
+        # read the associations from the GPA and GPI files instead of the GAF file
+        self.gpa = False
+
         # RelationshipSets
-        self.protein_associates_goterm = RelationshipSet('ASSOCIATION', ['Protein'], ['Term'], ['sid'], ['sid'])
+        self.protein_associates_goterm, = self.create_sets()
+
+    @staticmethod
+    def create_sets():
+        protein_associates_goterm = RelationshipSet('ASSOCIATION', ['Protein'], ['Term'], ['sid'], ['sid'])
+        return protein_associates_goterm,
 
     def run_with_mounted_arguments(self):
         self.run(self.taxid)
 
     def run(self, ref_taxid):
+        """
+        :param ref_taxid: A taxid or a list of taxids.
+        """
         go_instance = self.get_instance_by_name('GeneOntology')
         log.debug("Run for {}".format(ref_taxid))
-        if ref_taxid in TAXID_2_ORG_FILE_NAME:
-            goa_uniprot_gaf_file_name = 'goa_{0}.gaf.gz'.format(TAXID_2_ORG_FILE_NAME[ref_taxid])
-            goa_uniprot_gaf_file = go_instance.get_file(goa_uniprot_gaf_file_name)
-        else:
-            goa_uniprot_gaf_file = go_instance.get_file('goa_uniprot_all.gaf.gz')
-
-        self.parse_goa_uniprot_gaf_file(goa_uniprot_gaf_file, ref_taxid)
-
-    def parse_goa_uniprot_gaf_file(self, goa_uniprot_gaf_file, ref_taxid):
-
-        with gzip.open(goa_uniprot_gaf_file, 'rt') as f:
-            for line in f:
-                if not line.startswith('!'):
-                    line = line.strip()
-                    flds = line.split('\t')
-                    db = flds[0]
-
-                    try:
-                        taxid = flds[12].split(':')[1]
-                    except IndexError:
-                        continue
-
-                    if taxid == ref_taxid:
-                        if db == 'UniProtKB':
-                            db_id = flds[1]
-                            qualifier = flds[3]
-                            go_id = flds[4]
-                            evidence = flds[6]
-
-                            rel_properties = {'evidence': evidence}
-                            if qualifier:
-                                rel_properties['qualifier'] = qualifier
-
-                            self.protein_associates_goterm.add_relationship(
-                                {'sid': db_id}, {'sid': go_id}, rel_properties
-                            )
+        taxids = taxid_list(ref_taxid)
+        sets_by_taxid = taxid_sets(self, taxids, self.SETS)
+
+        if self.gpa:
+            self.run_gpa(go_instance, taxids, sets_by_taxid)
+            return
+
+        # file -> taxids
+        files = {}
+        other_taxids = []
+        for taxid in taxids:
+            if taxid in TAXID_2_ORG_FILE_NAME:
+                goa_uniprot_gaf_file_name = 'goa_{0}.gaf.gz'.format(TAXID_2_ORG_FILE_NAME[taxid])
+                files[go_instance.get_file(goa_uniprot_gaf_file_name)] = [taxid]
+            else:
+                other_taxids.append(taxid)
+
+        if other_taxids:
+            # read the taxid shards if the file was sharded after download
+            files.update(get_shard_files(go_instance.get_file('goa_uniprot_all.gaf.gz'), other_taxids))
+
+        for goa_uniprot_gaf_file, file_taxids in files.items():
+            self.parse_goa_uniprot_gaf_file(goa_uniprot_gaf_file, file_taxids, sets_by_taxid)
+
+    def run_gpa(self, go_instance, taxids, sets_by_taxid):
+        """
+        Read the associations from the GPA/GPI files. The GPA file has no taxid column, all taxids without
+        organism specific file are read in one pass over goa_uniprot_all.gpa.gz
+        """
+        # file name prefix -> taxids
+        files = {}
+        for taxid in taxids:
+            if taxid in TAXID_2_ORG_FILE_NAME:
+                files['goa_{0}'.format(TAXID_2_ORG_FILE_NAME[taxid])] = [taxid]
+            else:
+                files.setdefault('goa_uniprot_all', []).append(taxid)
+
+        for file_name, file_taxids in files.items():
+            self.parse_goa_uniprot_gpa_file(
+                go_instance.get_file('{}.gpa.gz'.format(file_name)), go_instance.get_file('{}.gpi.gz'.format(file_name)),
+                file_taxids, sets_by_taxid
+            )
+
+    def parse_goa_uniprot_gaf_file(self, goa_uniprot_gaf_file, ref_taxid, sets_by_taxid=None):
+        """
+        :param goa_uniprot_gaf_file: Path of the GAF file.
+        :param ref_taxid: A taxid or a list of taxids.
+        :param sets_by_taxid: Output sets by taxid, the sets of the parser if None.
+        """
+        taxids = taxid_list(ref_taxid)
+        self.add_associations(read_gaf_associations(goa_uniprot_gaf_file, taxids), taxids, sets_by_taxid)
+
+    def parse_goa_uniprot_gpa_file(self, goa_uniprot_gpa_file, goa_uniprot_gpi_file, ref_taxid, sets_by_taxid=None):
+        """
+        :param goa_uniprot_gpa_file: Path of the GPA file.
+        :param goa_uniprot_gpi_file: Path of the GPI file.
+        :param ref_taxid: A taxid or a list of taxids.
+        :param sets_by_taxid: Output sets by taxid, the sets of the parser if None.
+        """
+        taxids = taxid_list(ref_taxid)
+        product_taxids, product_parents = read_gpi_taxids(goa_uniprot_gpi_file, taxids)
+        self.add_associations(read_gpa_associations(goa_uniprot_gpa_file, product_taxids, product_parents), taxids,
+                              sets_by_taxid)
+
+    def add_associations(self, dfs, taxids, sets_by_taxid=None):
+        """
+        :param dfs: Iterator of DataFrames from `read_gaf_associations` or `read_gpa_associations`.
+        :param taxids: List of taxids.
+        :param sets_by_taxid: Output sets by taxid, the sets of the parser if None.
+        """
+        if sets_by_taxid is None:
+            sets_by_taxid = {taxid: (self.protein_associates_goterm,) for taxid in taxids}
+
+        # the indexes are opened once per run, not per chunk
+        if self.secondary_accession_index:
+            index_paths = [self.secondary_accession_index] if isinstance(self.secondary_accession_index, str) \
+                else self.secondary_accession_index
+            resolvers = [UniprotAccessionResolver(path) for path in index_paths]
+            dfs = (df.assign(db_id=resolve_with(resolvers, df['db_id'].tolist())) for df in dfs)
+
+        if self.aggregate:
+            self.add_aggregated_associations(aggregate_association_chunks(dfs), sets_by_taxid)
+            return
+
+        for df in dfs:
+            for db_id, qualifier, go_id, evidence, taxid in zip(
+                    df['db_id'], df['qualifier'], df['go_id'], df['evidence'], df['taxid']):
+                rel_properties = {'evidence': evidence}
+                if qualifier:
+                    rel_properties['qualifier'] = qualifier
+
+                protein_associates_goterm, = sets_by_taxid[taxid]
+                protein_associates_goterm.add_relationship(
+                    {'sid': db_id}, {'sid': go_id}, rel_properties
+                )
+
+    @staticmethod
+    def add_aggregated_associations(df, sets_by_taxid):
+        properties = ['evidence', 'evidence_count', 'references', 'references_count', 'assigned_by',
+                      'assigned_by_count', 'count']
+
+        for row in zip(df['taxid'], df['db_id'], df['go_id'], df['qualifier'], *(df[p] for p in properties)):
+            taxid, db_id, go_id, qualifier = row[:4]
+            rel_properties = dict(zip(properties, row[4:]))
+            rel_properties['count'] = int(rel_properties['count'])
+            if qualifier:
+                rel_properties['qualifier'] = qualifier
+
+            protein_associates_goterm, = sets_by_taxid[taxid]
+            protein_associates_goterm.add_relationship(
+                {'sid': db_id}, {'sid': go_id}, rel_properties
+            )
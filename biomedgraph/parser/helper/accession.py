@@ -0,0 +1,199 @@
+from array import array
+
+# layout of an encoded accession (63 bits, the sign bit is not used):
+#   10 bits prefix code | 4 bits number of digits | 49 bits number
+PREFIX_BITS = 10
+DIGIT_BITS = 4
+NUMBER_BITS = 49
+MAX_DIGITS = 14
+# prefix code of plain numbers (e.g. NCBI Gene IDs), 2-letter prefixes use the codes 0-675
+NO_PREFIX = (1 << PREFIX_BITS) - 1
+
+# 'NM_' -> prefix code shifted into place
+_PREFIXES = {
+    a + b + '_': ((ord(a) - 65) * 26 + ord(b) - 65) << (DIGIT_BITS + NUMBER_BITS)
+    for a in 'ABCDEFGHIJKLMNOPQRSTUVWXYZ' for b in 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+}
+_NO_PREFIX = NO_PREFIX << (DIGIT_BITS + NUMBER_BITS)
+
+
+def encode_accession(accession):
+    """
+    Pack an accession into a 63-bit integer.
+
+    Supported are accessions with a 2-letter prefix and a number (e.g. RefSeq 'NM_001098405') and plain
+    numbers (e.g. NCBI Gene ID '100008586'). Leading zeros are kept by storing the number of digits.
+
+        encode_accession('NM_001098405')
+        > 3157586288741237413
+        decode_accession(3157586288741237413)
+        > 'NM_001098405'
+
+    :param accession: The accession.
+    :return: The code or None if the accession can not be encoded.
+    """
+    prefix = _PREFIXES.get(accession[:3])
+    if prefix is None:
+        prefix = _NO_PREFIX
+        digits = accession
+    else:
+        digits = accession[3:]
+
+    # isdigit() is True for some non-ASCII digits
+    if 0 < len(digits) <= MAX_DIGITS and digits.isdigit() and digits.isascii():
+        return prefix | (len(digits) << NUMBER_BITS) | int(digits)
+    return None
+
+
+def decode_accession(code):
+    """
+    Unpack an accession encoded with `encode_accession`.
+
+    :param code: The code.
+    :return: The accession.
+    """
+    prefix = code >> (DIGIT_BITS + NUMBER_BITS)
+    n_digits = (code >> NUMBER_BITS) & ((1 << DIGIT_BITS) - 1)
+    number = str(code & ((1 << NUMBER_BITS) - 1)).zfill(n_digits)
+    if prefix == NO_PREFIX:
+        return number
+    return chr(prefix // 26 + 65) + chr(prefix % 26 + 65) + '_' + number
+
+
+class AccessionSet:
+    """
+    Set of accessions stored as packed 64-bit integers (see `encode_accession`).
+
+    The codes are kept in an open addressing hash table backed by an `array` of unsigned 64-bit integers,
+    an accession needs 12-24 bytes instead of ~100 bytes for a `str` in a `set`. Accessions that can not
+    be encoded are kept as strings.
+
+    The set supports `add`, `in` and `len`, it can replace the `set` of accessions used to filter
+    duplicates in the parsers:
+
+        check_transcripts = AccessionSet()
+        if refseq_acc not in check_transcripts:
+            ...
+            check_transcripts.add(refseq_acc)
+    """
+    # the table grows when it is 70% full
+    MAX_LOAD = 0.7
+
+    def __init__(self, capacity=1024):
+        """
+        :param capacity: Number of codes the set can hold before the table grows.
+        """
+        self._fallback = set()
+        self._size = 0
+        self._init_table(capacity)
+
+    def _init_table(self, capacity):
+        bits = max(int(capacity / self.MAX_LOAD), 1).bit_length()
+        self._mask = (1 << bits) - 1
+        self._table = array('Q', bytes(8 << bits))
+
+    def _slot(self, code):
+        """
+        Find the slot of a code, or the empty slot where it would be inserted (codes are never 0).
+        """
+        table = self._table
+        mask = self._mask
+        i = (code ^ (code >> 31)) & mask
+        while True:
+            c = table[i]
+            if c == code or not c:
+                return i
+            i = (i + 1) & mask
+
+    def add(self, item):
+        code = encode_accession(item)
+        if code is None:
+            self._fallback.add(item)
+            return
+        i = self._slot(code)
+        if not self._table[i]:
+            self._table[i] = code
+            self._size += 1
+            if self._size > self.MAX_LOAD * len(self._table):
+                self._grow()
+
+    def _grow(self):
+        old_table = self._table
+        self._init_table(2 * self._size)
+        table = self._table
+        for code in old_table:
+            if code:
+                table[self._slot(code)] = code
+
+    def __contains__(self, item):
+        code = encode_accession(item)
+        if code is None:
+            return item in self._fallback
+        return self._table[self._slot(code)] == code
+
+    def __len__(self):
+        return self._size + len(self._fallback)
+
+
+class AccessionPairSet(AccessionSet):
+    """
+    Set of accession pairs (e.g. gene/transcript relationships), stored as two packed 64-bit integers.
+
+        check_set = AccessionPairSet()
+        check_set.add(('100008586', 'NM_001098405'))
+        ('100008586', 'NM_001098405') in check_set
+        > True
+    """
+
+    def _init_table(self, capacity):
+        super(AccessionPairSet, self)._init_table(capacity)
+        # the first code is stored in `_table`, the second in `_second`
+        self._second = array('Q', bytes(8 * len(self._table)))
+
+    def _encode(self, item):
+        a = encode_accession(item[0])
+        if a is None:
+            return None
+        b = encode_accession(item[1])
+        if b is None:
+            return None
+        return a, b
+
+    def _slot(self, code):
+        a, b = code
+        table = self._table
+        second = self._second
+        mask = self._mask
+        i = (a ^ (a >> 31) ^ (b * 31) ^ (b >> 31)) & mask
+        while True:
+            c = table[i]
+            if not c or (c == a and second[i] == b):
+                return i
+            i = (i + 1) & mask
+
+    def add(self, item):
+        code = self._encode(item)
+        if code is None:
+            self._fallback.add(item)
+            return
+        i = self._slot(code)
+        if not self._table[i]:
+            self._table[i], self._second[i] = code
+            self._size += 1
+            if self._size > self.MAX_LOAD * len(self._table):
+                self._grow()
+
+    def _grow(self):
+        old_table, old_second = self._table, self._second
+        self._init_table(2 * self._size)
+        for code in zip(old_table, old_second):
+            if code[0]:
+                i = self._slot(code)
+                self._table[i], self._second[i] = code
+
+    def __contains__(self, item):
+        code = self._encode(item)
+        if code is None:
+            return item in self._fallback
+        i = self._slot(code)
+        return self._table[i] == code[0] and self._second[i] == code[1]
@@ -0,0 +1,167 @@
+import logging
+
+import numpy
+
+from biomedgraph.parser.helper.lookup import Lookup, write_lookup
+
+log = logging.getLogger(__name__)
+
+PRIMARY = 'primary'
+SYNONYM = 'synonym'
+PREVIOUS = 'previous'
+
+# a gene keeps the best status if a symbol is found more than once for the gene
+STATUS_RANK = {PRIMARY: 0, SYNONYM: 1, PREVIOUS: 2}
+
+
+def symbol_key(taxid, symbol):
+    return '{}\t{}'.format(taxid, symbol)
+
+
+def read_gene_info_symbols(gene_info_lines, taxid):
+    """
+    Get the gene symbols from NCBI gene_info.
+
+    :param gene_info_lines: Iterable of gene_info lines (e.g. a file handle in text mode).
+    :param taxid: Only return symbols of this taxid.
+    :return: Iterator of (taxid, symbol, NCBI Gene ID, status, source) tuples.
+    """
+    prefix = '{}\t'.format(taxid)
+    for l in gene_info_lines:
+        if l.startswith(prefix):
+            flds = l.split('\t', 5)
+            gene_id = flds[1]
+            if flds[2] != '-':
+                yield taxid, flds[2], gene_id, PRIMARY, 'ncbigene'
+            for synonym in flds[4].split('|'):
+                if synonym != '-':
+                    yield taxid, synonym, gene_id, SYNONYM, 'ncbigene'
+
+
+def _hgnc_list(value):
+    return [v for v in value.strip('"').split('|') if v]
+
+
+def read_hgnc_symbols(hgnc_lines):
+    """
+    Get the gene symbols from the HGNC hgnc_complete_set.txt file, the symbols are mapped to NCBI Gene IDs.
+
+    Approved symbols are 'primary', aliases 'synonym' and previous symbols 'previous'. Genes without
+    NCBI Gene ID are skipped.
+
+    :param hgnc_lines: Iterable of lines (e.g. a file handle in text mode).
+    :return: Iterator of (taxid, symbol, NCBI Gene ID, status, source) tuples.
+    """
+    lines = iter(hgnc_lines)
+    header = next(lines).rstrip('\n').split('\t')
+    symbol_index = header.index('symbol')
+    alias_index = header.index('alias_symbol')
+    prev_index = header.index('prev_symbol')
+    entrez_index = header.index('entrez_id')
+
+    for l in lines:
+        flds = l.rstrip('\n').split('\t')
+        if len(flds) <= entrez_index or not flds[entrez_index]:
+            continue
+        gene_id = flds[entrez_index]
+
+        yield '9606', flds[symbol_index], gene_id, PRIMARY, 'hgnc'
+        for symbol in _hgnc_list(flds[alias_index]):
+            yield '9606', symbol, gene_id, SYNONYM, 'hgnc'
+        for symbol in _hgnc_list(flds[prev_index]):
+            yield '9606', symbol, gene_id, PREVIOUS, 'hgnc'
+
+
+def write_gene_symbol_index(path, rows):
+    """
+    Write an index of (taxid, symbol) -> genes.
+
+    The index has one row per symbol and gene with the status of the symbol for the gene. For each symbol
+    the resolved gene is stored as well: the gene with the symbol as primary symbol or, if no gene has the
+    symbol as primary symbol, the only gene with the symbol as synonym or previous symbol. Symbols used by
+    more than one gene are ambiguous, they have more than one row.
+
+    :param path: Target directory.
+    :param rows: Iterable of (taxid, symbol, gene ID, status, source) tuples, e.g. from `read_gene_info_symbols`
+        and `read_hgnc_symbols`.
+    """
+    # key -> gene -> (status, source)
+    symbols = {}
+    for taxid, symbol, gene_id, status, source in rows:
+        genes = symbols.setdefault(symbol_key(taxid, symbol), {})
+        if gene_id not in genes or STATUS_RANK[status] < STATUS_RANK[genes[gene_id][0]]:
+            genes[gene_id] = (status, source)
+
+    keys = []
+    columns = {'gene': [], 'status': [], 'source': [], 'resolved': []}
+    for key, genes in symbols.items():
+        primary = [gene_id for gene_id, (status, _) in genes.items() if status == PRIMARY]
+        candidates = primary or list(genes)
+        resolved = candidates[0] if len(candidates) == 1 else ''
+
+        for gene_id, (status, source) in genes.items():
+            keys.append(key)
+            columns['gene'].append(gene_id)
+            columns['status'].append(status)
+            columns['source'].append(source)
+            columns['resolved'].append(resolved)
+
+    write_lookup(path, keys, columns)
+
+
+class GeneSymbolResolver:
+    """
+    Resolve gene symbols to NCBI Gene IDs without the database.
+
+    The resolver uses the index written by `NcbiGeneParser` (`build_symbol_index`), queries are answered
+    in batches:
+
+        resolver = GeneSymbolResolver(path)
+        resolver.resolve('9606', ['TP53', 'P53', 'NOT_A_GENE'])
+        > ['7157', '7157', None]
+        resolver.matches('9606', ['TP53'])
+        > [[('7157', 'primary', 'ncbigene')]]
+    """
+
+    def __init__(self, path):
+        """
+        :param path: Directory of the index.
+        """
+        self.lookup = Lookup(path)
+
+    def resolve(self, taxid, symbols):
+        """
+        Resolve a list of symbols.
+
+        :param taxid: The taxid.
+        :param symbols: List of symbols.
+        :return: List of NCBI Gene IDs, None if a symbol is not found or can not be resolved to one gene.
+        """
+        starts, ends = self.lookup.ranges([symbol_key(taxid, symbol) for symbol in symbols])
+        found = numpy.nonzero(ends > starts)[0]
+        values = self.lookup.column('resolved')[starts[found]]
+
+        result = [None] * len(symbols)
+        for i, value in zip(found, values):
+            if value:
+                result[i] = value.decode()
+        return result
+
+    def is_ambiguous(self, taxid, symbols):
+        """
+        :param taxid: The taxid.
+        :param symbols: List of symbols.
+        :return: List of booleans, True if a symbol is used by more than one gene.
+        """
+        starts, ends = self.lookup.ranges([symbol_key(taxid, symbol) for symbol in symbols])
+        return [bool(n > 1) for n in ends - starts]
+
+    def matches(self, taxid, symbols):
+        """
+        Get all genes of a list of symbols.
+
+        :param taxid: The taxid.
+        :param symbols: List of symbols.
+        :return: List with a list of (gene ID, status, source) tuples per symbol.
+        """
+        return self.lookup.get_all([symbol_key(taxid, symbol) for symbol in symbols], ['gene', 'status', 'source'])
@@ -0,0 +1,311 @@
+import gzip
+import logging
+from time import perf_counter
+
+log = logging.getLogger(__name__)
+
+# the first 8 columns of a GTF/GFF file
+GTF_COLUMNS = ['chr', 'source', 'type', 'start', 'end', 'score', 'strand', 'frame']
+
+
+def open_text(path):
+    """
+    Open a text file, gzipped or not.
+
+    :param path: Path to the file.
+    :return: File handle in text mode.
+    """
+    with open(path, 'rb') as f:
+        gzipped = f.read(2) == b'\x1f\x8b'
+    if gzipped:
+        return gzip.open(path, 'rt')
+    return open(path, 'rt')
+
+
+def get_gtf_attribute(attributes, key):
+    """
+    Get the value of a single key from a GTF attribute column without parsing the full column.
+
+        gene_id "ENSG00000223972"; gene_version "5"; gene_name "DDX11L1";
+
+    :param attributes: The attribute column.
+    :param key: The attribute key.
+    :return: The value or None if the key is not found.
+    """
+    needle = key + ' "'
+    i = attributes.find(needle)
+    # make sure the match is not the end of a longer key (e.g. 'havana_gene_id')
+    while i > 0 and attributes[i - 1] != ' ':
+        i = attributes.find(needle, i + 1)
+    if i == -1:
+        return None
+    start = i + len(needle)
+    return attributes[start:attributes.find('"', start)]
+
+
+def get_gff3_attribute(attributes, key):
+    """
+    Get the value of a single key from a GFF3 attribute column without parsing the full column.
+
+        ID=lnc-TOX3-1:20;gene_id=lnc-TOX3-1;transcript_id=lnc-TOX3-1:20;
+
+    :param attributes: The attribute column.
+    :param key: The attribute key.
+    :return: The value or None if the key is not found.
+    """
+    needle = key + '='
+    i = attributes.find(needle)
+    while i > 0 and attributes[i - 1] != ';':
+        i = attributes.find(needle, i + 1)
+    if i == -1:
+        return None
+    start = i + len(needle)
+    end = attributes.find(';', start)
+    if end == -1:
+        end = len(attributes)
+    return attributes[start:end]
+
+
+def parse_gtf_attributes(attributes):
+    """
+    Parse a full GTF attribute column into a dictionary.
+
+    :param attributes: The attribute column.
+    :return: Dictionary of attributes.
+    """
+    parsed = {}
+    for element in attributes.split(';'):
+        element = element.strip()
+        if element:
+            k, _, v = element.partition(' ')
+            parsed[k] = v.strip('"')
+    return parsed
+
+
+def parse_gff3_attributes(attributes):
+    """
+    Parse a full GFF3 attribute column into a dictionary.
+
+    :param attributes: The attribute column.
+    :return: Dictionary of attributes.
+    """
+    parsed = {}
+    for element in attributes.strip().split(';'):
+        if element:
+            k, _, v = element.partition('=')
+            parsed[k] = v
+    return parsed
+
+
+class GtfColumnReader:
+    """
+    Read a GTF/GFF3 file in batches of columns.
+
+    The reader is built for files where only a few feature types and attribute keys are needed:
+
+    - lines are filtered on the feature type column before the attribute column is touched
+    - only the requested attribute keys are extracted from the attribute column
+
+    Each batch is a dictionary of column name -> list. The lists contain the 8 fixed columns
+    (see `GTF_COLUMNS`, start/end as int), one column per requested attribute key (None if missing)
+    and, if `all_attributes` or `attribute_prefixes` are passed, a column 'attributes' with a
+    dictionary per record.
+
+        reader = GtfColumnReader(gtf_file)
+        for batch in reader.batches(types=['transcript'], attributes=['gene_id', 'transcript_id']):
+            for gene_id, transcript_id in zip(batch['gene_id'], batch['transcript_id']):
+                ...
+    """
+
+    def __init__(self, path, gff3=None):
+        """
+        :param path: Path to the GTF/GFF3 file (can be gzipped).
+        :param gff3: Attribute format is GFF3 (key=value;) instead of GTF (key "value";). Guessed from
+            the file name if not set.
+        """
+        self.path = path
+        if gff3 is None:
+            gff3 = '.gff' in path.lower()
+        self.gff3 = gff3
+
+        if self.gff3:
+            self._get_attribute = get_gff3_attribute
+            self._parse_attributes = parse_gff3_attributes
+        else:
+            self._get_attribute = get_gtf_attribute
+            self._parse_attributes = parse_gtf_attributes
+
+    def batches(self, types=None, attributes=None, attribute_prefixes=None, all_attributes=False,
+                batch_size=100000):
+        """
+        Iterate the file in batches of columns.
+
+        :param types: Feature types to return (e.g. ['gene', 'transcript']), all types if None.
+        :param attributes: List of attribute keys to extract into their own columns.
+        :param attribute_prefixes: Return all attributes with one of these key prefixes in the
+            'attributes' column (e.g. ['gene_alias']).
+        :param all_attributes: Return all attributes in the 'attributes' column.
+        :param batch_size: Number of records per batch.
+        """
+        types = set(types) if types is not None else None
+        keys = list(attributes) if attributes else []
+        prefixes = tuple(attribute_prefixes) if attribute_prefixes else None
+        with_dicts = all_attributes or prefixes is not None
+
+        get_attribute = self._get_attribute
+        parse_attributes = self._parse_attributes
+
+        batch = self._empty_batch(keys, with_dicts)
+        n = 0
+
+        with open_text(self.path) as f:
+            for line in f:
+                if line.startswith('#'):
+                    continue
+                flds = line.rstrip('\n').split('\t', 8)
+                if len(flds) < 9:
+                    continue
+
+                feature_type = flds[2]
+                if types is not None and feature_type not in types:
+                    continue
+
+                batch['chr'].append(flds[0])
+                batch['source'].append(flds[1])
+                batch['type'].append(feature_type)
+                batch['start'].append(int(flds[3]))
+                batch['end'].append(int(flds[4]))
+                batch['score'].append(flds[5])
+                batch['strand'].append(flds[6])
+                batch['frame'].append(flds[7])
+
+                attribute_column = flds[8]
+                if with_dicts:
+                    parsed = parse_attributes(attribute_column)
+                    for key in keys:
+                        batch[key].append(parsed.get(key))
+                    if prefixes is not None and not all_attributes:
+                        parsed = {k: v for k, v in parsed.items() if k.startswith(prefixes)}
+                    batch['attributes'].append(parsed)
+                else:
+                    for key in keys:
+                        batch[key].append(get_attribute(attribute_column, key))
+
+                n += 1
+                if n == batch_size:
+                    yield batch
+                    batch = self._empty_batch(keys, with_dicts)
+                    n = 0
+
+        if n:
+            yield batch
+
+    @staticmethod
+    def _empty_batch(keys, with_dicts):
+        batch = {c: [] for c in GTF_COLUMNS}
+        for key in keys:
+            batch[key] = []
+        if with_dicts:
+            batch['attributes'] = []
+        return batch
+
+
+class GtfScan:
+    """
+    Feed the records of one GTF/GFF file to several consumers in a single pass.
+
+    Consumers register a handler which is called with every batch of a GtfColumnReader, together with
+    the feature types and attribute keys they need. The file is decompressed and tokenized only once, no
+    matter how many consumers are registered. The reader is set up with the union of all requests, a
+    handler can thus see records of types it did not ask for and has to filter on the 'type' column.
+
+    The time spent in each handler is collected in `timings`, the time spent reading and tokenizing
+    the file is stored under the key 'read'.
+
+        scan = GtfScan(gtf_file)
+        scan.register('genes', gene_handler, types=['gene'], attributes=['gene_id'])
+        scan.register('loci', locus_handler, all_attributes=True)
+        scan.run()
+    """
+
+    READ = 'read'
+
+    def __init__(self, gtf_file, batch_size=100000):
+        """
+        :param gtf_file: Path to the GTF/GFF file.
+        :param batch_size: Number of records per batch.
+        """
+        self.gtf_file = gtf_file
+        self.batch_size = batch_size
+        self.consumers = []
+        self.timings = {}
+
+        # union of all consumer requests
+        self.types = set()
+        self.attributes = set()
+        self.all_attributes = False
+
+    def register(self, name, handler, types=None, attributes=None, all_attributes=False):
+        """
+        Register a consumer.
+
+        :param name: Name of the consumer, used to report timings.
+        :param handler: Function that is called with each batch.
+        :param types: Feature types the consumer needs, all if None.
+        :param attributes: List of attribute keys the consumer needs.
+        :param all_attributes: The consumer needs the 'attributes' column with all attributes.
+        """
+        if name in self.timings or name == self.READ:
+            raise ValueError("Consumer {} already registered.".format(name))
+
+        self.consumers.append((name, handler))
+        self.timings[name] = 0.0
+
+        if self.types is not None:
+            self.types = None if types is None else self.types | set(types)
+        if attributes:
+            self.attributes |= set(attributes)
+        self.all_attributes = self.all_attributes or all_attributes
+
+    def run(self):
+        """
+        Read the file once and call all registered handlers for each batch.
+
+        :return: Dictionary of consumer name -> seconds spent in the handler.
+        """
+        log.info("Start scan of {} for {}".format(self.gtf_file, [name for name, _ in self.consumers]))
+
+        batches = GtfColumnReader(self.gtf_file).batches(
+            types=self.types, attributes=sorted(self.attributes), all_attributes=self.all_attributes,
+            batch_size=self.batch_size
+        )
+
+        timings = [0.0] * len(self.consumers)
+        handlers = [handler for _, handler in self.consumers]
+        read_time = 0.0
+
+        batches = iter(batches)
+        while True:
+            t0 = perf_counter()
+            try:
+                batch = next(batches)
+            except StopIteration:
+                read_time += perf_counter() - t0
+                break
+            t1 = perf_counter()
+            read_time += t1 - t0
+
+            for i, handler in enumerate(handlers):
+                handler(batch)
+                t2 = perf_counter()
+                timings[i] += t2 - t1
+                t1 = t2
+
+        self.timings[self.READ] = read_time
+        for (name, _), t in zip(self.consumers, timings):
+            self.timings[name] = t
+
+        for name, t in self.timings.items():
+            log.info("GTF scan time {}: {:.1f}s".format(name, t))
+
+        return self.timings
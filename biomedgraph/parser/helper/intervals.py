@@ -0,0 +1,226 @@
+import json
+import logging
+import os
+
+import numpy
+
+log = logging.getLogger(__name__)
+
+INDEX_FILE = 'index.json'
+
+# attribute that holds the ID of a GTF record, by feature type
+ID_ATTRIBUTES = {
+    'gene': 'gene_id',
+    'transcript': 'transcript_id',
+    'exon': 'exon_id',
+    'CDS': 'protein_id'
+}
+
+
+class IntervalIndexBuilder:
+    """
+    Collect genomic intervals and write them to an IntervalIndex directory.
+
+    Intervals are closed and 1-based like in GTF files. The builder can be registered as consumer
+    of a GtfScan:
+
+        builder = IntervalIndexBuilder(types=['gene', 'transcript'])
+        builder.register(scan)
+        scan.run()
+        builder.save(path)
+    """
+
+    def __init__(self, types=('gene', 'transcript')):
+        """
+        :param types: GTF feature types to add to the index.
+        """
+        self.types = list(types)
+        self.chromosomes = {}
+
+    def add(self, chr, start, end, id, feature_type):
+        """
+        Add one interval.
+
+        :param chr: Chromosome
+        :param start: Start position
+        :param end: End position
+        :param id: ID of the feature
+        :param feature_type: Type of the feature (e.g. 'gene')
+        """
+        if chr not in self.chromosomes:
+            self.chromosomes[chr] = ([], [], [], [])
+        starts, ends, ids, types = self.chromosomes[chr]
+        starts.append(start)
+        ends.append(end)
+        ids.append(id)
+        types.append(feature_type)
+
+    def register(self, scan):
+        """
+        Register the builder as consumer of a GtfScan.
+
+        :param scan: The GtfScan.
+        """
+        id_attributes = sorted(set(ID_ATTRIBUTES[t] for t in self.types))
+        scan.register(self.__class__.__name__, self.add_batch, types=self.types, attributes=id_attributes)
+
+    def add_batch(self, batch):
+        """
+        Add all records of the configured types from a GtfColumnReader batch.
+
+        :param batch: Batch of GTF records.
+        """
+        for i, feature_type in enumerate(batch['type']):
+            if feature_type in self.types:
+                self.add(batch['chr'][i], batch['start'][i], batch['end'][i],
+                         batch[ID_ATTRIBUTES[feature_type]][i], feature_type)
+
+    def save(self, path):
+        """
+        Write the index to a directory, one set of numpy arrays per chromosome.
+
+        :param path: Target directory.
+        """
+        os.makedirs(path, exist_ok=True)
+        index = {'chromosomes': {}}
+
+        for i, (chr, (starts, ends, ids, types)) in enumerate(sorted(self.chromosomes.items())):
+            starts = numpy.array(starts, dtype=numpy.int64)
+            order = numpy.argsort(starts, kind='stable')
+            starts = starts[order]
+            ends = numpy.array(ends, dtype=numpy.int64)[order]
+
+            arrays = {
+                'start': starts,
+                'end': ends,
+                # running maximum of the end positions, used to find the first candidate of a query
+                'max_end': numpy.maximum.accumulate(ends),
+                'id': numpy.array([x or '' for x in ids], dtype=numpy.bytes_)[order],
+                'type': numpy.array(types, dtype=numpy.bytes_)[order]
+            }
+            for name, array in arrays.items():
+                numpy.save(os.path.join(path, '{}.{}.npy'.format(i, name)), array)
+
+            index['chromosomes'][chr] = {'prefix': str(i), 'size': len(starts)}
+
+        with open(os.path.join(path, INDEX_FILE), 'wt') as f:
+            json.dump(index, f)
+
+        log.info("Wrote interval index with {} chromosomes to {}".format(len(self.chromosomes), path))
+
+
+class IntervalIndex:
+    """
+    Answer overlap queries for genomic intervals.
+
+    The index stores the intervals of each chromosome sorted by start position together with the running
+    maximum of the end positions. All intervals overlapping a query [start, end] are in the slice between
+    the first interval with `max_end >= start` and the last interval with `start <= end`, both are found
+    with a binary search. The arrays are memory-mapped, only the accessed pages are read from disk.
+
+        index = IntervalIndex(path)
+        index.overlaps('1', 11000, 12000)
+        > [('ENSG00000223972', 'gene', 11869, 14409), ...]
+    """
+
+    def __init__(self, path):
+        """
+        :param path: Directory written by IntervalIndexBuilder.save()
+        """
+        self.path = path
+        with open(os.path.join(path, INDEX_FILE), 'rt') as f:
+            self.chromosomes = json.load(f)['chromosomes']
+        self._arrays = {}
+
+    def _get(self, chr):
+        if chr not in self._arrays:
+            prefix = self.chromosomes[chr]['prefix']
+            self._arrays[chr] = {
+                name: numpy.load(os.path.join(self.path, '{}.{}.npy'.format(prefix, name)), mmap_mode='r')
+                for name in ['start', 'end', 'max_end', 'id', 'type']
+            }
+        return self._arrays[chr]
+
+    def overlap_positions(self, chr, start, end):
+        """
+        Get the positions of all intervals overlapping [start, end] in the arrays of a chromosome.
+
+        :param chr: Chromosome
+        :param start: Start position
+        :param end: End position
+        :return: numpy array of positions
+        """
+        if chr not in self.chromosomes:
+            return numpy.array([], dtype=numpy.int64)
+        arrays = self._get(chr)
+        lo = numpy.searchsorted(arrays['max_end'], start, side='left')
+        hi = numpy.searchsorted(arrays['start'], end, side='right')
+        if hi <= lo:
+            return numpy.array([], dtype=numpy.int64)
+        return lo + numpy.nonzero(arrays['end'][lo:hi] >= start)[0]
+
+    def overlaps(self, chr, start, end):
+        """
+        Get all intervals overlapping [start, end].
+
+        :param chr: Chromosome
+        :param start: Start position
+        :param end: End position
+        :return: List of (id, type, start, end) tuples
+        """
+        positions = self.overlap_positions(chr, start, end)
+        if not len(positions):
+            return []
+        return self._intervals(chr, positions)
+
+    def point(self, chr, position):
+        """
+        Get all intervals containing a position.
+
+        :param chr: Chromosome
+        :param position: The position
+        :return: List of (id, type, start, end) tuples
+        """
+        return self.overlaps(chr, position, position)
+
+    def batch_overlaps(self, chrs, starts, ends):
+        """
+        Get the overlapping intervals for many queries.
+
+        The binary searches are run vectorized for all queries on the same chromosome.
+
+        :param chrs: List of chromosomes
+        :param starts: List of start positions
+        :param ends: List of end positions
+        :return: List with one list of (id, type, start, end) tuples per query
+        """
+        chrs = numpy.asarray(chrs)
+        starts = numpy.asarray(starts, dtype=numpy.int64)
+        ends = numpy.asarray(ends, dtype=numpy.int64)
+
+        results = [[] for _ in range(len(chrs))]
+
+        for chr in numpy.unique(chrs):
+            chr = str(chr)
+            if chr not in self.chromosomes:
+                continue
+            arrays = self._get(chr)
+            query_positions = numpy.nonzero(chrs == chr)[0]
+            lo = numpy.searchsorted(arrays['max_end'], starts[query_positions], side='left')
+            hi = numpy.searchsorted(arrays['start'], ends[query_positions], side='right')
+
+            for q, l, h in zip(query_positions, lo, hi):
+                if h > l:
+                    positions = l + numpy.nonzero(arrays['end'][l:h] >= starts[q])[0]
+                    if len(positions):
+                        results[q] = self._intervals(chr, positions)
+
+        return results
+
+    def _intervals(self, chr, positions):
+        arrays = self._get(chr)
+        return [
+            (id.decode(), feature_type.decode(), int(start), int(end))
+            for id, feature_type, start, end in zip(arrays['id'][positions], arrays['type'][positions],
+                                                    arrays['start'][positions], arrays['end'][positions])
+        ]
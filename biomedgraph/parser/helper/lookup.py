@@ -0,0 +1,120 @@
+import json
+import logging
+import os
+
+import numpy
+
+log = logging.getLogger(__name__)
+
+INDEX_FILE = 'index.json'
+
+
+def _to_bytes_array(values):
+    return numpy.array([v.encode() for v in values], dtype=numpy.bytes_)
+
+
+def write_lookup(path, keys, columns):
+    """
+    Write a lookup table to a directory.
+
+    The keys are sorted and stored together with the value columns as numpy arrays. A key can occur
+    several times, e.g. a gene symbol that is used by several genes.
+
+    :param path: Target directory.
+    :param keys: List of keys (str).
+    :param columns: Dictionary of column name -> list of values (str), same length as `keys`.
+    """
+    os.makedirs(path, exist_ok=True)
+
+    keys = _to_bytes_array(keys)
+    order = numpy.argsort(keys, kind='stable')
+    numpy.save(os.path.join(path, 'keys.npy'), keys[order])
+
+    for name, values in columns.items():
+        if len(values) != len(keys):
+            raise ValueError("Column {} has {} values for {} keys.".format(name, len(values), len(keys)))
+        numpy.save(os.path.join(path, '{}.npy'.format(name)), _to_bytes_array(values)[order])
+
+    with open(os.path.join(path, INDEX_FILE), 'wt') as f:
+        json.dump({'columns': list(columns), 'size': len(keys)}, f)
+
+    log.info("Wrote lookup with {} keys to {}".format(len(keys), path))
+
+
+class Lookup:
+    """
+    Look up string keys in a table written by `write_lookup`.
+
+    The arrays are memory-mapped, only the accessed pages are read from disk. Queries are answered
+    with vectorized binary searches:
+
+        lookup = Lookup(path)
+        lookup.get(['A8K9K2', 'P00000'], 'primary')
+        > ['P31946', None]
+    """
+
+    def __init__(self, path):
+        """
+        :param path: Directory written by `write_lookup`.
+        """
+        self.path = path
+        with open(os.path.join(path, INDEX_FILE), 'rt') as f:
+            self.columns = json.load(f)['columns']
+        self.keys = numpy.load(os.path.join(path, 'keys.npy'), mmap_mode='r')
+        self._columns = {}
+
+    def column(self, name):
+        if name not in self._columns:
+            self._columns[name] = numpy.load(os.path.join(self.path, '{}.npy'.format(name)), mmap_mode='r')
+        return self._columns[name]
+
+    def ranges(self, keys):
+        """
+        Get the rows of a list of keys.
+
+        :param keys: List of keys.
+        :return: Tuple of numpy arrays (start, end), the rows of key i are start[i]:end[i].
+        """
+        encoded = [k.encode() for k in keys]
+        queries = numpy.array(encoded, dtype=numpy.bytes_)
+        starts = numpy.searchsorted(self.keys, queries, side='left')
+        ends = numpy.searchsorted(self.keys, queries, side='right')
+        # keys longer than the longest stored key would be truncated in the comparison
+        too_long = numpy.fromiter((len(k) > self.keys.itemsize for k in encoded), dtype=bool, count=len(encoded))
+        ends[too_long] = starts[too_long]
+        return starts, ends
+
+    def get(self, keys, column):
+        """
+        Get the value of a column for a list of keys.
+
+        :param keys: List of keys.
+        :param column: Name of the column.
+        :return: List of values, None for keys that are not found or found more than once.
+        """
+        starts, ends = self.ranges(keys)
+        unique = (ends - starts) == 1
+        values = self.column(column)[starts[unique]]
+
+        result = [None] * len(keys)
+        for i, value in zip(numpy.nonzero(unique)[0], values):
+            result[i] = value.decode()
+        return result
+
+    def get_all(self, keys, columns):
+        """
+        Get all rows for a list of keys.
+
+        :param keys: List of keys.
+        :param columns: List of column names.
+        :return: List with a list of value tuples per key (empty if the key is not found).
+        """
+        starts, ends = self.ranges(keys)
+        arrays = [self.column(c) for c in columns]
+        return [
+            [tuple(a[i].decode() for a in arrays) for i in range(start, end)]
+            for start, end in zip(starts, ends)
+        ]
+
+    def __len__(self):
+        return len(self.keys)
@@ -1,47 +1,91 @@
-import os
+import io
 import logging
 import re
+from datetime import datetime
+
+import pronto
 
 log = logging.getLogger(__name__)
 
 
-def clean_obo_file(obofile):
+def iter_clean_obo_lines(lines):
     """
-    Clean format problems.
+    Clean format problems in the lines of an OBO file (see `remove_space_from_xref`).
 
-    :param obofile: Path to OBO file.
-    :return: Path to cleaned file.
+    The header is not changed. Only lines that can contain xrefs (with ']' or 'xref: ') are cleaned,
+    all other lines are returned as they are.
+
+    :param lines: Iterable of lines (e.g. a file handle in text mode).
+    :return: Iterator of cleaned lines.
     """
-    log.debug(f"Clean OBI file {obofile}")
-    path = os.path.dirname(obofile)
-    filename = os.path.basename(obofile)
+    # clean file, dbxref links in def line not well formatted
+    first_term_found = False
 
-    output_filename = "temp_clean_{}".format(filename)
-    output = os.path.join(path, output_filename)
-    log.debug(f"Write cleaned file to {output}")
+    for l in lines:
+        # check if first term was found (= skip header)
+        if not first_term_found:
+            if '[Term]' in l:
+                first_term_found = True
+        if first_term_found and (']' in l or 'xref: ' in l):
+            # clean xref def
+            l = remove_space_from_xref(l)
 
-    try:
-        os.remove(output)
-    except Exception as e:
-        log.info(e)
+        yield l
 
-    # clean file, dbxref links in def line not well formatted
-    first_term_found = False
 
-    with open(output, 'wt') as out:
-        with open(obofile, 'rt') as f:
-            for l in f:
-                # check if first term was found (= skip header)
-                if not first_term_found:
-                    if '[Term]' in l:
-                        first_term_found = True
-                if first_term_found:
-                    # clean xref def
-                    l = remove_space_from_xref(l)
+class CleanOboReader(io.RawIOBase):
+    """
+    Binary stream of a cleaned OBO file, the lines are cleaned while the stream is read.
+    """
+
+    def __init__(self, obofile):
+        """
+        :param obofile: Path to OBO file.
+        """
+        super(CleanOboReader, self).__init__()
+        self.name = obofile
+        self._file = open(obofile, 'rt', encoding='utf-8')
+        self._lines = iter_clean_obo_lines(self._file)
+        self._buffer = b''
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        chunks = [self._buffer]
+        size = len(self._buffer)
+        for l in self._lines:
+            line = l.encode('utf-8')
+            chunks.append(line)
+            size += len(line)
+            if size >= len(b):
+                break
+
+        data = b''.join(chunks)
+        n = min(len(b), len(data))
+        b[:n] = data[:n]
+        self._buffer = data[n:]
+        return n
+
+    def close(self):
+        self._file.close()
+        super(CleanOboReader, self).close()
+
+
+def open_clean_obo(obofile):
+    """
+    Open an OBO file for reading, format problems are cleaned on the fly (see `iter_clean_obo_lines`).
 
-                out.write(l)
+    The stream can be passed to `pronto.Ontology`, no cleaned copy of the file is written:
 
-    return output
+        with open_clean_obo(obofile) as f:
+            ontology = pronto.Ontology(f)
+
+    :param obofile: Path to OBO file.
+    :return: Buffered binary file handle.
+    """
+    log.debug(f"Open cleaned OBO file {obofile}")
+    return io.BufferedReader(CleanOboReader(obofile))
 
 
 def remove_space_from_xref(line):
@@ -63,7 +107,7 @@ def remove_space_from_xref(line):
     if line.endswith(']]'):
         if '[' in line:
             # get all occurences of '['
-            all_open_brackets = [m.start() for m in re.finditer('\[', line)]
+            all_open_brackets = [m.start() for m in re.finditer(r'\[', line)]
             index_second_last_open_bracket = all_open_brackets[-2]
             str_before_bracket = line[:index_second_last_open_bracket]
             str_xref_def = line[index_second_last_open_bracket:]
@@ -116,6 +160,9 @@ def remove_space_from_xref(line):
     else:
         if 'xref: ' in line:
             xref_key, xref_string = line.split(' ', 1)
+            # drop trailing qualifiers, descriptions and comments, they are not part of the ID
+            # - xref: HMDB:HMDB0002111 {source="KEGG COMPOUND"} -> xref: HMDB:HMDB0002111
+            xref_string = re.split(r' +(?:\{|"|!)', xref_string, 1)[0]
             if ':' in xref_string:
                 xref_string = clean_key_value_xref_element(xref_string)
             line = f'{xref_key} {xref_string}'
@@ -155,7 +202,250 @@ def clean_key_value_xref_element(xref):
 def clean_string_xref_element(xref):
     cleaned_string = xref.strip().replace(' ', '_').replace('\\', '').replace('[', '').replace(']', '')
     if "ISBN" in xref:
-        print(xref)
-        print(cleaned_string)
+        log.debug(f"Cleaned xref {xref} -> {cleaned_string}")
 
     return cleaned_string
+
+
+def iterate_obo_stanzas(lines):
+    """
+    Split the lines of an OBO file into stanzas.
+
+    The header is returned first with the stanza type None. Tag values are returned as they are in the
+    file (including qualifiers and comments), see `parse_obo_term` and `parse_obo_header`:
+
+        format-version: 1.2         (None, {'format-version': ['1.2']})
+        [Term]                      ('Term', {'id': ['FAO:0000001'], 'is_a': ['FAO:0000002 ! structure']})
+        id: FAO:0000001
+        is_a: FAO:0000002 ! structure
+
+    Only the tags of one stanza are kept in memory.
+
+    :param lines: Iterable of lines (e.g. a file handle in text mode).
+    :return: Iterator of (stanza type, dictionary tag -> list of values) tuples.
+    """
+    stanza_type = None
+    tags = {}
+
+    for l in lines:
+        l = l.strip()
+        if not l or l.startswith('!'):
+            continue
+
+        if l.startswith('[') and l.endswith(']'):
+            yield stanza_type, tags
+            stanza_type = l[1:-1]
+            tags = {}
+            continue
+
+        tag, _, value = l.partition(':')
+        tags.setdefault(tag, []).append(value.strip())
+
+    yield stanza_type, tags
+
+
+def _parse_quoted(value):
+    """
+    Split a value that starts with a quoted string: '"A \\"quoted\\" text." [xref]' -> ('A "quoted" text.', '[xref]')
+    """
+    if not value.startswith('"'):
+        return '', value
+    chars = []
+    i = 1
+    while i < len(value):
+        c = value[i]
+        if c == '\\' and i + 1 < len(value):
+            chars.append(value[i + 1])
+            i += 2
+            continue
+        if c == '"':
+            break
+        chars.append(c)
+        i += 1
+    return ''.join(chars), value[i + 1:].strip()
+
+
+def _parse_xref_list(value):
+    """
+    '[FAO:curators, ISBN:0471940526]' -> ['FAO:curators', 'ISBN:0471940526']
+    """
+    start = value.find('[')
+    end = value.rfind(']')
+    if start == -1 or end <= start:
+        return []
+    return [xref.strip().split(' ', 1)[0] for xref in value[start + 1:end].split(',') if xref.strip()]
+
+
+def _strip_comment(value):
+    """
+    Remove trailing comments and qualifiers: 'FAO:0000052 {source="x"} ! sporangium' -> 'FAO:0000052'
+    """
+    value = value.split(' !', 1)[0]
+    if value.endswith('}') and ' {' in value:
+        value = value.rsplit(' {', 1)[0]
+    return value.strip()
+
+
+def parse_obo_term(tags):
+    """
+    Get the values of a [Term] stanza from `iterate_obo_stanzas`.
+
+    :param tags: Dictionary tag -> list of values.
+    :return: Dictionary with the keys 'id', 'name', 'namespace', 'definition', 'definition_xrefs', 'obsolete',
+        'alt_ids', 'subsets', 'synonyms' (list of (description, scope, xrefs)), 'xrefs', 'is_a' and
+        'relationships' (list of (type, target)).
+    """
+    definition, definition_xrefs = None, []
+    if 'def' in tags:
+        definition, rest = _parse_quoted(tags['def'][0])
+        definition_xrefs = _parse_xref_list(rest)
+
+    synonyms = []
+    for value in tags.get('synonym', []):
+        description, rest = _parse_quoted(value)
+        scope = rest.split(' ', 1)[0] if rest and not rest.startswith('[') else None
+        synonyms.append((description, scope, _parse_xref_list(rest)))
+
+    relationships = []
+    for value in tags.get('relationship', []):
+        fields = _strip_comment(value).split()
+        if len(fields) >= 2:
+            relationships.append((fields[0], fields[1]))
+
+    return {
+        'id': tags['id'][0] if 'id' in tags else None,
+        'name': tags['name'][0] if 'name' in tags else None,
+        'namespace': tags['namespace'][0] if 'namespace' in tags else None,
+        'definition': definition,
+        'definition_xrefs': definition_xrefs,
+        'obsolete': tags.get('is_obsolete', ['false'])[0] == 'true',
+        'alt_ids': [_strip_comment(v) for v in tags.get('alt_id', [])],
+        'subsets': [_strip_comment(v) for v in tags.get('subset', [])],
+        'synonyms': synonyms,
+        'xrefs': [_strip_comment(v).split(' ', 1)[0] for v in tags.get('xref', [])],
+        'is_a': [_strip_comment(v) for v in tags.get('is_a', [])],
+        'relationships': relationships
+    }
+
+
+def parse_obo_header(tags):
+    """
+    Get the ontology metadata from the header stanza of `iterate_obo_stanzas`.
+
+    :param tags: Dictionary tag -> list of values.
+    :return: Dictionary with the keys 'ontology', 'date', 'data_version', 'default_namespace', 'subsetdefs'
+        (list of (name, description)) and 'annotations' (list of (property, value)).
+    """
+    date = tags['date'][0] if 'date' in tags else None
+    if date:
+        try:
+            # same format as pronto
+            date = str(datetime.strptime(date, '%d:%m:%Y %H:%M'))
+        except ValueError:
+            pass
+
+    subsetdefs = []
+    for value in tags.get('subsetdef', []):
+        name, _, description = value.partition(' ')
+        subsetdefs.append((name, _parse_quoted(description.strip())[0]))
+
+    annotations = []
+    for value in tags.get('property_value', []):
+        prop, _, rest = value.partition(' ')
+        if rest.startswith('"'):
+            rest = _parse_quoted(rest)[0]
+        else:
+            rest = rest.split(' ', 1)[0]
+        if rest:
+            annotations.append((prop, rest))
+
+    return {
+        'ontology': tags['ontology'][0] if 'ontology' in tags else None,
+        'date': date,
+        'data_version': tags['data-version'][0] if 'data-version' in tags else None,
+        'default_namespace': tags['default-namespace'][0] if 'default-namespace' in tags else None,
+        'subsetdefs': subsetdefs,
+        'annotations': annotations
+    }
+
+
+def read_obo(lines):
+    """
+    Read an OBO file without building an object model.
+
+        with open_clean_obo(obofile) as f:
+            header, terms = read_obo(io.TextIOWrapper(f, encoding='utf-8'))
+            for term in terms:
+                term['id'], term['is_a'], term['relationships']
+
+    :param lines: Iterable of lines (e.g. a file handle in text mode).
+    :return: Tuple (header from `parse_obo_header`, iterator of terms from `parse_obo_term`).
+    """
+    stanzas = iterate_obo_stanzas(lines)
+    _, header_tags = next(stanzas)
+
+    def terms():
+        for stanza_type, tags in stanzas:
+            if stanza_type == 'Term' and 'id' in tags:
+                yield parse_obo_term(tags)
+
+    return parse_obo_header(header_tags), terms()
+
+
+def read_pronto_ontology(ontology):
+    """
+    Get the header and the terms of a `pronto.Ontology` in the format of `read_obo`.
+
+    :param ontology: The pronto.Ontology.
+    :return: Tuple (header, iterator of terms).
+    """
+    metadata = ontology.metadata
+
+    annotations = []
+    for annotation in metadata.annotations:
+        value = None
+        if isinstance(annotation, pronto.LiteralPropertyValue):
+            value = annotation.literal
+        elif isinstance(annotation, pronto.ResourcePropertyValue):
+            value = annotation.resource
+        if value:
+            annotations.append((annotation.property, value))
+
+    header = {
+        'ontology': metadata.ontology,
+        'date': str(metadata.date),
+        'data_version': metadata.data_version,
+        'default_namespace': metadata.default_namespace,
+        'subsetdefs': [(subsetdef.name, subsetdef.description) for subsetdef in metadata.subsetdefs],
+        'annotations': annotations
+    }
+
+    def terms():
+        for term in ontology.terms():
+            relationships = []
+            try:
+                for reltype, targets in term.relationships.items():
+                    for target in targets:
+                        relationships.append((reltype.id, target.id))
+            except KeyError as e:
+                log.error(f"Cannot iterate relationshis of term {term.id}")
+                log.error(e)
+
+            definition = term.definition
+            yield {
+                'id': term.id,
+                'name': term.name,
+                'namespace': term.namespace,
+                'definition': str(definition) if definition is not None else None,
+                'definition_xrefs': [xref.id for xref in definition.xrefs] if definition is not None else [],
+                'obsolete': term.obsolete,
+                'alt_ids': list(term.alternate_ids),
+                'subsets': list(term.subsets),
+                'synonyms': [(synonym.description, synonym.scope, [xref.id for xref in synonym.xrefs])
+                             for synonym in term.synonyms],
+                'xrefs': [xref.id for xref in term.xrefs],
+                'is_a': [parent.id for parent in term.superclasses(distance=1, with_self=False)],
+                'relationships': relationships
+            }
+
+    return header, terms()
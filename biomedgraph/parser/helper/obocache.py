@@ -0,0 +1,106 @@
+import gzip
+import hashlib
+import logging
+import os
+import pickle
+
+import pronto
+
+from biomedgraph.parser.helper.obo import open_clean_obo
+
+log = logging.getLogger(__name__)
+
+# increase if the term format of `read_obo`/`read_pronto_ontology` or the cleaning of OBO files changes,
+# all cached ontologies are parsed again
+OBO_CACHE_VERSION = 2
+
+TERM_COLUMNS = ['id', 'name', 'namespace', 'definition', 'definition_xrefs', 'obsolete', 'alt_ids', 'subsets',
+                'synonyms', 'xrefs', 'is_a', 'relationships']
+
+
+def file_hash(path, blocksize=1 << 20):
+    """
+    :param path: Path to the file.
+    :return: SHA-256 hex digest of the file content.
+    """
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(blocksize), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def cache_key_prefix(parser_name, obo_backend):
+    """
+    Parser specific part of the cache key. For the pronto backend the key contains the pronto version,
+    a pronto upgrade misses the cache.
+
+    :param parser_name: Name of the parser (e.g. the class name).
+    :param obo_backend: 'pronto' or 'native'.
+    :return: The key prefix.
+    """
+    if obo_backend == 'pronto':
+        return '{}-pronto{}'.format(parser_name, pronto.__version__)
+    return '{}-{}'.format(parser_name, obo_backend)
+
+
+def terms_to_columns(terms):
+    """
+    Store a list of term dictionaries column by column.
+
+    :param terms: Iterable of terms from `read_obo` or `read_pronto_ontology`.
+    :return: Dictionary of column -> list of values.
+    """
+    columns = {column: [] for column in TERM_COLUMNS}
+    for term in terms:
+        for column, values in columns.items():
+            values.append(term[column])
+    return columns
+
+
+def columns_to_terms(columns):
+    """
+    :param columns: Dictionary from `terms_to_columns`.
+    :return: Iterator of term dictionaries.
+    """
+    for row in zip(*(columns[column] for column in TERM_COLUMNS)):
+        yield dict(zip(TERM_COLUMNS, row))
+
+
+def cached_ontology(cache_dir, obo_file, key_prefix, read_function):
+    """
+    Read an ontology from the cache, parse and cache it if it is not cached.
+
+    The cache key is built from `key_prefix`, `OBO_CACHE_VERSION` and the content hash of the OBO file,
+    a changed file or a new parser version misses the cache. The header and the term columns are stored
+    in one compressed pickle file per key.
+
+    :param cache_dir: Cache directory.
+    :param obo_file: Path to the OBO file.
+    :param key_prefix: Parser specific part of the key (e.g. parser class and backend).
+    :param read_function: Function that parses a binary file handle from `open_clean_obo` and returns
+        a tuple (header, iterator of terms).
+    :return: Tuple (header, iterator of terms).
+    """
+    key = '{}-v{}-{}'.format(key_prefix, OBO_CACHE_VERSION, file_hash(obo_file))
+    cache_file = os.path.join(cache_dir, '{}.pickle.gz'.format(key))
+
+    if os.path.exists(cache_file):
+        log.info("Read ontology {} from cache {}".format(obo_file, cache_file))
+        with gzip.open(cache_file, 'rb') as f:
+            data = pickle.load(f)
+        return data['header'], columns_to_terms(data['columns'])
+
+    log.info("Ontology {} not in cache, parse file".format(obo_file))
+    with open_clean_obo(obo_file) as cleaned_file:
+        header, terms = read_function(cleaned_file)
+        columns = terms_to_columns(terms)
+
+    # write to a temporary file first, a crashed run does not leave a broken cache file
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_file = '{}.tmp{}'.format(cache_file, os.getpid())
+    with gzip.open(tmp_file, 'wb', compresslevel=1) as f:
+        pickle.dump({'header': header, 'columns': columns}, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_file, cache_file)
+
+    return header, columns_to_terms(columns)
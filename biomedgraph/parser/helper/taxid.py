@@ -0,0 +1,36 @@
+def taxid_list(taxid):
+    """
+    Parsers accept a single taxid or a list of taxids, always return a list.
+
+    :param taxid: A taxid or a list of taxids.
+    :return: List of taxids.
+    """
+    if isinstance(taxid, str):
+        return [taxid]
+    return list(taxid)
+
+
+def taxid_sets(parser, taxids, names):
+    """
+    Get the output NodeSets/RelationshipSets of a parser for each taxid.
+
+    With a single taxid the sets of the parser are used (e.g. `parser.transcripts`). With several taxids,
+    `parser.create_sets()` is called once per taxid and the new sets are stored on the parser as
+    `<name>_<taxid>` (e.g. `parser.transcripts_10090`).
+
+    :param parser: The parser, must have a method `create_sets()` that returns new sets in the order of `names`.
+    :param taxids: List of taxids.
+    :param names: Attribute names of the sets.
+    :return: Dictionary taxid -> tuple of sets in the order of `names`.
+    """
+    if len(taxids) == 1:
+        return {taxids[0]: tuple(getattr(parser, name) for name in names)}
+
+    sets_by_taxid = {}
+    for taxid in taxids:
+        sets = parser.create_sets()
+        for name, s in zip(names, sets):
+            setattr(parser, '{}_{}'.format(name, taxid), s)
+        sets_by_taxid[taxid] = sets
+
+    return sets_by_taxid
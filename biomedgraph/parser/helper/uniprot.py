@@ -0,0 +1,159 @@
+from biomedgraph.parser.helper.lookup import Lookup, write_lookup
+
+
+def _line_value(line):
+    return line[5:].rstrip()
+
+
+def read_uniprot_records(lines, os_string_id=None, dr_databases=None):
+    """
+    Read records from a UniProt flat file and decode only the lines needed to build the graph.
+
+    The reader returns dictionaries with the keys 'AC' (list of accessions), 'DE' (description lines
+    joined with a space), 'OS' (organism lines joined with a space) and 'DR' (list of (database, [IDs])
+    tuples):
+
+        AC   P31946; A8K9K2; E1P616;
+        DE   RecName: Full=14-3-3 protein beta/alpha;
+        OS   Homo sapiens (Human).
+        DR   Ensembl; ENST00000353703; ENSP00000300161; ENSG00000166913. [P31946-1]
+
+        {'AC': ['P31946', 'A8K9K2', 'E1P616'], 'DE': 'RecName: Full=14-3-3 protein beta/alpha;',
+         'OS': 'Homo sapiens (Human).',
+         'DR': [('Ensembl', ['ENST00000353703', 'ENSP00000300161', 'ENSG00000166913'])]}
+
+    The OS lines come before comments, cross references, features and the sequence. If `os_string_id`
+    is not found in the OS lines, the rest of the record is skipped without looking at the lines.
+    AC and DE lines are only decoded for records that pass the filter.
+
+    :param lines: Iterable of lines (e.g. a file handle in text mode).
+    :param os_string_id: Only return records with this string in the OS lines (e.g. 'Human').
+    :param dr_databases: Only return DR lines of these databases (e.g. ['RefSeq', 'Ensembl']), all if None.
+    :return: Iterator of records.
+    """
+    if dr_databases is None:
+        dr_prefixes = 'DR   '
+    else:
+        dr_prefixes = tuple('DR   {};'.format(db) for db in dr_databases)
+
+    ac_lines = []
+    de_lines = []
+    os_lines = []
+    dr_lines = []
+    # None: before the end of the OS lines, True: record is returned, False: record is skipped
+    keep = None
+
+    for line in lines:
+        if keep is None:
+            if line.startswith('OS   '):
+                os_lines.append(_line_value(line))
+                continue
+            if os_lines:
+                # first line after OS lines
+                keep = os_string_id is None or os_string_id in ' '.join(os_lines)
+            elif line.startswith('AC   '):
+                ac_lines.append(line)
+                continue
+            elif line.startswith('DE   '):
+                de_lines.append(line)
+                continue
+
+        if line.startswith('//'):
+            if keep:
+                yield {
+                    'AC': [acc.strip() for l in ac_lines for acc in _line_value(l).split(';') if acc.strip()],
+                    'DE': ' '.join(_line_value(l).strip() for l in de_lines),
+                    'OS': ' '.join(os_lines),
+                    'DR': [_parse_dr_line(l) for l in dr_lines]
+                }
+            ac_lines = []
+            de_lines = []
+            os_lines = []
+            dr_lines = []
+            keep = None
+
+        elif keep and line.startswith(dr_prefixes):
+            dr_lines.append(line)
+
+
+def _parse_dr_line(line):
+    """
+    DR   RefSeq; NP_006752.1; NM_006761.4. [P62258-1] -> ('RefSeq', ['NP_006752.1', 'NM_006761.4'])
+    """
+    value = _line_value(line)
+    # remove isoform
+    if value.endswith(']'):
+        value = value.rsplit(' [', 1)[0]
+    fields = value.rstrip('.').split('; ')
+    return fields[0], fields[1:]
+
+
+def write_secondary_accession_index(path, accession_lists):
+    """
+    Write an index of secondary -> primary UniProt accessions.
+
+    Secondary accessions that are also a primary accession or that belong to more than one primary
+    accession (e.g. after an entry was split) are not resolved.
+
+    :param path: Target directory.
+    :param accession_lists: Iterable of accession lists of UniProt records, primary accession first.
+    """
+    primaries = set()
+    pairs = set()
+    for accessions in accession_lists:
+        primaries.add(accessions[0])
+        for secondary in accessions[1:]:
+            pairs.add((secondary, accessions[0]))
+
+    # keep ambiguous secondary accessions, the lookup returns None for keys found more than once
+    pairs = sorted(pair for pair in pairs if pair[0] not in primaries)
+
+    write_lookup(path, [secondary for secondary, _ in pairs], {'primary': [primary for _, primary in pairs]})
+
+
+class UniprotAccessionResolver:
+    """
+    Map secondary UniProt accessions to primary accessions.
+
+    Relationships to secondary accessions either miss the Protein node or create duplicate nodes. The
+    resolver uses the index written by `UniprotKnowledgebaseParser` (`build_secondary_accession_index`):
+
+        resolver = UniprotAccessionResolver(path)
+        resolver.resolve(['A8K9K2', 'P31946', 'P00000'])
+        > ['P31946', 'P31946', 'P00000']
+    """
+
+    def __init__(self, path):
+        """
+        :param path: Directory of the index.
+        """
+        self.lookup = Lookup(path)
+
+    def resolve(self, accessions):
+        """
+        Resolve a list of accessions, accessions that are not a (unique) secondary accession are not changed.
+
+        :param accessions: List of accessions.
+        :return: List of accessions.
+        """
+        primaries = self.lookup.get([accession or '' for accession in accessions], 'primary')
+        return [primary or accession for accession, primary in zip(accessions, primaries)]
+
+
+def resolve_accessions(index_path, accessions):
+    """
+    Resolve secondary UniProt accessions if an index is available.
+
+    The index is written per taxid. For data with several species pass a list of indexes (e.g. one per
+    taxid), the accessions are resolved with each index in turn.
+
+    :param index_path: Directory of the index, a list of directories or None.
+    :param accessions: List of accessions.
+    :return: List of accessions, unchanged if `index_path` is None.
+    """
+    if not index_path:
+        return accessions
+    index_paths = [index_path] if isinstance(index_path, str) else index_path
+    for path in index_paths:
+        accessions = UniprotAccessionResolver(path).resolve(accessions)
+    return accessions
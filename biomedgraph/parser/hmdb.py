@@ -4,6 +4,8 @@ import logging
 from graphpipeline.parser import ReturnParser
 from graphio import NodeSet, RelationshipSet
 
+from biomedgraph.parser.helper.uniprot import resolve_accessions
+
 log = logging.getLogger(__name__)
 
 
@@ -12,6 +14,9 @@ class HmdbParser(ReturnParser):
     def __init__(self):
         super(HmdbParser, self).__init__()
 
+        # optional secondary -> primary UniProt accession index (see UniprotKnowledgebaseParser)
+        self.secondary_accession_index = None
+
         # NodeSets
         self.metabolites = NodeSet(['Metabolite'], merge_keys=['sid'], default_props={'source': 'hmdb'})
 
@@ -30,6 +35,9 @@ class HmdbParser(ReturnParser):
 
         all_metabolites = etree.parse(all_metabolites_file)
 
+        # (HMDB ID, UniProt ID), UniProt IDs are resolved at the end
+        protein_associations = []
+
         for metabolite in all_metabolites.getroot():
             # TODO just iterate over property list, this code snippet was copied from manually testing stuff in Spyder
             # TODO filter empty properties
@@ -74,6 +82,15 @@ class HmdbParser(ReturnParser):
             # add association to Proteins
             for protein in metabolite.find('{http://www.hmdb.ca}protein_associations'):
                 uniprot_id = protein.findtext('{http://www.hmdb.ca}uniprot_id')
-                self.metabolite_associates_protein.add_relationship(
-                    {'sid': sid}, {'sid': uniprot_id}, {}
-                )
+                protein_associations.append((sid, uniprot_id))
+
+        uniprot_ids = resolve_accessions(self.secondary_accession_index, [x[1] for x in protein_associations])
+        # two accessions can resolve to the same primary accession
+        check_associations = set()
+        for (sid, _), uniprot_id in zip(protein_associations, uniprot_ids):
+            if (sid, uniprot_id) in check_associations:
+                continue
+            check_associations.add((sid, uniprot_id))
+            self.metabolite_associates_protein.add_relationship(
+                {'sid': sid}, {'sid': uniprot_id}, {}
+            )
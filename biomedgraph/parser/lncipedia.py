@@ -1,10 +1,11 @@
 import logging
 
-from graphpipeline.parser import GffReader
 from graphpipeline.parser import ReturnParser
 from graphpipeline.datasource import DataSourceVersion
 from graphio import NodeSet, RelationshipSet
 
+from biomedgraph.parser.helper.gtf import GtfColumnReader
+
 log = logging.getLogger(__name__)
 
 
@@ -41,19 +42,20 @@ class LncipediaParser(ReturnParser):
 
         gff_file = lncipedia_instance.get_file('lncipedia_5_2_hg38.gff')
 
-        annotation = GffReader(gff_file)
+        reader = GtfColumnReader(gff_file, gff3=True)
 
         check_ids = set()
 
-        for r in annotation.records:
-            if r.type == 'lnc_RNA':
+        # only 'lnc_RNA' records are needed, the alias attributes are extracted by prefix
+        for batch in reader.batches(types=['lnc_RNA'], attributes=['gene_id', 'transcript_id'],
+                                    attribute_prefixes=['gene_alias', 'transcript_alias']):
+            for gene_id, transcript_id, aliases in zip(batch['gene_id'], batch['transcript_id'],
+                                                       batch['attributes']):
                 # create gene
-                gene_id = r.attributes['gene_id']
                 if gene_id not in check_ids:
                     self.genes.add_node({'sid': gene_id, 'source': lncipedia_datasource_name})
                     check_ids.add(gene_id)
 
-                transcript_id = r.attributes['transcript_id']
                 if transcript_id not in check_ids:
                     self.transcripts.add_node({'sid': transcript_id, 'source': lncipedia_datasource_name})
                     check_ids.add(transcript_id)
@@ -64,7 +66,7 @@ class LncipediaParser(ReturnParser):
                     )
                     check_ids.add(frozenset((gene_id, transcript_id)))
 
-                for k,v in r.attributes.items():
+                for k, v in aliases.items():
                     if k.startswith('gene_alias'):
                         ref_gene_id = v.split('.')[0]
                         # don't create MAPS relationship if same name like mapped entity
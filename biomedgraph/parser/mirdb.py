@@ -23,11 +23,14 @@ class MirdbParser(ReturnParser):
     def run(self, taxid):
 
         mirdb_instance = self.get_instance_by_name('Mirdb')
-        mirdb_file = mirdb_instance.datasource.get_prediction_file(mirdb_instance)
 
         datasource_name = mirdb_instance.datasource.name
         mir_prefix = TAXID_2_MIRPREFIX[taxid]
 
+        mirdb_file = mirdb_instance.datasource.get_prediction_file(mirdb_instance, mir_prefix)
+        if mirdb_file is None:
+            return
+
         with gzip.open(mirdb_file, 'rt') as f:
             for l in f:
                 flds = l.split()
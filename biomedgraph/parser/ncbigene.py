@@ -3,15 +3,91 @@ from graphpipeline.parser import ReturnParser
 from graphio import NodeSet, RelationshipSet
 import logging
 
+from biomedgraph.datasources.partition import get_shard_file, get_shard_files
+from biomedgraph.parser.helper.accession import AccessionPairSet
+from biomedgraph.parser.helper.genesymbol import read_gene_info_symbols, read_hgnc_symbols, write_gene_symbol_index
+from biomedgraph.parser.helper.taxid import taxid_list, taxid_sets
+
 
 TAXID_SPECIFIC_GENEINFO = {
     '9606': 'Homo_sapiens.gene_info.gz',
     '10090': 'Mus_musculus.gene_info.gz'
 }
 
+# gene_info columns with '|' separated lists
+GENE_INFO_LIST_FIELDS = ['Synonyms', 'dbXrefs', 'Other_designations', 'Feature_type']
+
+# dbXrefs that are turned into (Gene)-[MAPS]-> relationships: database -> attribute of the RelationshipSet
+DBXREF_RELATIONSHIPS = {
+    'Ensembl': 'gene_maps_gene',
+    'HGNC': 'gene_maps_gene',
+    'miRBase': 'gene_maps_precursor_mirna'
+}
+
 log = logging.getLogger(__name__)
 
+
+def normalize_gene_info(props):
+    """
+    Drop '-' placeholders and split the list columns of a gene_info line (see GENE_INFO_LIST_FIELDS).
+
+        normalize_gene_info({'Symbol': 'A1BG', 'Synonyms': 'A1B|ABG', 'chromosome': '-'})
+        > {'Symbol': 'A1BG', 'Synonyms': ['A1B', 'ABG']}
+
+    :param props: Dictionary column -> value.
+    :return: Normalized dictionary.
+    """
+    normalized = {}
+    for key, value in props.items():
+        if value == '-':
+            continue
+        if key in GENE_INFO_LIST_FIELDS:
+            value = value.split('|')
+        normalized[key] = value
+    return normalized
+
+
+def split_dbxref(dbxref):
+    """
+    Split a gene_info dbXref into database and ID, e.g. 'HGNC:HGNC:5' -> ('HGNC', 'HGNC:5')
+    """
+    db, _, xref_id = dbxref.partition(':')
+    return db, xref_id
+
+
+def iterate_taxid_lines(path, taxids, columns):
+    """
+    Stream the lines of a tab separated NCBI Gene file that starts with the taxid (e.g. gene2ensembl).
+
+    Lines of other taxids are skipped before they are split and lines are split only up to the
+    last needed column:
+
+        iterate_taxid_lines(gene2accession_file, ['9606'], 6)
+        > ['9606', '1', 'REVIEWED', 'NM_130786.4', '1519316133', 'NP_570602.2'], ...
+
+    :param path: Path of the original file, the taxid shards are read if available.
+    :param taxids: List of taxids.
+    :param columns: Number of leading columns to return.
+    :return: Iterator of field lists.
+    """
+    for file, file_taxids in get_shard_files(path, taxids).items():
+        prefixes = tuple('{}\t'.format(taxid) for taxid in file_taxids)
+        log.info("Parse {}".format(file))
+        with gzip.open(file, 'rt') as f:
+            for l in f:
+                if l.startswith(prefixes):
+                    yield l.rstrip('\n').split('\t', columns)[:columns]
+
+
 class NcbiGeneParser(ReturnParser):
+    """
+    Parse genes and gene symbols from gene_info.gz
+
+    If `build_symbol_index` is set, an index of (taxid, symbol) -> NCBI Gene IDs is written to
+    `NcbiGene.get_symbol_index_path`. For human the symbols of HGNC are added (requires the HGNC instance).
+    Other parsers use it to resolve gene symbols without the database (see
+    `biomedgraph.parser.helper.genesymbol.GeneSymbolResolver`).
+    """
 
     def __init__(self):
 
@@ -29,6 +105,13 @@ class NcbiGeneParser(ReturnParser):
                                                              ['sid', 'taxid'], ['sid', 'taxid'], default_props={'source': 'ncbigene'})
         self.gene_maps_genesymbol = RelationshipSet('MAPS', ['Gene'], ['Gene'], ['sid'], ['sid', 'taxid'], default_props={'source': 'ncbigene'})
 
+        # normalize the Gene properties and create relationships from dbXrefs (see `normalize_gene_info`)
+        self.normalize = False
+        # write an index of gene symbols
+        self.build_symbol_index = False
+        self.gene_maps_gene = RelationshipSet('MAPS', ['Gene'], ['Gene'], ['sid'], ['sid'], default_props={'source': 'ncbigene'})
+        self.gene_maps_precursor_mirna = RelationshipSet('MAPS', ['Gene'], ['PrecursorMirna'], ['sid'], ['sid'], default_props={'source': 'ncbigene'})
+
     def run_with_mounted_arguments(self):
         self.run(self.taxid)
 
@@ -40,11 +123,29 @@ class NcbiGeneParser(ReturnParser):
         if taxid in TAXID_SPECIFIC_GENEINFO:
             gene_info_file = ncbigene_instance.get_file(TAXID_SPECIFIC_GENEINFO[taxid])
         else:
-            gene_info_file = ncbigene_instance.get_file('gene_info.gz')
+            # read the taxid shard if the file was sharded after download
+            gene_info_file = get_shard_file(ncbigene_instance.get_file('gene_info.gz'), taxid)
+            if gene_info_file is None:
+                log.info("No genes for taxid {}".format(taxid))
+                return
 
         log.info(gene_info_file)
         self.parse_gene_info(gene_info_file, taxid)
 
+        if self.build_symbol_index:
+            self.write_symbol_index(ncbigene_instance, gene_info_file, taxid)
+
+    def write_symbol_index(self, ncbigene_instance, gene_info_file, taxid):
+        with gzip.open(gene_info_file, 'rt') as f:
+            rows = list(read_gene_info_symbols(f, taxid))
+
+        if taxid == '9606':
+            hgnc_instance = self.get_instance_by_name('HGNC')
+            with open(hgnc_instance.get_file('hgnc_complete_set.txt'), 'rt') as f:
+                rows.extend(read_hgnc_symbols(f))
+
+        write_gene_symbol_index(ncbigene_instance.datasource.get_symbol_index_path(taxid, ncbigene_instance), rows)
+
     def parse_gene_info(self, gene_info_file, taxid):
         # check sets
         check_ids = set()
@@ -80,6 +181,13 @@ class NcbiGeneParser(ReturnParser):
                             zip(header_fields, flds)
                         )
 
+                        if self.normalize:
+                            props = normalize_gene_info(props)
+                            props['dbXrefs'] = self.add_dbxref_relationships(entrez_gene_id,
+                                                                             props.get('dbXrefs', []))
+                            if not props['dbXrefs']:
+                                del props['dbXrefs']
+
                         check_ids.add(entrez_gene_id)
                         self.genes.add_node(props)
 
@@ -117,6 +225,58 @@ class NcbiGeneParser(ReturnParser):
                                                                    {'sid': symbol, 'taxid': taxid},
                                                                    {'status': 'synonym'})
 
+    def add_dbxref_relationships(self, entrez_gene_id, dbxrefs):
+        """
+        Create (Gene)-[MAPS]-> relationships for the dbXrefs of a gene (see DBXREF_RELATIONSHIPS).
+
+        :param entrez_gene_id: The NCBI Gene ID.
+        :param dbxrefs: List of dbXrefs, e.g. ['MIM:138670', 'HGNC:HGNC:5', 'Ensembl:ENSG00000121410']
+        :return: List of dbXrefs without relationship (e.g. ['MIM:138670']).
+        """
+        other = []
+        for dbxref in dbxrefs:
+            db, xref_id = split_dbxref(dbxref)
+            if db in DBXREF_RELATIONSHIPS and xref_id:
+                getattr(self, DBXREF_RELATIONSHIPS[db]).add_relationship(
+                    {'sid': entrez_gene_id}, {'sid': xref_id}, {}
+                )
+            else:
+                other.append(dbxref)
+        return other
+
+
+def resolve_replacements(replaced_by):
+    """
+    Resolve chains of replaced IDs to the final ID.
+
+    A discontinued gene can be replaced by a gene that is discontinued later as well. The chains are
+    followed with path compression, each ID is visited only once:
+
+        resolve_replacements({'1': '2', '2': '3', '4': None, '5': '4'})
+        > {'1': '3', '2': '3', '4': None, '5': None}
+
+    :param replaced_by: Dictionary discontinued ID -> new ID or None if the ID was withdrawn.
+    :return: Dictionary discontinued ID -> final live ID or None if the chain ends in a withdrawn ID.
+    """
+    final = {}
+    for start in replaced_by:
+        path = []
+        current = start
+        while current in replaced_by and current not in final:
+            if current in path:
+                # cycle, no live ID
+                log.warning("Cyclic replacement of gene ID {}".format(current))
+                final.update(dict.fromkeys(path))
+                break
+            path.append(current)
+            current = replaced_by[current]
+        else:
+            result = final[current] if current in final else current
+            for discontinued in path:
+                final[discontinued] = result
+    return final
+
+
 class NcbiLegacyGeneParser(ReturnParser):
     """
     Parse legacy gene IDs from gene_history.gz
@@ -124,6 +284,11 @@ class NcbiLegacyGeneParser(ReturnParser):
     9       -       1246494 repA1   20031113
     9       -       1246495 repA2   20031113
     9       -       1246496 leuA    20031113
+
+    Besides the (Legacy)-[REPLACED_BY]->(Gene) relationships from the file the chains of replacements are
+    resolved: each legacy gene gets a (Legacy)-[CURRENT]->(Gene) relationship to the live gene at the end of
+    the chain and the properties 'current' (ID of the live gene) and 'withdrawn' (True if the chain ends in
+    a gene that was discontinued without replacement).
     """
 
     def __init__(self):
@@ -134,6 +299,7 @@ class NcbiLegacyGeneParser(ReturnParser):
 
         self.legacy_genes = NodeSet(['Gene', 'Legacy'], merge_keys=['sid'], default_props={'source': 'ncbigene'})
         self.legacy_gene_now_gene = RelationshipSet('REPLACED_BY', ['Gene', 'Legacy'], ['Gene'], ['sid'], ['sid'], default_props={'source': 'ncbigene'})
+        self.legacy_gene_current_gene = RelationshipSet('CURRENT', ['Gene', 'Legacy'], ['Gene'], ['sid'], ['sid'], default_props={'source': 'ncbigene'})
 
     def run_with_mounted_arguments(self):
         self.run(self.taxid)
@@ -141,7 +307,15 @@ class NcbiLegacyGeneParser(ReturnParser):
     def run(self, taxid):
         log.debug(f'Run parser {self.__class__.__name__} for taxID: {taxid}.')
         ncbigene_instance = self.get_instance_by_name('NcbiGene')
-        gene_history_file = ncbigene_instance.get_file('gene_history.gz')
+        gene_history_file = get_shard_file(ncbigene_instance.get_file('gene_history.gz'), taxid)
+        if gene_history_file is None:
+            log.info("No legacy genes for taxid {}".format(taxid))
+            return
+
+        # discontinued ID -> (symbol, date)
+        legacy_genes = {}
+        # discontinued ID -> new ID or None
+        replaced_by = {}
 
         with gzip.open(gene_history_file, 'rt') as f:
             # skip header
@@ -154,13 +328,151 @@ class NcbiLegacyGeneParser(ReturnParser):
                     discontinued_gene_id = flds[2]
                     discontinued_symbol = flds[3]
                     date = flds[4]
-                    self.legacy_genes.add_node(
-                        {'sid': discontinued_gene_id, 'date': date, 'symbol': discontinued_symbol, 'taxid': taxid}
-                    )
+                    legacy_genes[discontinued_gene_id] = (discontinued_symbol, date)
                     if new_gene_id != '-':
+                        replaced_by[discontinued_gene_id] = new_gene_id
                         self.legacy_gene_now_gene.add_relationship(
                             {'sid': discontinued_gene_id}, {'sid': new_gene_id}, {}
                         )
+                    else:
+                        replaced_by[discontinued_gene_id] = None
+
+        current_genes = resolve_replacements(replaced_by)
+
+        for discontinued_gene_id, (discontinued_symbol, date) in legacy_genes.items():
+            current_gene_id = current_genes[discontinued_gene_id]
+            self.legacy_genes.add_node(
+                {'sid': discontinued_gene_id, 'date': date, 'symbol': discontinued_symbol, 'taxid': taxid,
+                 'current': current_gene_id, 'withdrawn': current_gene_id is None}
+            )
+            if current_gene_id is not None:
+                self.legacy_gene_current_gene.add_relationship(
+                    {'sid': discontinued_gene_id}, {'sid': current_gene_id}, {}
+                )
+
+
+class NcbiGene2EnsemblParser(ReturnParser):
+    """
+    Extract (Gene {ncbigene})-[MAPS]-(Gene {ensembl}) mappings from gene2ensembl.gz
+
+    #tax_id GeneID  Ensembl_gene_identifier RNA_nucleotide_accession.version        Ensembl_rna_identifier  ...
+    9606    1       ENSG00000121410 NM_130786.4     ENST00000263100.8       NP_570602.2     ENSP00000263100.2
+
+    The file has one line per transcript, only the first three columns are split.
+
+    The parser can run on a list of taxids, each taxid gets its own RelationshipSet (see
+    `biomedgraph.parser.helper.taxid.taxid_sets`).
+    """
+    SETS = ['gene_maps_gene']
+
+    def __init__(self):
+        super(NcbiGene2EnsemblParser, self).__init__()
+
+        self.arguments = ['taxid']
+
+        self.gene_maps_gene, = self.create_sets()
+
+    @staticmethod
+    def create_sets():
+        gene_maps_gene = RelationshipSet('MAPS', ['Gene'], ['Gene'], ['sid'], ['sid'], default_props={'source': 'ncbigene'})
+        return gene_maps_gene,
+
+    def run_with_mounted_arguments(self):
+        self.run(self.taxid)
+
+    def run(self, taxid):
+        """
+        :param taxid: A taxid or a list of taxids.
+        """
+        log.info(f"Run {self.__class__.__name__}")
+        ncbigene_instance = self.get_instance_by_name('NcbiGene')
+        gene2ensembl_file = ncbigene_instance.get_file('gene2ensembl.gz')
+
+        taxids = taxid_list(taxid)
+        sets_by_taxid = taxid_sets(self, taxids, self.SETS)
+
+        check_set = AccessionPairSet()
+
+        for flds in iterate_taxid_lines(gene2ensembl_file, taxids, 3):
+            gene_id = flds[1]
+            ensembl_gene_id = flds[2]
+
+            if ensembl_gene_id != '-' and (gene_id, ensembl_gene_id) not in check_set:
+                gene_maps_gene, = sets_by_taxid[flds[0]]
+                gene_maps_gene.add_relationship(
+                    {'sid': gene_id}, {'sid': ensembl_gene_id}, {}
+                )
+                check_set.add((gene_id, ensembl_gene_id))
+
+
+class NcbiGene2AccessionParser(ReturnParser):
+    """
+    Extract (Gene)-[CODES]-(Transcript) and (Transcript)-[CODES]-(Protein) from gene2accession.gz
+
+    #tax_id GeneID  status  RNA_nucleotide_accession.version        RNA_nucleotide_gi       protein_accession.version ...
+    9606    1       REVIEWED        NM_130786.4     1519316133      NP_570602.2     ...
+
+    The file is very large (one line per gene/sequence/genomic location, ~40 GB uncompressed). Only the
+    first six columns are split. Lines with GenBank accessions (status '-') and genomic lines without
+    a RNA accession are skipped, only RefSeq transcripts and proteins are used.
+
+    The parser can run on a list of taxids, each taxid gets its own RelationshipSets (see
+    `biomedgraph.parser.helper.taxid.taxid_sets`).
+    """
+    SETS = ['gene_codes_transcript', 'transcript_codes_protein']
+
+    def __init__(self):
+        super(NcbiGene2AccessionParser, self).__init__()
+
+        self.arguments = ['taxid']
+
+        self.gene_codes_transcript, self.transcript_codes_protein = self.create_sets()
+
+    @staticmethod
+    def create_sets():
+        gene_codes_transcript = RelationshipSet('CODES', ['Gene'], ['Transcript'], ['sid'], ['sid'], default_props={'source': 'ncbigene'})
+        transcript_codes_protein = RelationshipSet('CODES', ['Transcript'], ['Protein'], ['sid'], ['sid'], default_props={'source': 'ncbigene'})
+        return gene_codes_transcript, transcript_codes_protein
+
+    def run_with_mounted_arguments(self):
+        self.run(self.taxid)
+
+    def run(self, taxid):
+        """
+        :param taxid: A taxid or a list of taxids.
+        """
+        log.info(f"Run {self.__class__.__name__}")
+        ncbigene_instance = self.get_instance_by_name('NcbiGene')
+        gene2accession_file = ncbigene_instance.get_file('gene2accession.gz')
+
+        taxids = taxid_list(taxid)
+        sets_by_taxid = taxid_sets(self, taxids, self.SETS)
+
+        # the same gene/transcript pair is listed once per genomic location
+        check_g_t_rels = AccessionPairSet()
+        check_t_p_rels = AccessionPairSet()
+
+        for flds in iterate_taxid_lines(gene2accession_file, taxids, 6):
+            status = flds[2]
+            transcript_id = flds[3].split('.')[0]
+            if status == '-' or transcript_id == '-':
+                continue
+
+            gene_codes_transcript, transcript_codes_protein = sets_by_taxid[flds[0]]
+            gene_id = flds[1]
+            protein_id = flds[5].split('.')[0]
+
+            if (gene_id, transcript_id) not in check_g_t_rels:
+                gene_codes_transcript.add_relationship(
+                    {'sid': gene_id}, {'sid': transcript_id}, {'status': status}
+                )
+                check_g_t_rels.add((gene_id, transcript_id))
+
+            if protein_id != '-' and (transcript_id, protein_id) not in check_t_p_rels:
+                transcript_codes_protein.add_relationship(
+                    {'sid': transcript_id}, {'sid': protein_id}, {'status': status}
+                )
+                check_t_p_rels.add((transcript_id, protein_id))
 
 
 class NcbiGeneOrthologParser(ReturnParser):
@@ -1,12 +1,18 @@
+import io
 import pronto
-import os
 import logging
 import json
-import re
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
 
 from graphpipeline.parser import ReturnParser
 from graphio import NodeSet, RelationshipSet
 
+from biomedgraph.parser.helper.obo import open_clean_obo, read_obo, read_pronto_ontology
+from biomedgraph.parser.helper.obocache import cached_ontology, cache_key_prefix
+
 log = logging.getLogger(__name__)
 
 # some ontologies have specific OBO file names (not uberon.obo but basic.obo)
@@ -14,14 +20,190 @@ OBO_FILE_MAPPINGS = {
     'uberon': 'basic.obo'
 }
 
+# rough peak memory of parsing an OBO file relative to the file size, used to schedule parallel runs
+OBO_MEMORY_FACTOR = 20
+
+
+def get_obo_filename(ontology_name):
+    if ontology_name in OBO_FILE_MAPPINGS:
+        return OBO_FILE_MAPPINGS[ontology_name]
+    return "{}.obo".format(ontology_name)
+
+
+def find_obo_files(obo_dir):
+    """
+    Find the OBO files in the OboFoundry download directory (one directory per ontology).
+
+    :param obo_dir: The download directory (i.e. instance dir).
+    :return: Dictionary of ontology name -> path to the OBO file.
+    """
+    obo_files = {}
+    for ontology_name in sorted(os.listdir(obo_dir)):
+        obo_file = os.path.join(obo_dir, ontology_name, get_obo_filename(ontology_name))
+        if os.path.isfile(obo_file):
+            obo_files[ontology_name] = obo_file
+    return obo_files
+
+
+def write_parser_shard(parser, shard_path):
+    """
+    Write the NodeSets and RelationshipSets of a parser to a directory, one JSON file per set.
+
+    The files are written to a temporary directory which is renamed when all files are written,
+    an existing shard directory is always complete.
+
+    :param parser: The parser.
+    :param shard_path: The shard directory.
+    """
+    tmp_path = '{}.tmp{}'.format(shard_path, os.getpid())
+
+    try:
+        os.makedirs(tmp_path)
+
+        for name, value in vars(parser).items():
+            if isinstance(value, NodeSet):
+                data = {'type': 'nodeset', **value.metadata_dict, 'nodes': value.nodes}
+            elif isinstance(value, RelationshipSet):
+                data = {'type': 'relationshipset', **value.metadata_dict, 'relationships': value.relationships}
+            else:
+                continue
+            with open(os.path.join(tmp_path, '{}.json'.format(name)), 'wt') as f:
+                json.dump(data, f)
+
+        remove_shard(shard_path)
+        os.replace(tmp_path, shard_path)
+    finally:
+        if os.path.exists(tmp_path):
+            shutil.rmtree(tmp_path)
+
+
+def remove_shard(shard_path):
+    """
+    Remove the shard of an ontology, e.g. the shard of a previous run if the ontology fails.
+
+    :param shard_path: The shard directory.
+    """
+    if os.path.exists(shard_path):
+        shutil.rmtree(shard_path)
+
+
+def parse_ontology_to_shard(ontology_name, obo_file, shard_dir, obo_backend='pronto', cache_dir=None):
+    """
+    Parse one ontology and write the output to `shard_dir/ontology_name` (runs in a worker process).
+
+    :param ontology_name: The ontology name (e.g. go, uberon).
+    :param obo_file: Path to the OBO file.
+    :param shard_dir: The output directory.
+    :param obo_backend: 'pronto' or 'native'.
+    :param cache_dir: Directory of the parsed ontology cache, no cache if None.
+    :return: The shard directory.
+    """
+    parser = OboFoundryParser()
+    parser.obo_backend = obo_backend
+    parser.cache_dir = cache_dir
+    parser.parse_file(obo_file)
+
+    shard_path = os.path.join(shard_dir, ontology_name)
+    write_parser_shard(parser, shard_path)
+    return shard_path
+
+
+def parse_ontologies_parallel(obo_files, shard_dir, workers, memory_budget=None, obo_backend='pronto',
+                              cache_dir=None):
+    """
+    Parse ontologies in a process pool and write one output shard per ontology.
+
+    The shards are yielded as soon as they are written, a loader can consume them while the other
+    ontologies are parsed. Large files are submitted first. The estimated memory of the running
+    parsers (`OBO_MEMORY_FACTOR` * file size) is kept below `memory_budget`, a file that exceeds
+    the budget on its own is parsed when no other file is running. Errors are returned per ontology
+    and do not stop the other runs, the shard of a previous run is removed for failed ontologies.
+    If a worker process dies (e.g. killed by the OOM killer) the pool is broken: the running and the
+    remaining ontologies are returned as failed.
+
+    :param obo_files: Dictionary of ontology name -> path to the OBO file (e.g. from `find_obo_files`).
+    :param shard_dir: The output directory.
+    :param workers: Number of worker processes.
+    :param memory_budget: Memory budget in bytes, no limit if None.
+    :param obo_backend: 'pronto' or 'native'.
+    :param cache_dir: Directory of the parsed ontology cache, no cache if None.
+    :return: Iterator of (ontology name, shard directory, error) tuples, the shard directory is None
+        if the ontology failed.
+    """
+    os.makedirs(shard_dir, exist_ok=True)
+
+    pending = sorted(obo_files.items(), key=lambda item: os.path.getsize(item[1]), reverse=True)
+    running = {}
+    used_memory = 0
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        while pending or running:
+
+            try:
+                # submit the largest files that fit into the budget
+                for ontology_name, obo_file in list(pending):
+                    if len(running) >= workers:
+                        break
+                    memory = OBO_MEMORY_FACTOR * os.path.getsize(obo_file)
+                    if memory_budget and running and used_memory + memory > memory_budget:
+                        continue
+                    log.debug(f"Parse ontology {ontology_name}")
+                    future = executor.submit(parse_ontology_to_shard, ontology_name, obo_file, shard_dir,
+                                             obo_backend, cache_dir)
+                    running[future] = (ontology_name, memory)
+                    used_memory += memory
+                    pending.remove((ontology_name, obo_file))
+            except BrokenProcessPool as e:
+                log.error("Process pool broken, no further ontologies are parsed")
+                for ontology_name, _ in pending:
+                    remove_shard(os.path.join(shard_dir, ontology_name))
+                    yield ontology_name, None, e
+                pending = []
+
+            if not running:
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                ontology_name, memory = running.pop(future)
+                used_memory -= memory
+                try:
+                    yield ontology_name, future.result(), None
+                except Exception as e:
+                    log.error(f"Cannot parse ontology {ontology_name}")
+                    log.error(e)
+                    # a loader must not pick up the shard of a previous run
+                    remove_shard(os.path.join(shard_dir, ontology_name))
+                    yield ontology_name, None, e
+
 
 class OboFoundryParser(ReturnParser):
+    """
+    Parse an ontology from OboFoundry.
+
+    With `obo_backend` = 'native' the OBO file is read stanza by stanza with
+    `biomedgraph.parser.helper.obo.read_obo` instead of building a `pronto.Ontology`.
+
+    If `cache_dir` is set, the parsed terms are cached by the content hash of the OBO file, unchanged
+    ontologies are not parsed again.
+
+    `run_all` parses all downloaded ontologies in a process pool and writes one output shard per
+    ontology (see `parse_ontologies_parallel`).
+    """
 
     def __init__(self):
         super(OboFoundryParser, self).__init__()
 
         self.arguments = ['ontology_name']
 
+        # 'pronto' or 'native'
+        self.obo_backend = 'pronto'
+        # directory of the parsed ontology cache (see `biomedgraph.parser.helper.obocache`), no cache if None
+        self.cache_dir = None
+        # number of worker processes and memory budget in bytes of `run_all`
+        self.workers = 1
+        self.memory_budget = None
+
         # NodeSets
         self.ontologies = NodeSet(['Ontology'], merge_keys=['sid'])
         self.terms = NodeSet(['Term'], merge_keys=['sid'])
@@ -50,229 +232,91 @@ class OboFoundryParser(ReturnParser):
 
     def parse_obo_file(self, ontology_file):
         """
-        Parse an OBO file from OboFoundry and extract Ontology, Terms, Subsets and relationships.
+        Parse an OBO file from OboFoundry with pronto and extract Ontology, Terms, Subsets and relationships.
 
-        :param ontology_file: Path to the ontology file.
+        :param ontology_file: Path to the ontology file or binary file handle (e.g. from `open_clean_obo`).
         """
-        this_ontology = pronto.Ontology(ontology_file)
+        metadata, terms = read_pronto_ontology(pronto.Ontology(ontology_file))
+        self.add_ontology(metadata, terms)
 
-        check_synonym_nodes = set()
+    def parse_obo_file_native(self, lines):
+        """
+        Parse an OBO file with the native stanza parser, the output is the same as `parse_obo_file`.
 
-        metadata = this_ontology.metadata
+        :param lines: Iterable of lines (e.g. a file handle in text mode).
+        """
+        metadata, terms = read_obo(lines)
+        self.add_ontology(metadata, terms)
 
-        # construct Ontology node
-        ontology_sid = metadata.ontology
-        ontology_dict = {'sid': ontology_sid, 'date': str(metadata.date), 'version': metadata.data_version}
-        for annotation in metadata.annotations:
-            property = annotation.property
+    def read_ontology(self, cleaned_file):
+        """
+        Read an ontology with the configured `obo_backend`.
 
-            value = None
-            if isinstance(annotation, pronto.LiteralPropertyValue):
-                value = annotation.literal
-            elif isinstance(annotation, pronto.ResourcePropertyValue):
-                value = annotation.resource
+        :param cleaned_file: Binary file handle from `open_clean_obo`.
+        :return: Tuple (header, iterator of terms), see `biomedgraph.parser.helper.obo.read_obo`.
+        """
+        if self.obo_backend == 'native':
+            return read_obo(io.TextIOWrapper(cleaned_file, encoding='utf-8'))
+        return read_pronto_ontology(pronto.Ontology(cleaned_file))
 
-            if value:
-                ontology_dict[property] = value
+    def add_ontology(self, metadata, terms):
+        """
+        Create the Ontology, Term and Subset nodes and the relationships.
+
+        :param metadata: Header from `read_obo` or `read_pronto_ontology`.
+        :param terms: Iterable of terms from `read_obo` or `read_pronto_ontology`.
+        """
+        check_synonym_nodes = set()
+
+        # construct Ontology node
+        ontology_sid = metadata['ontology']
+        ontology_dict = {'sid': ontology_sid, 'date': metadata['date'], 'version': metadata['data_version']}
+        for property, value in metadata['annotations']:
+            ontology_dict[property] = value
 
         self.ontologies.add_node(ontology_dict)
 
         # construct subset nodes
-        for subsetdef in metadata.subsetdefs:
-            subset_dict = {'name': subsetdef.name, 'description': subsetdef.description}
-            self.subsets.add_node(subset_dict)
-            self.subset_of_ontology.add_relationship({'name': subsetdef.name}, {'sid': ontology_sid},
-                                                     {'source': 'obofoundry'})
+        for name, description in metadata['subsetdefs']:
+            self.subsets.add_node({'name': name, 'description': description})
+            self.subset_of_ontology.add_relationship({'name': name}, {'sid': ontology_sid}, {'source': 'obofoundry'})
 
         # iterate terms
-        for term in this_ontology.terms():
+        for term in terms:
 
-            term_sid = term.id
+            term_sid = term['id']
             self.terms.add_node(
-                {'name': (term.name), 'sid': term_sid, 'namespace': (term.namespace), 'obsolete': term.obsolete,
-                 'definition': term.definition, 'alt_ids': list(term.alternate_ids)}
+                {'name': term['name'], 'sid': term_sid, 'namespace': term['namespace'], 'obsolete': term['obsolete'],
+                 'definition': term['definition'], 'alt_ids': term['alt_ids']}
             )
 
             # term in ontology relationship
             self.term_in_ontology.add_relationship({'sid': term_sid}, {'sid': ontology_sid}, {'source': 'obofoundry'})
 
             # subset relationships
-            for subset_name in term.subsets:
+            for subset_name in term['subsets']:
                 self.term_in_subset.add_relationship({'sid': term_sid}, {'name': subset_name}, {'source': 'obofoundry'})
 
-            # inter Term relationships
-            ## SubClassOf / is_a relationships
-            for parent in term.superclasses(distance=1, with_self=False):
+            # is_a relationships
+            for parent in term['is_a']:
                 self.term_is_a_term.add_relationship(
-                    {'sid': term_sid}, {'sid': parent.id}, {'source': 'obofoundry'}
+                    {'sid': term_sid}, {'sid': parent}, {'source': 'obofoundry'}
                 )
 
-            ## synonyms
-            for synonym in term.synonyms:
-                # create synonym node
-                if synonym.description not in check_synonym_nodes:
-                    self.synonym_terms.add_node({'name': synonym.description})
+            # synonyms
+            for description, scope, xrefs in term['synonyms']:
+                if description not in check_synonym_nodes:
+                    self.synonym_terms.add_node({'name': description})
+                    check_synonym_nodes.add(description)
                 self.term_synonym_term.add_relationship(
-                    {'sid': term_sid}, {'name': synonym.description},
-                    {'source': 'obofoundry', 'scope': synonym.scope, 'xrefs': [xref.id for xref in synonym.xrefs]}
+                    {'sid': term_sid}, {'name': description},
+                    {'source': 'obofoundry', 'scope': scope, 'xrefs': xrefs}
                 )
 
-            ## other named relationships
-            try:
-                for reltype, targets in term.relationships.items():
-                    for target in targets:
-                        self.term_ontorel_term.add_relationship(
-                            {'sid': term_sid}, {'sid': target.id}, {'source': 'obofoundry', 'type': reltype.id})
-            except KeyError as e:
-                log.error(f"Cannot iterate relationshis of term {term_sid}")
-                log.error(e)
-
-    def clean_obo_file(self, obofile):
-        """
-        Clean format problems.
-
-        :param obofile: Path to OBO file.
-        :return: Path to cleaned file.
-        """
-        log.debug(f"Clean OBI file {obofile}")
-        path = os.path.dirname(obofile)
-        filename = os.path.basename(obofile)
-
-        output_filename = "temp_clean_{}".format(filename)
-        output = os.path.join(path, output_filename)
-        log.debug(f"Write cleaned file to {output}")
-
-        try:
-            os.remove(output)
-        except Exception as e:
-            log.info(e)
-
-        # clean file, dbxref links in def line not well formatted
-        first_term_found = False
-
-        with open(output, 'wt') as out:
-            with open(obofile, 'rt') as f:
-                for l in f:
-                    # check if first term was found (= skip header)
-                    if not first_term_found:
-                        if '[Term]' in l:
-                            first_term_found = True
-                    if first_term_found:
-                        # clean xref def
-                        l = self.remove_space_from_xref(l)
-
-                    out.write(l)
-
-        return output
-
-    def remove_space_from_xref(self, line):
-        """
-        Clean up xref definitions in a way that all spaces are removed or replaced by an underscore.
-
-        - [EC: 1.2.3.4] is bad, no space after EC: [EC:1.2.3.4] is correct
-        - [TAO:Arratia and Schultze_1992] is bad, replace space with underscore
-
-        :param line:
-        :return:
-        """
-        # check if line contains xrefs
-        line = line.strip()
-        # if the line ends with ']]' there are malformatted xrefs
-        # such as [ISBN 3-89937-052-X [Goujet and Young\, 2004\]]
-        if line.endswith(']]'):
-            if '[' in line:
-                # get all occurences of '['
-                all_open_brackets = [m.start() for m in re.finditer('\[', line)]
-                index_second_last_open_bracket = all_open_brackets[-2]
-                str_before_bracket = line[:index_second_last_open_bracket]
-                str_xref_def = line[index_second_last_open_bracket:]
-
-                line = str_before_bracket + '[' + self.clean_string_xref_element(str_xref_def) + ']'
-
-        elif line.endswith(']') and line != '[Term]' and line != '[Typedef]':
-            if '[' in line:
-                # find last '[' bracket
-                xref_open_bracket_index = line.rfind('[')
-
-                str_before_bracket = line[:xref_open_bracket_index]
-                str_xref_def = line[xref_open_bracket_index:]
-
-                # split up the xref def
-                cleaned_xref_strings = []
-
-                # first handle lists xref defs with proper key:value
-                if ':' in str_xref_def and ', ' in str_xref_def:
-                    for xref in str_xref_def[1:-1].split(','):
-                        if ':' in xref:
-                            cleaned_xref = self.clean_key_value_xref_element(xref)
-                            # if there is wrong formatting, the cleaning function returns non
-                            if cleaned_xref:
-                                cleaned_xref_strings.append(cleaned_xref)
-                        else:
-                            cleaned_xref = self.clean_string_xref_element(xref)
-                            # if there is wrong formatting, the cleaning function returns non
-                            if cleaned_xref:
-                                cleaned_xref_strings.append(cleaned_xref)
-
-                # then handle single xref defs
-                elif ':' in str_xref_def and ', ' not in str_xref_def:
-                    cleaned_xref = self.clean_key_value_xref_element(str_xref_def[1:-1])
-                    # if there is wrong formatting, the cleaning function returns non
-                    if cleaned_xref:
-                        cleaned_xref_strings.append(cleaned_xref)
-
-                else:
-                    cleaned_xref = self.clean_string_xref_element(str_xref_def[1:-1])
-                    if cleaned_xref:
-                        cleaned_xref_strings.append(cleaned_xref)
-
-                if cleaned_xref_strings:
-                    cleaned_xref_def = ''.join(['[', ', '.join(cleaned_xref_strings), ']'])
-                else:
-                    cleaned_xref_def = '[]'
-
-                line = str_before_bracket + cleaned_xref_def
-
-        return line + '\n'
-
-    @staticmethod
-    def clean_key_value_xref_element(xref):
-        """
-        Takes an xref element with key and value and cleans it up.
-
-        :param xref: The xref element.
-        :return: The cleaned xref element
-        """
-        xref = xref.strip()
-
-        k, v = xref.split(':', 1)
-        # remove ' ' in key
-        k = k.replace(' ', '').replace('\\', '')
-
-        # remove starting ' ' in value
-        if v.startswith(' '):
-            v = v[1:]
-        # remove trailing ',' in value
-        if v.endswith(','):
-            v = v[:-1]
-        # replace all other spaces with underscore
-        v = v.replace(' ', '_').replace('\\', '')
-
-        # some values contain subvalues (wrong formatting)
-        # [GO:[GOC:mtg_sensu, ISBN:0198547684]
-        # simply remove those elements
-        if not v.startswith('[') and not v.endswith(']'):
-            return f"{k}:{v}"
-
-    @staticmethod
-    def clean_string_xref_element(xref):
-
-        cleaned_string = xref.strip().replace(' ', '_').replace('\\', '').replace('[', '').replace(']', '')
-        if "ISBN" in xref:
-            print(xref)
-            print(cleaned_string)
-
-        return cleaned_string
+            # other named relationships
+            for reltype, target in term['relationships']:
+                self.term_ontorel_term.add_relationship(
+                    {'sid': term_sid}, {'sid': target}, {'source': 'obofoundry', 'type': reltype})
 
     def run_with_mounted_arguments(self):
         self.run(self.ontology_name)
@@ -282,17 +326,51 @@ class OboFoundryParser(ReturnParser):
         Parse a specific ontology by name.
         :param ontology_name: The ontology name (e.g. go, uberon)
         """
-        if ontology_name in OBO_FILE_MAPPINGS:
-            obo_filename = OBO_FILE_MAPPINGS[ontology_name]
-        else:
-            obo_filename = "{}.obo".format(ontology_name)
+        obo_file_path = self.obo_instance.get_file_from_directory(ontology_name, get_obo_filename(ontology_name))
+        self.parse_file(obo_file_path)
 
-        obo_file_path = self.obo_instance.get_file_from_directory(ontology_name, obo_filename)
+    def parse_file(self, obo_file_path):
+        """
+        Parse an OBO file with the configured backend and cache.
 
-        # clean obo files
-        cleaned_file = self.clean_obo_file(obo_file_path)
+        :param obo_file_path: Path to the OBO file.
+        """
+        if self.cache_dir:
+            metadata, terms = cached_ontology(self.cache_dir, obo_file_path,
+                                              cache_key_prefix(self.__class__.__name__, self.obo_backend),
+                                              self.read_ontology)
+            self.add_ontology(metadata, terms)
+            return
+
+        # clean obo files while they are read
+        with open_clean_obo(obo_file_path) as cleaned_file:
+            metadata, terms = self.read_ontology(cleaned_file)
+            self.add_ontology(metadata, terms)
+
+    def run_all(self, shard_dir, ontology_names=None):
+        """
+        Parse all downloaded ontologies in parallel, the output of each ontology is written to
+        `shard_dir/ontology_name`. The NodeSets of this parser stay empty.
 
-        self.parse_obo_file(cleaned_file)
+        :param shard_dir: The output directory.
+        :param ontology_names: Only parse these ontologies (optional).
+        :return: Dictionary of ontology name -> error of the ontologies that failed.
+        """
+        obo_files = find_obo_files(self.obo_instance.instance_dir)
+        if ontology_names:
+            obo_files = {k: v for k, v in obo_files.items() if k in ontology_names}
+
+        errors = {}
+        for ontology_name, shard_path, error in parse_ontologies_parallel(
+                obo_files, shard_dir, self.workers, memory_budget=self.memory_budget,
+                obo_backend=self.obo_backend, cache_dir=self.cache_dir):
+            if error:
+                errors[ontology_name] = error
+            else:
+                log.info(f"Wrote ontology {ontology_name} to {shard_path}")
+
+        log.info(f"Parsed {len(obo_files) - len(errors)} of {len(obo_files)} ontologies")
+        return errors
 
     def get_obofile_table(self):
         """
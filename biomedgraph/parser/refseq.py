@@ -1,9 +1,13 @@
 import gzip
 import logging
+import os
 
 from graphpipeline.parser import ReturnParser
 from graphio import NodeSet, RelationshipSet
 
+from biomedgraph.parser.helper.accession import AccessionSet, AccessionPairSet
+from biomedgraph.parser.helper.taxid import taxid_list, taxid_sets
+
 log = logging.getLogger(__name__)
 
 
@@ -25,7 +29,12 @@ class RefseqEntityParser(ReturnParser):
     Example line: TaxID, organism, ID, taxonomy, status, length
 
         9606    Homo sapiens    NM_000035.3     complete|vertebrate_mammalian   REVIEWED        2426
+
+    The parser can run on a list of taxids, the catalog is then read only once. Each taxid gets its
+    own NodeSets (see `biomedgraph.parser.helper.taxid.taxid_sets`).
     """
+    SETS = ['transcripts', 'proteins']
+
     def __init__(self):
 
         super(RefseqEntityParser, self).__init__()
@@ -34,23 +43,32 @@ class RefseqEntityParser(ReturnParser):
         self.arguments = ['taxid']
 
         # define NodeSet and RelationshipSet
-        self.transcripts = NodeSet(['Transcript'], merge_keys=['sid'], default_props={'source': 'refseq'})
-        self.proteins = NodeSet(['Protein'], merge_keys=['sid'], default_props={'source': 'refseq'})
+        self.transcripts, self.proteins = self.create_sets()
+
+    @staticmethod
+    def create_sets():
+        transcripts = NodeSet(['Transcript'], merge_keys=['sid'], default_props={'source': 'refseq'})
+        proteins = NodeSet(['Protein'], merge_keys=['sid'], default_props={'source': 'refseq'})
+        return transcripts, proteins
 
     def run_with_mounted_arguments(self):
         self.run(self.taxid)
 
     def run(self, taxid):
+        """
+        :param taxid: A taxid or a list of taxids.
+        """
+        taxids = taxid_list(taxid)
 
         refseq_instance = self.get_instance_by_name('Refseq')
         refseq_catalog_file = refseq_instance.datasource.get_catalog_file_path(refseq_instance)
 
-        datasource_name = refseq_instance.datasource.name
+        sets_by_taxid = taxid_sets(self, taxids, self.SETS)
 
         with gzip.open(refseq_catalog_file, 'rt') as f:
 
-            check_transcripts = set()
-            check_proteins = set()
+            check_transcripts = AccessionSet()
+            check_proteins = AccessionSet()
 
             for l in f:
                 flds = l.rstrip().split('\t')
@@ -58,7 +76,9 @@ class RefseqEntityParser(ReturnParser):
                 if len(flds) >= 6:
                     this_taxid = flds[0]
 
-                    if this_taxid == taxid:
+                    if this_taxid in sets_by_taxid:
+                        transcripts, proteins = sets_by_taxid[this_taxid]
+
                         refseq_acc, version = flds[2].split('.')
                         status = flds[4]
                         length = flds[5]
@@ -68,20 +88,20 @@ class RefseqEntityParser(ReturnParser):
                         if refseq_acc.startswith('NM') or refseq_acc.startswith('NR') or refseq_acc.startswith(
                                 "XM") or refseq_acc.startswith("XR"):
                             if refseq_acc not in check_transcripts:
-                                self.transcripts.add_node(
+                                transcripts.add_node(
                                     {'sid': refseq_acc, 'version': version, 'status': status,
                                      'length': length,
-                                     'taxid': taxid}
+                                     'taxid': this_taxid}
                                 )
 
                                 check_transcripts.add(refseq_acc)
                         # protein
                         if refseq_acc.startswith('NP') or refseq_acc.startswith('XP'):
                             if refseq_acc not in check_proteins:
-                                self.proteins.add_node(
+                                proteins.add_node(
                                     {'sid': refseq_acc, 'version': version, 'status': status,
                                      'length': length,
-                                     'taxid': taxid})
+                                     'taxid': this_taxid})
                                 check_proteins.add(refseq_acc)
 
 
@@ -93,27 +113,47 @@ class RefseqRemovedRecordsParser(ReturnParser):
 
     Simple approach is to collect all files from all previous releases and collect all records (relationships
     are filtered locally).
+
+    If the RefSeq instance has a taxid-partitioned archive store (see
+    `biomedgraph.datasources.refseq.consolidate_archived_releases`) only the partitions of the requested
+    taxids are read, otherwise all release files of the instance are scanned.
     """
+    SETS = ['legacy_transcripts', 'legacy_transcript_now_transcript', 'legacy_proteins', 'legacy_protein_now_protein',
+            'gene_codes_legacy_transcript', 'legacy_transcript_codes_protein']
+
     def __init__(self):
         super(RefseqRemovedRecordsParser, self).__init__()
 
         self.arguments = ['taxid']
 
-        self.legacy_ids = set()
+        self.legacy_ids = AccessionSet()
+
+        (self.legacy_transcripts, self.legacy_transcript_now_transcript, self.legacy_proteins,
+         self.legacy_protein_now_protein, self.gene_codes_legacy_transcript,
+         self.legacy_transcript_codes_protein) = self.create_sets()
 
-        self.legacy_transcripts = NodeSet(['Transcript', 'Legacy'], merge_keys=['sid'], default_props={'source': 'refseq'})
-        self.legacy_transcript_now_transcript = RelationshipSet('REPLACED_BY', ['Transcript'], ['Transcript'], ['sid'], ['sid'], default_props={'source': 'refseq'})
-        self.legacy_proteins = NodeSet(['Protein', 'Legacy'], merge_keys=['sid'], default_props={'source': 'refseq'})
-        self.legacy_protein_now_protein = RelationshipSet('REPLACED_BY', ['Protein'], ['Protein'],
-                                                                ['sid'], ['sid'], default_props={'source': 'refseq'})
-        self.gene_codes_legacy_transcript = RelationshipSet('CODES', ['Gene'], ['Transcript', 'Legacy'], ['sid'], ['sid'], default_props={'source': 'refseq'})
-        self.legacy_transcript_codes_protein = RelationshipSet('CODES', ['Transcript', 'Legacy'], ['Protein'],
-                                                               ['sid'], ['sid'], default_props={'source': 'refseq'})
+        self.sets_by_taxid = {}
+
+    @staticmethod
+    def create_sets():
+        legacy_transcripts = NodeSet(['Transcript', 'Legacy'], merge_keys=['sid'], default_props={'source': 'refseq'})
+        legacy_transcript_now_transcript = RelationshipSet('REPLACED_BY', ['Transcript'], ['Transcript'], ['sid'], ['sid'], default_props={'source': 'refseq'})
+        legacy_proteins = NodeSet(['Protein', 'Legacy'], merge_keys=['sid'], default_props={'source': 'refseq'})
+        legacy_protein_now_protein = RelationshipSet('REPLACED_BY', ['Protein'], ['Protein'],
+                                                     ['sid'], ['sid'], default_props={'source': 'refseq'})
+        gene_codes_legacy_transcript = RelationshipSet('CODES', ['Gene'], ['Transcript', 'Legacy'], ['sid'], ['sid'], default_props={'source': 'refseq'})
+        legacy_transcript_codes_protein = RelationshipSet('CODES', ['Transcript', 'Legacy'], ['Protein'],
+                                                          ['sid'], ['sid'], default_props={'source': 'refseq'})
+        return (legacy_transcripts, legacy_transcript_now_transcript, legacy_proteins, legacy_protein_now_protein,
+                gene_codes_legacy_transcript, legacy_transcript_codes_protein)
 
     def run_with_mounted_arguments(self):
         self.run(self.taxid)
 
     def run(self, taxid):
+        """
+        :param taxid: A taxid or a list of taxids, all taxids are parsed in one pass over the archive files.
+        """
         # get the nodes first, this also creates a set of all legacy IDs
         self.get_legacy_nodes(taxid)
         # then get the relationnships to gene IDs, this uses the set of legacy IDs to not recreate existing relationships
@@ -164,53 +204,50 @@ class RefseqRemovedRecordsParser(ReturnParser):
         :return:
         """
         refseq_instance = self.get_instance_by_name('Refseq')
+        sets_by_taxid = self._get_sets_by_taxid(taxid)
+
+        for release, flds in self._iter_archive(refseq_instance, 'removed-records', list(sets_by_taxid)):
+            this_taxid = flds[0]
+
+            if this_taxid in sets_by_taxid:
+                (legacy_transcripts, legacy_transcript_now_transcript, legacy_proteins,
+                 legacy_protein_now_protein, _, _) = sets_by_taxid[this_taxid]
+
+                refseq_acc, version = flds[2].split('.')
+                reason = flds[-1]
+                # transcript
+                if refseq_acc.startswith('NM') or refseq_acc.startswith('NR') or refseq_acc.startswith(
+                        "XM") or refseq_acc.startswith("XR"):
+                    if refseq_acc not in self.legacy_ids:
+                        legacy_transcripts.add_node(
+                            {'sid': refseq_acc, 'version': version,
+                             'status': 'removed', 'removed_in': release, 'reason': reason,
+                             'taxid': this_taxid}
+                        )
 
-        removed_records_files = refseq_instance.find_files(lambda x: 'removed-records' in x and x.endswith('.gz'))
-
-        for file in removed_records_files:
-            log.debug(f"Parse {file}")
-            release = file.split('/')[-1].split('.')[0].replace('release', '')
-            with gzip.open(file, 'rt') as f:
-                for l in f:
-                    flds = l.strip().split('\t')
-                    this_taxid = flds[0]
-
-                    if this_taxid == taxid:
-                        refseq_acc, version = flds[2].split('.')
-                        reason = flds[-1]
-                        # transcript
-                        if refseq_acc.startswith('NM') or refseq_acc.startswith('NR') or refseq_acc.startswith(
-                                "XM") or refseq_acc.startswith("XR"):
-                            if refseq_acc not in self.legacy_ids:
-                                self.legacy_transcripts.add_node(
-                                    {'sid': refseq_acc, 'version': version,
-                                     'status': 'removed', 'removed_in': release, 'reason': reason,
-                                     'taxid': taxid}
-                                )
-
-                                self.legacy_ids.add(refseq_acc)
+                        self.legacy_ids.add(refseq_acc)
 
-                                if 'replaced by' in reason:
-                                    # replaced by NM_022375 -> NM_022375
-                                    new_accession = (reason.rsplit(' ', 1)[1]).split('.')[0]
-                                    self.legacy_transcript_now_transcript.add_relationship(
-                                        {'sid': refseq_acc}, {'sid': new_accession}, {}
-                                    )
-                        # protein
-                        if refseq_acc.startswith('NP') or refseq_acc.startswith('XP'):
-                            if refseq_acc not in self.legacy_ids:
-                                self.legacy_proteins.add_node(
-                                    {'sid': refseq_acc, 'version': version,
-                                     'status': 'removed', 'removed_in': release, 'reason': reason,
-                                     'taxid': taxid})
-                                self.legacy_ids.add(refseq_acc)
-
-                                if 'replaced by' in reason:
-                                    # replaced by NM_022375 -> NM_022375
-                                    new_accession = (reason.rsplit(' ', 1)[1]).split('.')[0]
-                                    self.legacy_protein_now_protein.add_relationship(
-                                        {'sid': refseq_acc}, {'sid': new_accession}, {}
-                                    )
+                        if 'replaced by' in reason:
+                            # replaced by NM_022375 -> NM_022375
+                            new_accession = (reason.rsplit(' ', 1)[1]).split('.')[0]
+                            legacy_transcript_now_transcript.add_relationship(
+                                {'sid': refseq_acc}, {'sid': new_accession}, {}
+                            )
+                # protein
+                if refseq_acc.startswith('NP') or refseq_acc.startswith('XP'):
+                    if refseq_acc not in self.legacy_ids:
+                        legacy_proteins.add_node(
+                            {'sid': refseq_acc, 'version': version,
+                             'status': 'removed', 'removed_in': release, 'reason': reason,
+                             'taxid': this_taxid})
+                        self.legacy_ids.add(refseq_acc)
+
+                        if 'replaced by' in reason:
+                            # replaced by NM_022375 -> NM_022375
+                            new_accession = (reason.rsplit(' ', 1)[1]).split('.')[0]
+                            legacy_protein_now_protein.add_relationship(
+                                {'sid': refseq_acc}, {'sid': new_accession}, {}
+                            )
 
     def get_legacy_gene_rels(self, taxid):
         """
@@ -238,41 +275,71 @@ class RefseqRemovedRecordsParser(ReturnParser):
         """
         log.debug("Get relationships from legacy RefSeq IDs to genes.")
         refseq_instance = self.get_instance_by_name('Refseq')
+        sets_by_taxid = self._get_sets_by_taxid(taxid)
+
+        check_set = AccessionPairSet()
+        for _, flds in self._iter_archive(refseq_instance, 'accession2geneid', list(sets_by_taxid)):
+            this_taxid = flds[0]
+            if this_taxid in sets_by_taxid:
+                _, _, _, _, gene_codes_legacy_transcript, legacy_transcript_codes_protein = sets_by_taxid[this_taxid]
+
+                gene_id = flds[1].strip()
+                transcript_accession = flds[2].strip().split('.')[0]
+                protein_accession = flds[3].strip().split('.')[0]
+                if transcript_accession in self.legacy_ids:
+                    if (gene_id, transcript_accession) not in check_set:
+                        gene_codes_legacy_transcript.add_relationship(
+                            {'sid': gene_id}, {'sid': transcript_accession}, {}
+                        )
+                        check_set.add((gene_id, transcript_accession))
+                    if protein_accession != 'na':
+                        if (transcript_accession, protein_accession) not in check_set:
+                            legacy_transcript_codes_protein.add_relationship(
+                                {'sid': transcript_accession}, {'sid': protein_accession}, {}
+                            )
+                            check_set.add((transcript_accession, protein_accession))
 
-        archived_accession2geneid = refseq_instance.find_files(lambda x: 'accession2geneid' in x and x.endswith('.gz'))
-        check_set = set()
-        for file in archived_accession2geneid:
-            log.debug(f"Parse {file}")
+    @staticmethod
+    def _iter_archive(refseq_instance, file_type, taxids):
+        """
+        Iterate the lines of all releases of a file type.
 
-            with gzip.open(file, 'rt') as f:
-                for l in f:
-                    flds = l.strip().split('\t')
-                    this_taxid = flds[0]
-                    if this_taxid == taxid:
-                        """
-                                    1: Taxonomic ID
-            2: Entrez GeneID
-            3: Transcript accession.version
-            4: Protein accession.version
-               na if no data
-               --for example, the NR_ accession prefix is used for RNA
-                 so there is no corresponding protein record
-                        """
-                        gene_id = flds[1].strip()
-                        transcript_accession = flds[2].strip().split('.')[0]
-                        protein_accession = flds[3].strip().split('.')[0]
-                        if transcript_accession in self.legacy_ids:
-                            if (gene_id, transcript_accession) not in check_set:
-                                self.gene_codes_legacy_transcript.add_relationship(
-                                    {'sid': gene_id}, {'sid': transcript_accession}, {}
-                                )
-                                check_set.add((gene_id, transcript_accession))
-                            if transcript_accession != 'na':
-                                if (transcript_accession, protein_accession) not in check_set:
-                                    self.legacy_transcript_codes_protein.add_relationship(
-                                        {'sid': transcript_accession}, {'sid': protein_accession}, {}
-                                    )
-                                    check_set.add((transcript_accession, protein_accession))
+        Reads the partitions of the archive store if available, all release files of the instance otherwise.
+        In the latter case lines of other taxids are returned as well.
+
+        :param refseq_instance: The RefSeq DataSource instance.
+        :param file_type: 'removed-records' or 'accession2geneid'
+        :param taxids: List of taxids.
+        :return: Iterator of (release, fields) tuples.
+        """
+        partition_files = refseq_instance.datasource.get_archive_partition_files(refseq_instance, file_type, taxids)
+
+        if partition_files is not None:
+            for file in partition_files:
+                log.debug(f"Parse {file}")
+                with gzip.open(file, 'rt') as f:
+                    for l in f:
+                        release, line = l.split('\t', 1)
+                        yield release, line.strip().split('\t')
+        else:
+            files = refseq_instance.find_files(
+                lambda x: os.path.basename(x).startswith('release') and file_type in x and x.endswith('.gz')
+            )
+            for file in files:
+                log.debug(f"Parse {file}")
+                release = file.split('/')[-1].split('.')[0].replace('release', '')
+                with gzip.open(file, 'rt') as f:
+                    for l in f:
+                        yield release, l.strip().split('\t')
+
+    def _get_sets_by_taxid(self, taxid):
+        """
+        Output sets by taxid, created on first use and shared by `get_legacy_nodes` and `get_legacy_gene_rels`.
+        """
+        taxids = taxid_list(taxid)
+        if set(self.sets_by_taxid) != set(taxids):
+            self.sets_by_taxid = taxid_sets(self, taxids, self.SETS)
+        return self.sets_by_taxid
 
 
 class RefseqCodesParser(ReturnParser):
@@ -291,6 +358,8 @@ class RefseqCodesParser(ReturnParser):
         :return: List of (Gene)-[CODES]-(Transcript) Relationships
         """
 
+    SETS = ['gene_codes_transcript', 'transcript_codes_protein']
+
     def __init__(self):
         """
         :param refseq_instance: The RefSeq DataSource instance.
@@ -301,50 +370,62 @@ class RefseqCodesParser(ReturnParser):
         self.arguments = ['taxid']
 
         # define NodeSet and RelationshipSet
-        self.gene_codes_transcript = RelationshipSet('CODES', ['Gene'], ['Transcript'], ['sid'], ['sid'], default_props={'source': 'refseq'})
-        self.transcript_codes_protein = RelationshipSet('CODES', ['Transcript'], ['Protein'], ['sid'], ['sid'], default_props={'source': 'refseq'})
+        self.gene_codes_transcript, self.transcript_codes_protein = self.create_sets()
+
+    @staticmethod
+    def create_sets():
+        gene_codes_transcript = RelationshipSet('CODES', ['Gene'], ['Transcript'], ['sid'], ['sid'], default_props={'source': 'refseq'})
+        transcript_codes_protein = RelationshipSet('CODES', ['Transcript'], ['Protein'], ['sid'], ['sid'], default_props={'source': 'refseq'})
+        return gene_codes_transcript, transcript_codes_protein
 
     def run_with_mounted_arguments(self):
         self.run(self.taxid)
 
     def run(self, taxid):
+        """
+        :param taxid: A taxid or a list of taxids, all taxids are parsed in one pass over the file.
+        """
         refseq_instance = self.get_instance_by_name('Refseq')
-        datasource_name = refseq_instance.datasource.name
 
         refseq_accession2geneid_file = refseq_instance.datasource.get_accession2geneid_file_path(refseq_instance)
 
+        sets_by_taxid = taxid_sets(self, taxid_list(taxid), self.SETS)
+
         # check sets to avoid duplicates
-        check_g_t_rels = set()
-        check_t_p_rels = set()
+        check_g_t_rels = AccessionPairSet()
+        check_t_p_rels = AccessionPairSet()
 
         with gzip.open(refseq_accession2geneid_file, 'rt') as f:
             for l in f:
                 flds = l.strip().split('\t')
 
                 this_taxid = flds[0]
-                gene_id = flds[1]
-                transcript_id = flds[2].split('.')[0]
-                protein_id = flds[3].split('.')[0]
 
-                if this_taxid == taxid:
+                if this_taxid in sets_by_taxid:
+                    gene_codes_transcript, transcript_codes_protein = sets_by_taxid[this_taxid]
+
+                    gene_id = flds[1]
+                    transcript_id = flds[2].split('.')[0]
+                    protein_id = flds[3].split('.')[0]
+
                     # gene-transcript or transcript-protein pairs can be duplicate
                     # if e.g. a gene has one transcript which gives rise to two proteins
                     # we thus check for each pair if it was added already
-                    if gene_id + transcript_id not in check_g_t_rels:
-                        self.gene_codes_transcript.add_relationship(
+                    if (gene_id, transcript_id) not in check_g_t_rels:
+                        gene_codes_transcript.add_relationship(
                             {'sid': gene_id}, {'sid': transcript_id},
-                            {'taxid': taxid}
+                            {'taxid': this_taxid}
                         )
-                        check_g_t_rels.add(gene_id + transcript_id)
+                        check_g_t_rels.add((gene_id, transcript_id))
 
                     # the gene/transcript relationship is mostly clear
                     # but often there are no proteins associated
                     if protein_id != 'na':
-                        if transcript_id + protein_id not in check_t_p_rels:
-                            self.transcript_codes_protein.add_relationship(
+                        if (transcript_id, protein_id) not in check_t_p_rels:
+                            transcript_codes_protein.add_relationship(
                                 {'sid': transcript_id},
                                 {'sid': protein_id},
-                                {'taxid': taxid}
+                                {'taxid': this_taxid}
                             )
 
-                            check_t_p_rels.add(transcript_id + protein_id)
+                            check_t_p_rels.add((transcript_id, protein_id))
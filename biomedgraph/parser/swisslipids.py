@@ -4,6 +4,8 @@ import logging
 from graphpipeline.parser import ReturnParser
 from graphio import NodeSet, RelationshipSet
 
+from biomedgraph.parser.helper.uniprot import resolve_accessions
+
 log = logging.getLogger(__name__)
 
 
@@ -13,6 +15,11 @@ class SwissLipidsParser(ReturnParser):
 
         super(SwissLipidsParser, self).__init__()
 
+        # optional secondary -> primary UniProt accession index (see UniprotKnowledgebaseParser), the index is
+        # written per taxid and SwissLipids covers many species: use a list with the index of each taxid,
+        # accessions of species without index are not resolved
+        self.secondary_accession_index = None
+
         # define NodeSet and RelationshipSet
         self.lipids = NodeSet(['Lipid'], merge_keys=['sid'])
 
@@ -207,6 +214,8 @@ class SwissLipidsParser(ReturnParser):
         """
         lipids_2_protein_file = instance.get_file('lipids2uniprot.tsv.gz')
 
+        # (SwissLipids ID, UniProt ID, mapping level), UniProt IDs are resolved at the end
+        associations = []
 
         # iterate file
         with gzip.open(lipids_2_protein_file, 'rt', errors="replace") as f:
@@ -227,6 +236,15 @@ class SwissLipidsParser(ReturnParser):
                         uniprot_ids.add(u)
 
                 for up in uniprot_ids:
-                    self.lipid_associates_protein.add_relationship(
-                        {'sid': swisslipids_id}, {'sid': up}, {'source': 'swisslipids', 'level': mapping_level}
-                    )
+                    associations.append((swisslipids_id, up, mapping_level))
+
+        uniprot_ids = resolve_accessions(self.secondary_accession_index, [x[1] for x in associations])
+        # two accessions can resolve to the same primary accession
+        check_associations = set()
+        for (swisslipids_id, _, mapping_level), up in zip(associations, uniprot_ids):
+            if (swisslipids_id, up) in check_associations:
+                continue
+            check_associations.add((swisslipids_id, up))
+            self.lipid_associates_protein.add_relationship(
+                {'sid': swisslipids_id}, {'sid': up}, {'source': 'swisslipids', 'level': mapping_level}
+            )
@@ -1,16 +1,158 @@
 import gzip
+import io
 import logging
+from concurrent.futures import ProcessPoolExecutor
+from queue import Queue
+from threading import Thread
 
+import pandas
 from graphpipeline.parser import ReturnParser
-from graphpipeline.parser import EMBLReaderUniProt
 from graphio import NodeSet, RelationshipSet
 
+from biomedgraph.parser.helper.uniprot import read_uniprot_records, write_secondary_accession_index
+
 TAXID_OS_NAME = {'9606': 'Human',
                  '10090': 'Mouse'}
 
+# a UniProt flat file record ends with a line '//'
+RECORD_END = b'\n//\n'
+# cross references used by the parser
+DR_DATABASES = ['RefSeq', 'Ensembl']
+
+# columns of idmapping_selected.tab used by the UniprotMappingParser
+IDMAPPING_SELECTED_COLUMNS = {0: 'UniProtKB-AC', 3: 'RefSeq', 12: 'NCBI-taxon', 19: 'Ensembl_TRS', 20: 'Ensembl_PRO'}
+IDMAPPING_COLUMNS = ['UniProtKB-AC', 'type', 'id']
+
 log = logging.getLogger(__name__)
 
 
+def extract_record(record, os_string_id):
+    """
+    Get the data used by the UniprotKnowledgebaseParser from a record.
+
+    :param record: Record returned by `read_uniprot_records`.
+    :param os_string_id: String to search in the OS line (e.g. 'Human').
+    :return: Tuple (accessions, name, description, RefSeq IDs, Ensembl (transcript, protein) IDs) or None if
+        the record is from another organism.
+    """
+    if os_string_id not in record['OS']:
+        return None
+
+    desc = record['DE']
+    rec_name = desc.split(';')[0].split('Full=')[1]
+
+    refseq_ids = []
+    ensembl_ids = []
+    for db, ids in record['DR']:
+        if db == 'RefSeq':
+            # ('RefSeq', ['NP_003395.1', 'NM_003404.4']), remove version
+            refseq_ids.extend(refseq_id.split('.')[0] for refseq_id in ids)
+        elif db == 'Ensembl':
+            # ('Ensembl', ['ENST00000353703', 'ENSP00000300161', 'ENSG00000166913'])
+            ensembl_ids.append((ids[0], ids[1]))
+
+    return record['AC'], rec_name, desc, refseq_ids, ensembl_ids
+
+
+def iterate_knowledgebase_records(kb_file, os_string_id, dr_databases=DR_DATABASES):
+    """
+    Parse a knowledgebase file and yield the extracted records of an organism (see `extract_record`).
+
+    :param kb_file: Path to the gzipped UniProt flat file.
+    :param os_string_id: String to search in the OS line (e.g. 'Human').
+    :param dr_databases: Cross references to read, an empty list to skip all.
+    """
+    log.debug(f"Parsing {kb_file}")
+    with gzip.open(kb_file, 'rt') as f:
+        for record in read_uniprot_records(f, os_string_id=os_string_id, dr_databases=dr_databases):
+            yield extract_record(record, os_string_id)
+
+
+def split_knowledgebase_file(kb_file, chunk_size):
+    """
+    Decompress a knowledgebase file and split it into chunks that contain complete records.
+
+    :param kb_file: Path to the gzipped UniProt flat file.
+    :param chunk_size: Approximate size of the chunks in bytes (decompressed).
+    :return: Iterator of chunks (bytes).
+    """
+    rest = b''
+    with gzip.open(kb_file, 'rb') as f:
+        while True:
+            data = f.read(chunk_size)
+            if not data:
+                break
+            data = rest + data
+            # cut after the last complete record
+            end = data.rfind(RECORD_END)
+            if end == -1:
+                rest = data
+                continue
+            end += len(RECORD_END)
+            yield data[:end]
+            rest = data[end:]
+    if rest.strip():
+        yield rest
+
+
+def parse_knowledgebase_chunk(chunk, os_string_id, dr_databases=DR_DATABASES):
+    """
+    Parse a chunk of a knowledgebase file (runs in a worker process).
+
+    :param chunk: Complete records (bytes).
+    :param os_string_id: String to search in the OS line (e.g. 'Human').
+    :param dr_databases: Cross references to read, an empty list to skip all.
+    :return: List of extracted records (see `extract_record`).
+    """
+    records = read_uniprot_records(io.StringIO(chunk.decode()), os_string_id=os_string_id,
+                                   dr_databases=dr_databases)
+    return [extract_record(record, os_string_id) for record in records]
+
+
+def _submit_chunks(executor, kb_file, os_string_id, dr_databases, chunk_size, futures):
+    try:
+        for chunk in split_knowledgebase_file(kb_file, chunk_size):
+            futures.put(executor.submit(parse_knowledgebase_chunk, chunk, os_string_id, dr_databases))
+    except Exception as e:
+        futures.put(e)
+    futures.put(None)
+
+
+def iterate_knowledgebase_records_parallel(kb_files, os_string_id, workers, dr_databases=DR_DATABASES,
+                                           chunk_size=8 * 1024 * 1024):
+    """
+    Parse knowledgebase files in a process pool and yield the extracted records of an organism.
+
+    One thread per file decompresses the file and submits record-aligned chunks to a shared process pool,
+    all files are parsed concurrently. The results are returned in the order of the files and of the
+    chunks within a file, i.e. in the same order as `iterate_knowledgebase_records`. The number of chunks
+    waiting to be returned is limited per file.
+
+    :param kb_files: List of paths to gzipped UniProt flat files.
+    :param os_string_id: String to search in the OS line (e.g. 'Human').
+    :param workers: Number of worker processes.
+    :param dr_databases: Cross references to read, an empty list to skip all.
+    :param chunk_size: Approximate size of the chunks in bytes (decompressed).
+    """
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        file_futures = []
+        for kb_file in kb_files:
+            log.debug(f"Parsing {kb_file} with {workers} workers")
+            futures = Queue(maxsize=workers)
+            Thread(target=_submit_chunks, args=(executor, kb_file, os_string_id, dr_databases, chunk_size, futures),
+                   daemon=True).start()
+            file_futures.append(futures)
+
+        for futures in file_futures:
+            while True:
+                future = futures.get()
+                if future is None:
+                    break
+                if isinstance(future, Exception):
+                    raise future
+                yield from future.result()
+
+
 class UniprotKnowledgebaseParser(ReturnParser):
     """
 
@@ -26,6 +168,13 @@ class UniprotKnowledgebaseParser(ReturnParser):
         DR   RefSeq; NP_006752.1; NM_006761.4. [P62258-1]
 
     The mapping parser returns transcript-protein relationships for both ENSEMBL and RefSeq.
+
+    With `workers` > 1 the files are split into chunks of records which are parsed in a process pool
+    (see `iterate_knowledgebase_records_parallel`), the output is the same as in serial mode.
+
+    If `build_secondary_accession_index` is set, an index of secondary -> primary accessions is written to
+    `Uniprot.get_secondary_accession_index_path`. Other parsers use it to resolve UniProt accessions before
+    the relationships are loaded (see `biomedgraph.parser.helper.uniprot.UniprotAccessionResolver`).
     """
     def __init__(self):
         """
@@ -37,6 +186,13 @@ class UniprotKnowledgebaseParser(ReturnParser):
         # arguments
         self.arguments = ['taxid']
 
+        # number of worker processes, parse in the main process if 1
+        self.workers = 1
+        # create the Transcript/Protein mappings, set to False if they come from the UniprotMappingParser
+        self.mappings = True
+        # write an index of secondary -> primary accessions
+        self.build_secondary_accession_index = False
+
         # NodeSet
         self.proteins = NodeSet(['Protein'], merge_keys=['sid'], default_props={'source': 'uniprot'})
 
@@ -64,96 +220,213 @@ class UniprotKnowledgebaseParser(ReturnParser):
         check_p_m_p = set()
 
         # for now we always run on SPROT and TREMBL
-        for kb_file in knowledgebase_files:
-            log.debug(f"Parsing {kb_file}")
-            with gzip.open(kb_file, 'rt') as f:
-                up_parser = EMBLReaderUniProt(f)
-
-                for record in up_parser.records:
-                    # check taxon
-                    if os_string_id in record['OS']:
-                        # acc
-                        acc_list = record['AC']
-                        primary_acc = acc_list[0]
-                        secondary = acc_list[1:]
-
-                        # (Protein)
-                        # make primary protein with full data
-                        desc = record['DE']
-                        rec_name = desc.split(';')[0].split('Full=')[1]
-
-                        primary_props = {'sid': primary_acc, 'name': rec_name, 'desc': desc, 'category': 'primary',
-                                         'taxid': taxid}
-
-                        if primary_acc not in check_protein:
-                            self.proteins.add_node(primary_props)
-                            check_protein.add(primary_acc)
-
-                        for secondary_acc in secondary:
-                            if secondary_acc not in check_protein:
-                                self.proteins.add_node(
-                                    {'sid': secondary_acc, 'category': 'secondary',
-                                     'taxid': taxid})
-                                check_protein.add(secondary_acc)
-
-                            # (Protein)-[PRIMARY]-(Protein)
-                            if frozenset([primary_acc, secondary_acc]) not in check_p_p_p:
-                                self.protein_primary_protein.add_relationship(
-                                    {'sid': primary_acc}, {'sid': secondary}, {}
-                                )
-                                check_p_p_p.add(frozenset([primary_acc, secondary_acc]))
-
-                        # (Transcript)-[CODES]-(Protein)
-                        # (Protein)-[MAPS]-(Protein)
-                        ## RefSeq
-                        # ('RefSeq', ['NP_003395']),
-                        refseq_mappings = [x[1] for x in record['DR'] if x[0] == 'RefSeq']
-                        for map in refseq_mappings:
-
-                            for refseq_id in map:
-                                # remove version from refseq ID
-                                refseq_id = refseq_id.split('.')[0]
-                                second_letter = refseq_id[1]
-
-                                # (Transcript)-[CODES]-(Protein)
-                                if second_letter == 'M' or second_letter == 'R':
-                                    for uniprot_acc in acc_list:
-                                        if refseq_id + uniprot_acc not in check_t_c_p:
-                                            self.transcript_codes_protein.add_relationship(
-                                                {'sid': refseq_id}, {'sid': uniprot_acc},
-                                                {'source': datasource_name}
-                                            )
-                                            check_t_c_p.add(refseq_id + uniprot_acc)
-
-                                # (Protein)-[MAPS]-(Protein)
-                                if second_letter == 'P':
-                                    for uniprot_acc in acc_list:
-                                        if uniprot_acc + refseq_id not in check_p_m_p:
-                                            self.protein_maps_protein.add_relationship(
-                                                {'sid': uniprot_acc}, {'sid': refseq_id},
-                                                {}
-                                            )
-                                            check_p_m_p.add(uniprot_acc + refseq_id)
-
-                        ## ensembl
-                        ensembl_mappings = [x[1] for x in record['DR'] if x[0] == 'Ensembl']
-                        for map in ensembl_mappings:
-                            ensembl_transcript_id = map[0]
-                            ensembl_protein_id = map[1]
-
-                            for uniprot_acc in acc_list:
-                                # (Transcript)-[CODES]-(Protein)
-                                if ensembl_transcript_id + uniprot_acc not in check_t_c_p:
-                                    self.transcript_codes_protein.add_relationship(
-                                        {'sid': ensembl_transcript_id}, {'sid': uniprot_acc},
-                                        {}
-                                    )
-                                    check_t_c_p.add(ensembl_transcript_id + uniprot_acc)
-
-                                # (Protein)-[MAPS]-(Protein)
-                                if ensembl_protein_id + uniprot_acc not in check_p_m_p:
-                                    self.protein_maps_protein.add_relationship(
-                                        {'sid': uniprot_acc}, {'sid': ensembl_protein_id},
-                                        {}
-                                    )
-                                    check_p_m_p.add(ensembl_protein_id + uniprot_acc)
+        dr_databases = DR_DATABASES if self.mappings else []
+        if self.workers > 1:
+            records = iterate_knowledgebase_records_parallel(knowledgebase_files, os_string_id, self.workers,
+                                                             dr_databases=dr_databases)
+        else:
+            records = (record for kb_file in knowledgebase_files
+                       for record in iterate_knowledgebase_records(kb_file, os_string_id, dr_databases))
+
+        accession_lists = []
+
+        for acc_list, rec_name, desc, refseq_ids, ensembl_ids in records:
+            if self.build_secondary_accession_index:
+                accession_lists.append(acc_list)
+
+            # acc
+            primary_acc = acc_list[0]
+            secondary = acc_list[1:]
+
+            # (Protein)
+            # make primary protein with full data
+            primary_props = {'sid': primary_acc, 'name': rec_name, 'desc': desc, 'category': 'primary',
+                             'taxid': taxid}
+
+            if primary_acc not in check_protein:
+                self.proteins.add_node(primary_props)
+                check_protein.add(primary_acc)
+
+            for secondary_acc in secondary:
+                if secondary_acc not in check_protein:
+                    self.proteins.add_node(
+                        {'sid': secondary_acc, 'category': 'secondary',
+                         'taxid': taxid})
+                    check_protein.add(secondary_acc)
+
+                # (Protein)-[PRIMARY]-(Protein)
+                if frozenset([primary_acc, secondary_acc]) not in check_p_p_p:
+                    self.protein_primary_protein.add_relationship(
+                        {'sid': primary_acc}, {'sid': secondary_acc}, {}
+                    )
+                    check_p_p_p.add(frozenset([primary_acc, secondary_acc]))
+
+            # (Transcript)-[CODES]-(Protein)
+            # (Protein)-[MAPS]-(Protein)
+            ## RefSeq
+            for refseq_id in refseq_ids:
+                second_letter = refseq_id[1]
+
+                # (Transcript)-[CODES]-(Protein)
+                if second_letter == 'M' or second_letter == 'R':
+                    for uniprot_acc in acc_list:
+                        if refseq_id + uniprot_acc not in check_t_c_p:
+                            self.transcript_codes_protein.add_relationship(
+                                {'sid': refseq_id}, {'sid': uniprot_acc},
+                                {'source': datasource_name}
+                            )
+                            check_t_c_p.add(refseq_id + uniprot_acc)
+
+                # (Protein)-[MAPS]-(Protein)
+                if second_letter == 'P':
+                    for uniprot_acc in acc_list:
+                        if uniprot_acc + refseq_id not in check_p_m_p:
+                            self.protein_maps_protein.add_relationship(
+                                {'sid': uniprot_acc}, {'sid': refseq_id},
+                                {}
+                            )
+                            check_p_m_p.add(uniprot_acc + refseq_id)
+
+            ## ensembl
+            for ensembl_transcript_id, ensembl_protein_id in ensembl_ids:
+
+                for uniprot_acc in acc_list:
+                    # (Transcript)-[CODES]-(Protein)
+                    if ensembl_transcript_id + uniprot_acc not in check_t_c_p:
+                        self.transcript_codes_protein.add_relationship(
+                            {'sid': ensembl_transcript_id}, {'sid': uniprot_acc},
+                            {}
+                        )
+                        check_t_c_p.add(ensembl_transcript_id + uniprot_acc)
+
+                    # (Protein)-[MAPS]-(Protein)
+                    if ensembl_protein_id + uniprot_acc not in check_p_m_p:
+                        self.protein_maps_protein.add_relationship(
+                            {'sid': uniprot_acc}, {'sid': ensembl_protein_id},
+                            {}
+                        )
+                        check_p_m_p.add(ensembl_protein_id + uniprot_acc)
+
+        if self.build_secondary_accession_index:
+            write_secondary_accession_index(
+                uniprot_instance.datasource.get_secondary_accession_index_path(taxid, uniprot_instance),
+                accession_lists
+            )
+
+
+def read_idmapping_selected(path, taxid, chunksize=500000):
+    """
+    Read the accession, RefSeq and Ensembl columns of an idmapping_selected.tab file for one taxid.
+
+    :param path: Path to the file.
+    :param taxid: The taxid.
+    :param chunksize: Number of lines read at once.
+    :return: DataFrame with the columns in IDMAPPING_SELECTED_COLUMNS.
+    """
+    chunks = []
+    for chunk in pandas.read_csv(path, sep='\t', header=None, usecols=list(IDMAPPING_SELECTED_COLUMNS),
+                                 dtype=str, chunksize=chunksize):
+        chunk = chunk.rename(columns=IDMAPPING_SELECTED_COLUMNS)
+        chunks.append(chunk[chunk['NCBI-taxon'] == taxid])
+    return pandas.concat(chunks, ignore_index=True)
+
+
+def read_idmapping(path, types, chunksize=1000000):
+    """
+    Read the rows of given ID types from an idmapping.dat file.
+
+        P31946    RefSeq_NT    NM_003404.4
+
+    :param path: Path to the file.
+    :param types: List of ID types (e.g. ['RefSeq_NT']).
+    :param chunksize: Number of lines read at once.
+    :return: DataFrame with the columns 'UniProtKB-AC', 'type' and 'id'.
+    """
+    chunks = []
+    for chunk in pandas.read_csv(path, sep='\t', header=None, names=IDMAPPING_COLUMNS, dtype=str,
+                                 chunksize=chunksize):
+        chunks.append(chunk[chunk['type'].isin(types)])
+    return pandas.concat(chunks, ignore_index=True)
+
+
+def explode_mapping(df, column, remove_version=False):
+    """
+    Get (accession, ID) pairs from a column with multiple IDs.
+
+        P31946    NP_003395.1; NP_001295.2    ->    P31946    NP_003395.1
+                                                    P31946    NP_001295.2
+
+    :param df: DataFrame with the column 'UniProtKB-AC'.
+    :param column: The column with IDs separated by '; '.
+    :param remove_version: Remove the version from the IDs.
+    :return: DataFrame with the columns 'accession' and 'id'.
+    """
+    ids = df[column].dropna().str.split('; ')
+    pairs = pandas.DataFrame({'accession': df.loc[ids.index, 'UniProtKB-AC'], 'id': ids}).explode('id')
+    if remove_version:
+        pairs['id'] = pairs['id'].str.split('.', n=1).str[0]
+    return pairs
+
+
+class UniprotMappingParser(ReturnParser):
+    """
+    Get the Transcript/Protein mappings of the UniprotKnowledgebaseParser from the UniProt ID mapping files.
+
+    The tabular idmapping_selected.tab contains one line per UniProt accession with the Ensembl transcripts,
+    Ensembl proteins and RefSeq proteins. RefSeq transcripts are only in the 3 column idmapping.dat:
+
+        P31946    RefSeq_NT    NM_003404.4
+
+    Both files are read with a vectorized column scan which is much faster than parsing the flat files. Set
+    `mappings = False` on the UniprotKnowledgebaseParser to only get the nodes from the flat files.
+
+    In contrast to the flat file parser, only primary accessions are mapped.
+
+    The ID mapping files have to be downloaded with the `idmapping` option of the Uniprot datasource.
+    """
+    def __init__(self):
+        super(UniprotMappingParser, self).__init__()
+
+        # arguments
+        self.arguments = ['taxid']
+
+        # RelationshipSet
+        self.transcript_codes_protein = RelationshipSet('CODES', ['Transcript'], ['Protein'], ['sid'], ['sid'], default_props={'source': 'uniprot'})
+        self.protein_maps_protein = RelationshipSet('MAPS', ['Protein'], ['Protein'], ['sid'], ['sid'], default_props={'source': 'uniprot'})
+
+    def run_with_mounted_arguments(self):
+        self.run(self.taxid)
+
+    def run(self, taxid):
+        uniprot_instance = self.get_instance_by_name('Uniprot')
+
+        selected_file, idmapping_file = uniprot_instance.datasource.get_idmapping_files_for_taxid(
+            taxid, uniprot_instance
+        )
+
+        selected = read_idmapping_selected(selected_file, taxid)
+        refseq_transcripts = read_idmapping(idmapping_file, ['RefSeq_NT'])
+
+        # (Transcript)-[CODES]-(Protein)
+        codes = pandas.concat([
+            explode_mapping(refseq_transcripts, 'id', remove_version=True),
+            explode_mapping(selected, 'Ensembl_TRS')
+        ]).drop_duplicates()
+
+        for accession, transcript_id in codes.itertuples(index=False):
+            self.transcript_codes_protein.add_relationship(
+                {'sid': transcript_id}, {'sid': accession}, {}
+            )
+
+        # (Protein)-[MAPS]-(Protein)
+        maps = pandas.concat([
+            explode_mapping(selected, 'RefSeq', remove_version=True),
+            explode_mapping(selected, 'Ensembl_PRO')
+        ]).drop_duplicates()
+
+        for accession, protein_id in maps.itertuples(index=False):
+            self.protein_maps_protein.add_relationship(
+                {'sid': accession}, {'sid': protein_id}, {}
+            )
+
+        log.info("Mapped {} transcripts and {} proteins from UniProt ID mapping".format(len(codes), len(maps)))
@@ -14,7 +14,7 @@ setup(name='biomedgraph',
       license='MIT License',
       packages=find_packages(),
       install_requires=[
-          'urllib3', 'pandas', 'xlrd', 'requests', 'ftputil',
+          'urllib3', 'pandas', 'numpy', 'xlrd', 'requests', 'ftputil',
           'psycopg2-binary', 'pronto', 'graphio>=0.1.0', 'graphpipeline', 'lxml', 'click'
       ],
       keywords=['NEO4J', 'Biology'],
@@ -0,0 +1,47 @@
+import pytest
+import gzip
+
+from biomedgraph.datasources.partition import shard_file, get_shard_file, first_column_key
+
+
+@pytest.fixture
+def gene_history_file(tmpdir):
+    """
+    Test gene_history file with lines of two taxids.
+    """
+    filename = str(tmpdir.join("gene_history.gz"))
+
+    text = """#tax_id	GeneID	Discontinued_GeneID	Discontinued_Symbol	Discontinue_Date
+9	-	1246494	repA1	20031113
+9606	1	100	A1BG-AS	20050508
+9	-	1246496	leuA	20031113
+9606	-	101	OLD	20050508
+"""
+
+    with gzip.open(filename, 'wt') as f:
+        f.write(text)
+
+    return filename
+
+
+def test_shard_file(gene_history_file):
+    manifest = shard_file(gene_history_file, first_column_key)
+    assert set(manifest['shards']) == {'9', '9606'}
+
+    with gzip.open(get_shard_file(gene_history_file, '9606'), 'rt') as f:
+        lines = f.read().splitlines()
+
+    # header is copied to every shard
+    assert lines[0].startswith('#tax_id')
+    assert [l.split('\t')[2] for l in lines[1:]] == ['100', '101']
+
+    assert get_shard_file(gene_history_file, '10090') is None
+
+
+def test_shard_file_keys(gene_history_file):
+    manifest = shard_file(gene_history_file, first_column_key, keys=['9606'])
+    assert list(manifest['shards']) == ['9606']
+
+
+def test_get_shard_file_not_sharded(gene_history_file):
+    assert get_shard_file(gene_history_file, '9606') == gene_history_file
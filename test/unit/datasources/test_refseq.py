@@ -0,0 +1,80 @@
+import pytest
+import gzip
+
+import os
+
+from biomedgraph.datasources.partition import read_index
+from biomedgraph.datasources.refseq import download_and_filter_data_file, consolidate_archived_releases
+
+
+@pytest.fixture(scope='session')
+def removed_records_file(tmpdir_factory):
+    """
+    Test removed-records file with human and mouse lines, written as two concatenated gzip members.
+    """
+    filename = tmpdir_factory.mktemp("datasources").join("release10.removed-records.gz")
+
+    first = """9606	Homo sapiens	NM_001001.1	complete|vertebrate_mammalian	REVIEWED	1000	replaced by NM_001002.1
+10090	Mus musculus	NM_002001.1	complete|vertebrate_mammalian	REVIEWED	1000	permanently suppressed
+"""
+    second = """9606	Homo sapiens	NP_001001.1	complete|vertebrate_mammalian	REVIEWED	300	dead protein"""
+
+    with open(filename, 'wb') as f:
+        f.write(gzip.compress(first.encode()))
+        f.write(gzip.compress(second.encode()))
+
+    return filename
+
+
+def test_download_and_filter_data_file(removed_records_file, tmpdir):
+    filtered_file = download_and_filter_data_file('file://{}'.format(removed_records_file), str(tmpdir), ['9606'])
+
+    assert filtered_file.endswith('release10.removed-records.filtered.gz')
+
+    with gzip.open(filtered_file, 'rt') as f:
+        lines = f.read().splitlines()
+
+    assert len(lines) == 2
+    assert all(l.startswith('9606\t') for l in lines)
+    assert lines[1].split('\t')[2] == 'NP_001001.1'
+
+
+def test_download_and_filter_data_file_truncated(removed_records_file, tmpdir):
+    with open(removed_records_file, 'rb') as f:
+        data = f.read()
+    truncated_file = tmpdir.join('release11.removed-records.gz')
+    with open(truncated_file, 'wb') as f:
+        f.write(data[:len(data) - 10])
+
+    target = tmpdir.mkdir('target')
+    with pytest.raises(IOError):
+        download_and_filter_data_file('file://{}'.format(truncated_file), str(target), ['9606'])
+
+    # neither the partial nor the final file are left behind
+    assert os.listdir(target) == []
+
+
+def test_consolidate_archived_releases(tmpdir):
+    releases = {
+        'release2.removed-records.gz': '9606\tHomo sapiens\tNM_000002.1\tcomplete\tREVIEWED\t100\tdead\n',
+        'release10.removed-records.filtered.gz': '9606\tHomo sapiens\tNM_000010.1\tcomplete\tREVIEWED\t100\tdead\n'
+                                                 '10090\tMus musculus\tNM_000011.1\tcomplete\tREVIEWED\t100\tdead\n',
+        'release2.accession2geneid.gz': '9606\t1\tNM_000002.1\tna\n'
+    }
+    for name, text in releases.items():
+        with gzip.open(str(tmpdir.join(name)), 'wt') as f:
+            f.write(text)
+
+    store_path = consolidate_archived_releases(str(tmpdir))
+    index = read_index(store_path)
+
+    assert index['releases'] == ['2', '10']
+    assert index['files']['removed-records']['9606']['lines'] == 2
+    assert set(index['files']['accession2geneid']) == {'9606'}
+
+    with gzip.open(os.path.join(store_path, 'removed-records', '9606.gz'), 'rt') as f:
+        lines = f.read().splitlines()
+
+    # lines are prefixed with the release and sorted by release
+    assert [l.split('\t')[0] for l in lines] == ['2', '10']
+    assert lines[1].split('\t')[3] == 'NM_000010.1'
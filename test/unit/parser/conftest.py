@@ -0,0 +1,22 @@
+import pytest
+import gzip
+
+
+@pytest.fixture(scope='session')
+def gtf_file(tmpdir_factory):
+    """
+    Test GTF file, one gene with one transcript, one exon and one CDS.
+    """
+    filename = tmpdir_factory.mktemp("parser").join("gtf_test_file.gtf.gz")
+
+    text = """#!genome-build GRCh38.p13
+1	havana	gene	11869	14409	.	+	.	gene_id "ENSG00000223972"; gene_version "5"; gene_name "DDX11L1"; havana_gene_id "OTTHUMG00000000961";
+1	havana	transcript	11869	14409	.	+	.	gene_id "ENSG00000223972"; transcript_id "ENST00000456328"; gene_name "DDX11L1"; tag "basic";
+1	havana	exon	11869	12227	.	+	.	gene_id "ENSG00000223972"; transcript_id "ENST00000456328"; exon_number "1";
+1	havana	CDS	12010	12057	.	+	0	gene_id "ENSG00000223972"; transcript_id "ENST00000456328"; protein_id "ENSP00000000001";
+"""
+
+    with gzip.open(filename, 'wt') as f:
+        f.write(text)
+
+    return str(filename)
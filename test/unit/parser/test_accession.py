@@ -0,0 +1,41 @@
+import pytest
+
+from biomedgraph.parser.helper.accession import encode_accession, decode_accession, AccessionSet, \
+    AccessionPairSet
+
+
+@pytest.mark.parametrize('accession', ['NM_001098405', 'XP_1', '100008586', '0012'])
+def test_encode_decode(accession):
+    assert decode_accession(encode_accession(accession)) == accession
+
+
+@pytest.mark.parametrize('accession', ['NZ_CP012345', 'nm_1', 'NM_', ''])
+def test_encode_not_supported(accession):
+    assert encode_accession(accession) is None
+
+
+def test_accession_set():
+    # small capacity, the table has to grow
+    accessions = AccessionSet(capacity=2)
+    for i in range(1000):
+        accessions.add('NM_{:06d}'.format(i))
+    accessions.add('NM_000001')
+    accessions.add('NZ_CP012345')
+
+    assert len(accessions) == 1001
+    assert 'NM_000999' in accessions
+    assert 'NM_999' not in accessions
+    assert 'NZ_CP012345' in accessions
+
+
+def test_accession_pair_set():
+    pairs = AccessionPairSet(capacity=2)
+    for i in range(1000):
+        pairs.add((str(i), 'NM_{}'.format(i)))
+    pairs.add(('1', 'NM_1'))
+    pairs.add(('x', 'NM_1'))
+
+    assert len(pairs) == 1001
+    assert ('5', 'NM_5') in pairs
+    assert ('5', 'NM_6') not in pairs
+    assert ('x', 'NM_1') in pairs
@@ -0,0 +1,148 @@
+import pytest
+import gzip
+import os
+import shutil
+
+from graphio import NodeSet
+
+from biomedgraph.datasources.ensembl import Ensembl
+from biomedgraph.parser import EnsemblEntityParser, EnsemblLocusParser, EnsemblGtfParser, \
+    EnsemblTranscriptStructureParser
+from biomedgraph.parser.ensembl import locus_key, locus_digest, read_locus_keys, write_locus_keys
+
+
+class EnsemblInstance:
+    """
+    Minimal ENSEMBL DataSource instance with the GTF file of a release.
+    """
+    def __init__(self, instance_dir, version, gtf_file=None, patched=False):
+        self.instance_dir = instance_dir
+        self.version = version
+        if gtf_file:
+            gtf_name = 'chr_patch_hapl_scaff.gtf.gz' if patched else 'chr.gtf.gz'
+            target_dir = os.path.join(instance_dir, 'gtf', 'homo_sapiens')
+            os.makedirs(target_dir, exist_ok=True)
+            shutil.copy(gtf_file, os.path.join(target_dir, 'Homo_sapiens.GRCh38.{}.{}'.format(version, gtf_name)))
+
+
+def run_parser(parser, instance, taxid='9606'):
+    parser.get_instance_by_name = lambda name: instance
+    parser.run(taxid)
+    return parser
+
+
+@pytest.fixture
+def ensembl_instance(gtf_file, tmpdir):
+    # only the flat GTF file is available
+    return EnsemblInstance(str(tmpdir.mkdir('104')), '104', gtf_file)
+
+
+def test_ensembl_gtf_parser(ensembl_instance):
+    gtf_parser = run_parser(EnsemblGtfParser(), ensembl_instance)
+    entity_parser = run_parser(EnsemblEntityParser(), ensembl_instance)
+    locus_parser = run_parser(EnsemblLocusParser(), ensembl_instance)
+
+    # one scan gives the same output as the separate parsers
+    assert gtf_parser.genes.nodes == entity_parser.genes.nodes
+    assert gtf_parser.transcripts.nodes == entity_parser.transcripts.nodes
+    assert gtf_parser.proteins.nodes == entity_parser.proteins.nodes
+    assert gtf_parser.gene_codes_transcript.relationships == entity_parser.gene_codes_transcript.relationships
+    assert gtf_parser.transcript_codes_protein.relationships == entity_parser.transcript_codes_protein.relationships
+    assert gtf_parser.locus.nodes == locus_parser.locus.nodes
+
+    assert [n['sid'] for n in gtf_parser.genes.nodes] == ['ENSG00000223972']
+    assert [n['sid'] for n in gtf_parser.proteins.nodes] == ['ENSP00000000001']
+    assert len(gtf_parser.locus.nodes) == 4
+
+
+def test_locus_key():
+    key = locus_key('1', 11869, 14409, '+', 'gene', 'ENSG00000223972', None, 'h38')
+    assert key == locus_key('1', 11869, 14409, '+', 'gene', 'ENSG00000223972', None, 'h38')
+    assert key != locus_key('1', 11869, 14410, '+', 'gene', 'ENSG00000223972', None, 'h38')
+    assert len(key) == 16
+
+
+def test_write_read_locus_keys(tmpdir):
+    path = str(tmpdir.join('locus_keys', '9606.txt.gz'))
+    keys = {'b': locus_digest({'sid': 'b'}), 'a': locus_digest({'sid': 'a'})}
+
+    write_locus_keys(path, keys)
+    assert read_locus_keys(path) == keys
+
+
+def test_locus_parser_incremental(gtf_file, tmpdir):
+    previous_instance = EnsemblInstance(str(tmpdir.mkdir('103')), '103', gtf_file)
+    previous_parser = run_parser(EnsemblLocusParser(), previous_instance)
+    previous_keys = {n['sid']: n for n in previous_parser.locus.nodes}
+
+    # next release: the exon is removed, the gene is renamed, a new exon is added
+    with gzip.open(gtf_file, 'rt') as f:
+        lines = [l for l in f if '\texon\t' not in l]
+    lines[1] = lines[1].replace('DDX11L1', 'DDX11L2')
+    lines.append('1\thavana\texon\t12613\t12721\t.\t+\t.\tgene_id "ENSG00000223972"; '
+                 'transcript_id "ENST00000456328"; exon_number "2";\n')
+    next_gtf_file = str(tmpdir.join('next.gtf.gz'))
+    with gzip.open(next_gtf_file, 'wt') as f:
+        f.writelines(lines)
+
+    instance = EnsemblInstance(str(tmpdir.mkdir('104')), '104', next_gtf_file)
+    parser = EnsemblLocusParser()
+    parser.previous_keys_file = Ensembl.get_locus_keys_file_path('9606', previous_instance)
+    run_parser(parser, instance)
+
+    added = {n['type']: n for n in parser.locus.nodes}
+    assert set(added) == {'gene', 'exon'}
+    # the changed gene keeps its key
+    assert added['gene']['sid'] in previous_keys
+    assert added['gene']['gene_name'] == 'DDX11L2'
+    assert added['exon']['start'] == 12613
+
+    removed = parser.removed_locus_keys
+    assert len(removed) == 1
+    assert previous_keys[next(iter(removed))]['type'] == 'exon'
+    assert set(read_locus_keys(Ensembl.get_removed_locus_keys_file_path('9606', instance))) == removed
+
+    gtf_parser = EnsemblGtfParser()
+    gtf_parser.locus_parser.previous_keys_file = parser.previous_keys_file
+    run_parser(gtf_parser, instance)
+    assert gtf_parser.removed_locus_keys == removed
+
+    # the removed keys are not in a NodeSet, the pipeline would merge them back as Locus nodes
+    for p in (parser, gtf_parser):
+        for nodeset in (v for v in vars(p).values() if isinstance(v, NodeSet)):
+            assert not removed & {n['sid'] for n in nodeset.nodes if 'sid' in n}
+
+    # all loci of the new release are in the key file
+    assert len(read_locus_keys(Ensembl.get_locus_keys_file_path('9606', instance))) == 4
+
+
+def test_transcript_structure_parser(gtf_file, tmpdir):
+    # add a second exon and CDS before the first ones
+    with gzip.open(gtf_file, 'rt') as f:
+        lines = f.readlines()
+    lines[3:3] = [
+        '1\thavana\texon\t12613\t12721\t.\t+\t.\tgene_id "ENSG00000223972"; transcript_id "ENST00000456328"; '
+        'exon_number "2";\n',
+        '1\thavana\tCDS\t12613\t12700\t.\t+\t0\tgene_id "ENSG00000223972"; transcript_id "ENST00000456328"; '
+        'protein_id "ENSP00000000001";\n'
+    ]
+    structure_gtf_file = str(tmpdir.join('structure.gtf.gz'))
+    with gzip.open(structure_gtf_file, 'wt') as f:
+        f.writelines(lines)
+
+    instance = EnsemblInstance(str(tmpdir.mkdir('104')), '104', structure_gtf_file)
+    parser = run_parser(EnsemblTranscriptStructureParser(), instance)
+
+    gene, = parser.gene_structures.nodes
+    assert (gene['sid'], gene['start'], gene['end'], gene['taxid']) == ('ENSG00000223972', 11869, 14409, '9606')
+
+    transcript, = parser.transcript_structures.nodes
+    assert transcript['sid'] == 'ENST00000456328'
+    assert (transcript['chr'], transcript['start'], transcript['end']) == ('1', 11869, 14409)
+
+    # exons and CDS are sorted by start
+    assert len(transcript['exon_starts']) == 2
+    assert transcript['exon_starts'] == [11869, 12613]
+    assert [end - start + 1 for start, end in zip(transcript['exon_starts'], transcript['exon_ends'])] == [359, 109]
+    assert (transcript['cds_starts'][0], transcript['cds_ends'][-1]) == (12010, 12700)
+    assert transcript['cds_ends'] == [12057, 12700]
@@ -1,7 +1,12 @@
 import pytest
 import gzip
 
+import pandas
+
 from biomedgraph.parser import GeneOntologyAssociationParser
+from biomedgraph.parser.geneontology import read_gaf_associations, aggregate_associations, read_gpi_taxids, \
+    read_gpa_associations, aggregate_association_chunks
+from biomedgraph.parser.helper.uniprot import write_secondary_accession_index
 
 
 @pytest.fixture(scope='session')
@@ -93,3 +98,124 @@ UniProtKB	A0A075B5J0	Trbv26		GO:0005886	PMID:21873635	IBA	MGI:MGI:98596|PANTHER:
 #         for rel in parser.protein_associates_goterm.relationships:
 #             assert type(rel.start_node_properties['sid']) is str
 #             assert 'GO' in rel.end_node_properties['sid']
+
+
+def test_read_gaf_associations(gaf_file):
+    df = next(read_gaf_associations(str(gaf_file), ['9606', '10090']))
+
+    assert (df['taxid'] == '9606').sum() == 25
+    assert (df['taxid'] == '10090').sum() == 10
+    assert df['go_id'].str.startswith('GO:').all()
+
+    dfs = list(read_gaf_associations(str(gaf_file), ['10090'], chunksize=7))
+    assert sum(len(df) for df in dfs) == 10
+    assert dfs[0].iloc[0].tolist() == ['A0A075B5I2', '', 'GO:0005886', 'PMID:21873635', 'IBA', 'GO_Central', '10090']
+
+
+def test_aggregate_associations(gaf_file):
+    df = next(read_gaf_associations(str(gaf_file), ['9606']))
+    # duplicate a line with another evidence code and reference
+    extra = df.iloc[[1]].assign(evidence='IDA', reference='PMID:1|PMID:2', assigned_by='HPA')
+    df = pandas.concat([df, extra, extra])
+
+    agg = aggregate_associations(df)
+
+    assert len(agg) == 25
+    row = agg[(agg['db_id'] == 'A0A024RBG1') & (agg['go_id'] == 'GO:0003723')].iloc[0]
+    assert row['evidence'] == ['IEA', 'IDA']
+    assert row['evidence_count'] == [1, 2]
+    assert row['references'] == ['GO_REF:0000043', 'PMID:1', 'PMID:2']
+    assert row['references_count'] == [1, 2, 2]
+    assert row['assigned_by'] == ['UniProt', 'HPA']
+    assert row['count'] == 3
+
+
+def test_aggregate_association_chunks(gaf_file):
+    df = next(read_gaf_associations(str(gaf_file), ['9606', '10090']))
+    extra = df.iloc[[1]].assign(evidence='IDA', reference='PMID:1|PMID:2', assigned_by='HPA')
+    df = pandas.concat([df, extra, extra]).reset_index(drop=True)
+
+    # lines of the same group in different chunks give the same result as one chunk
+    chunks = [df.iloc[i:i + 4] for i in range(0, len(df), 4)]
+    expected = aggregate_associations(df)
+    agg = aggregate_association_chunks(iter(chunks))
+
+    assert agg.columns.tolist() == expected.columns.tolist()
+    assert agg.values.tolist() == expected.values.tolist()
+
+
+def test_read_gpa_associations(tmpdir):
+    gpi_file = str(tmpdir.join('test.gpi.gz'))
+    gpa_file = str(tmpdir.join('test.gpa.gz'))
+    with gzip.open(gpi_file, 'wt') as f:
+        f.write('!gpi-version: 1.2\n')
+        f.write('UniProtKB\tA0A024RBG1\tNUDT4B\tNUDT4B protein\tNUDT4B\tprotein\ttaxon:9606\t\tHGNC:18012\tdb_subset=TrEMBL\n')
+        f.write('UniProtKB\tA0A075B5I2\tTrbv4\tIg-like protein\tTrbv4\tprotein\ttaxon:10090\t\t\tdb_subset=TrEMBL\n')
+        f.write('UniProtKB\tA0A024RBG1-2\tNUDT4B\tNUDT4B isoform\tNUDT4B\tprotein\ttaxon:9606\tUniProtKB:A0A024RBG1\t\t\n')
+        f.write('ComplexPortal\tCPX-1\tComplex\tA complex\t\tprotein_complex\ttaxon:9606\t\t\t\n')
+    with gzip.open(gpa_file, 'wt') as f:
+        f.write('!gpa-version: 1.1\n')
+        f.write('UniProtKB\tA0A024RBG1\tenables\tGO:0003723\tGO_REF:0000043\tECO:0000322\tUniProtKB-KW:KW-0694\t\t20200222\tUniProt\t\tgo_evidence=IEA\n')
+        f.write('UniProtKB\tA0A024RBG1\tNOT|located_in\tGO:0005829\tGO_REF:0000052\tECO:0000314\t\t\t20161204\tHPA\t\t\n')
+        f.write('UniProtKB\tA0A024RBG1-2\tcontributes_to\tGO:0003723\tPMID:2\tECO:0000999\t\t\t20200101\tHPA\t\t\n')
+        f.write('UniProtKB\tA0A075B5I2\tlocated_in\tGO:0005886\tPMID:21873635\tECO:0000318\t\t\t20171207\tGO_Central\t\tgo_evidence=IBA\n')
+        f.write('ComplexPortal\tCPX-1\tpart_of\tGO:0005829\tPMID:1\tECO:0000353\t\t\t20200101\tComplexPortal\t\tgo_evidence=IPI\n')
+
+    product_taxids, product_parents = read_gpi_taxids(gpi_file, ['9606'])
+    assert product_taxids == {'A0A024RBG1': '9606', 'A0A024RBG1-2': '9606'}
+    assert product_parents == {'A0A024RBG1-2': 'A0A024RBG1'}
+
+    # same vocabulary as GAF 2.2: canonical accessions, relations as qualifiers and GO evidence codes
+    df = pandas.concat(read_gpa_associations(gpa_file, product_taxids, product_parents))
+    assert df.values.tolist() == [
+        ['A0A024RBG1', 'enables', 'GO:0003723', 'GO_REF:0000043', 'IEA', 'UniProt', '9606'],
+        ['A0A024RBG1', 'NOT|located_in', 'GO:0005829', 'GO_REF:0000052', 'IDA', 'HPA', '9606'],
+        ['A0A024RBG1', 'contributes_to', 'GO:0003723', 'PMID:2', '', 'HPA', '9606']
+    ]
+
+
+def test_gaf_gpa_same_qualifiers(tmpdir):
+    gaf_file = str(tmpdir.join('test.gaf.gz'))
+    gpi_file = str(tmpdir.join('test.gpi.gz'))
+    gpa_file = str(tmpdir.join('test.gpa.gz'))
+    with gzip.open(gaf_file, 'wt') as f:
+        f.write('!gaf-version: 2.2\n')
+        f.write('UniProtKB\tA0A024RBG1\tNUDT4B\tenables\tGO:0003723\tGO_REF:0000043\tIEA\tUniProtKB-KW:KW-0694\tF\t'
+                'NUDT4B protein\tNUDT4B\tprotein\ttaxon:9606\t20200222\tUniProt\t\t\n')
+        f.write('UniProtKB\tA0A024RBG1\tNUDT4B\tNOT|located_in\tGO:0005829\tGO_REF:0000052\tIDA\t\tC\t'
+                'NUDT4B protein\tNUDT4B\tprotein\ttaxon:9606\t20161204\tHPA\t\t\n')
+    with gzip.open(gpi_file, 'wt') as f:
+        f.write('!gpi-version: 1.2\n')
+        f.write('UniProtKB\tA0A024RBG1\tNUDT4B\tNUDT4B protein\tNUDT4B\tprotein\ttaxon:9606\t\tHGNC:18012\t\n')
+    with gzip.open(gpa_file, 'wt') as f:
+        f.write('!gpa-version: 1.1\n')
+        f.write('UniProtKB\tA0A024RBG1\tenables\tGO:0003723\tGO_REF:0000043\tECO:0000322\tUniProtKB-KW:KW-0694\t\t'
+                '20200222\tUniProt\t\tgo_evidence=IEA\n')
+        f.write('UniProtKB\tA0A024RBG1\tNOT|located_in\tGO:0005829\tGO_REF:0000052\tECO:0000314\t\t\t20161204\tHPA\t\t\n')
+
+    gaf = pandas.concat(read_gaf_associations(gaf_file, ['9606']))
+    product_taxids, product_parents = read_gpi_taxids(gpi_file, ['9606'])
+    gpa = pandas.concat(read_gpa_associations(gpa_file, product_taxids, product_parents))
+
+    assert gaf['qualifier'].tolist() == gpa['qualifier'].tolist() == ['enables', 'NOT|located_in']
+    assert gaf.values.tolist() == gpa.values.tolist()
+
+
+def test_add_associations_several_indexes(tmpdir):
+    human = str(tmpdir.join('9606'))
+    mouse = str(tmpdir.join('10090'))
+    write_secondary_accession_index(human, [['P31946', 'A8K9K2']])
+    write_secondary_accession_index(mouse, [['Q9CQV8', 'Q3TY33']])
+
+    df = pandas.DataFrame(
+        [['A8K9K2', '', 'GO:0003723', 'PMID:1', 'IDA', 'HPA', '9606'],
+         ['Q3TY33', '', 'GO:0005886', 'PMID:2', 'IBA', 'GO_Central', '10090']],
+        columns=['db_id', 'qualifier', 'go_id', 'reference', 'evidence', 'assigned_by', 'taxid']
+    )
+
+    parser = GeneOntologyAssociationParser()
+    parser.secondary_accession_index = [human, mouse]
+    parser.add_associations(iter([df]), ['9606', '10090'])
+
+    assert [start['sid'] for start, end, props in parser.protein_associates_goterm.relationships] == \
+        ['P31946', 'Q9CQV8']
@@ -0,0 +1,31 @@
+from biomedgraph.parser.helper.genesymbol import read_gene_info_symbols, read_hgnc_symbols, \
+    write_gene_symbol_index, GeneSymbolResolver
+
+
+def test_gene_symbol_resolver(tmpdir):
+    gene_info = [
+        '#tax_id\tGeneID\tSymbol\tLocusTag\tSynonyms\tdbXrefs\n',
+        '9606\t7157\tTP53\t-\tBCC7|LFS1|P53\tMIM:191170\n',
+        '9606\t1\tA1BG\t-\tA1B|ABG|GAB\tMIM:138670\n',
+        '9606\t2\tA2M\t-\tA2MD|CPAMD5|S863-7\tMIM:103950\n',
+        '9606\t9999\tGAB1\t-\tGAB\t-\n',
+        '10090\t22059\tTrp53\t-\tp53\t-\n'
+    ]
+    hgnc = [
+        'hgnc_id\tsymbol\tname\talias_symbol\tprev_symbol\tentrez_id\n',
+        'HGNC:11998\tTP53\ttumor protein p53\t"LFS1|p53"\t\t7157\n',
+        'HGNC:7\tA2M\talpha-2-macroglobulin\t"FWP007|S863-7"\t"CPAMD5"\t2\n',
+        'HGNC:100\tNOID\tgene without NCBI Gene ID\t\t\t\n'
+    ]
+    path = str(tmpdir.join('symbol_index'))
+    write_gene_symbol_index(path, list(read_gene_info_symbols(gene_info, '9606')) + list(read_hgnc_symbols(hgnc)))
+
+    resolver = GeneSymbolResolver(path)
+    symbols = ['TP53', 'P53', 'p53', 'FWP007', 'GAB', 'GAB1', 'Trp53', 'NOID']
+    assert resolver.resolve('9606', symbols) == ['7157', '7157', '7157', '2', None, '9999', None, None]
+    assert resolver.is_ambiguous('9606', symbols) == [False, False, False, False, True, False, False, False]
+
+    assert resolver.matches('9606', ['CPAMD5', 'GAB']) == [
+        [('2', 'synonym', 'ncbigene')],
+        [('1', 'synonym', 'ncbigene'), ('9999', 'synonym', 'ncbigene')]
+    ]
@@ -0,0 +1,48 @@
+import pytest
+import gzip
+
+from biomedgraph.parser.helper.gtf import GtfColumnReader, GtfScan, get_gtf_attribute
+
+
+def test_get_gtf_attribute():
+    attributes = 'gene_id "ENSG1"; havana_gene_id "OTT1"; gene_name "A";'
+    assert get_gtf_attribute(attributes, 'gene_id') == 'ENSG1'
+    assert get_gtf_attribute(attributes, 'gene_name') == 'A'
+    assert get_gtf_attribute(attributes, 'protein_id') is None
+
+
+class TestGtfColumnReader:
+
+    def test_type_filter(self, gtf_file):
+        batches = list(GtfColumnReader(gtf_file).batches(types=['transcript', 'CDS'],
+                                                         attributes=['transcript_id', 'protein_id']))
+        assert len(batches) == 1
+        batch = batches[0]
+
+        assert batch['type'] == ['transcript', 'CDS']
+        assert batch['start'] == [11869, 12010]
+        assert batch['transcript_id'] == ['ENST00000456328', 'ENST00000456328']
+        assert batch['protein_id'] == [None, 'ENSP00000000001']
+
+    def test_all_attributes(self, gtf_file):
+        batches = list(GtfColumnReader(gtf_file).batches(attributes=['gene_id'], all_attributes=True,
+                                                         batch_size=3))
+        assert [len(b['type']) for b in batches] == [3, 1]
+        assert batches[0]['attributes'][0]['havana_gene_id'] == 'OTTHUMG00000000961'
+        assert batches[1]['gene_id'] == ['ENSG00000223972']
+
+
+def test_gtf_scan(gtf_file):
+    seen = {}
+
+    scan = GtfScan(gtf_file)
+    scan.register('genes', lambda batch: seen.setdefault('genes', []).extend(batch['type']),
+                  types=['gene'])
+    scan.register('cds', lambda batch: seen.setdefault('cds', []).extend(batch['protein_id']),
+                  types=['CDS'], attributes=['protein_id'])
+    timings = scan.run()
+
+    # both consumers see the union of requested types
+    assert seen['genes'] == ['gene', 'CDS']
+    assert seen['cds'] == [None, 'ENSP00000000001']
+    assert set(timings) == {'genes', 'cds', GtfScan.READ}
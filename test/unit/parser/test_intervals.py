@@ -0,0 +1,44 @@
+import pytest
+
+from biomedgraph.parser.helper.intervals import IntervalIndex, IntervalIndexBuilder
+
+
+@pytest.fixture(scope='session')
+def interval_index(tmpdir_factory):
+    """
+    Interval index with a long gene that spans two short genes on chromosome 1.
+    """
+    path = str(tmpdir_factory.mktemp("parser").join("interval_index"))
+
+    builder = IntervalIndexBuilder()
+    builder.add('1', 100, 10000, 'LONG', 'gene')
+    builder.add('1', 200, 300, 'A', 'gene')
+    builder.add('1', 200, 250, 'A-1', 'transcript')
+    builder.add('1', 5000, 5100, 'B', 'gene')
+    builder.add('2', 1, 50, 'C', 'gene')
+    builder.save(path)
+
+    return IntervalIndex(path)
+
+
+class TestIntervalIndex:
+
+    def test_point(self, interval_index):
+        assert sorted(x[0] for x in interval_index.point('1', 250)) == ['A', 'A-1', 'LONG']
+        assert [x[0] for x in interval_index.point('1', 4000)] == ['LONG']
+        assert interval_index.point('1', 50) == []
+
+    def test_range(self, interval_index):
+        assert sorted(x[0] for x in interval_index.overlaps('1', 280, 5000)) == ['A', 'B', 'LONG']
+        assert interval_index.overlaps('2', 51, 100) == []
+        assert interval_index.overlaps('X', 1, 100) == []
+
+    def test_interval_values(self, interval_index):
+        assert interval_index.overlaps('2', 10, 10) == [('C', 'gene', 1, 50)]
+
+    def test_batch(self, interval_index):
+        results = interval_index.batch_overlaps(['1', '2', 'X', '1'], [5050, 10, 1, 10001], [5050, 20, 1, 20000])
+        assert sorted(x[0] for x in results[0]) == ['B', 'LONG']
+        assert [x[0] for x in results[1]] == ['C']
+        assert results[2] == []
+        assert results[3] == []
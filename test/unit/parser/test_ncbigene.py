@@ -0,0 +1,57 @@
+import gzip
+
+import pytest
+
+from biomedgraph.datasources.partition import shard_file, first_column_key
+from biomedgraph.parser.ncbigene import iterate_taxid_lines, resolve_replacements, normalize_gene_info, \
+    split_dbxref
+
+
+@pytest.fixture
+def gene2accession_file(tmpdir):
+    path = str(tmpdir.join('gene2accession.gz'))
+    lines = [
+        '#tax_id\tGeneID\tstatus\tRNA_nucleotide_accession.version\tRNA_nucleotide_gi\tprotein_accession.version\tprotein_gi\tgenomic_nucleotide_accession.version',
+        '9606\t1\tREVIEWED\tNM_130786.4\t1519316133\tNP_570602.2\t21071030\tNC_000019.10',
+        '9606\t1\t-\tAF414429.1\t15778555\tAAL07469.1\t15778556\t-',
+        '10090\t11287\tVALIDATED\tNM_007376.4\t1063746862\tNP_031402.3\t161484640\tNC_000072.7',
+        '96060\t5\tREVIEWED\tNM_000001.1\t1\tNP_000001.1\t2\t-'
+    ]
+    with gzip.open(path, 'wt') as f:
+        f.write('\n'.join(lines) + '\n')
+    return path
+
+
+@pytest.mark.parametrize('shard', [False, True])
+def test_iterate_taxid_lines(gene2accession_file, shard):
+    if shard:
+        shard_file(gene2accession_file, first_column_key)
+
+    rows = list(iterate_taxid_lines(gene2accession_file, ['9606'], 6))
+    assert rows == [
+        ['9606', '1', 'REVIEWED', 'NM_130786.4', '1519316133', 'NP_570602.2'],
+        ['9606', '1', '-', 'AF414429.1', '15778555', 'AAL07469.1']
+    ]
+
+    rows = list(iterate_taxid_lines(gene2accession_file, ['10090', '9606', '1'], 3))
+    assert sorted(row[0] for row in rows) == ['10090', '9606', '9606']
+    assert all(len(row) == 3 for row in rows)
+
+
+def test_resolve_replacements():
+    replaced_by = {'1': '2', '2': '3', '4': None, '5': '4', '6': '7', '7': '6'}
+
+    assert resolve_replacements(replaced_by) == {
+        '1': '3', '2': '3', '4': None, '5': None, '6': None, '7': None
+    }
+
+
+def test_normalize_gene_info():
+    props = {'sid': '1', 'Symbol': 'A1BG', 'Synonyms': 'A1B|ABG|GAB', 'chromosome': '19', 'map_location': '-',
+             'dbXrefs': 'MIM:138670|HGNC:HGNC:5|Ensembl:ENSG00000121410', 'Other_designations': '-'}
+
+    assert normalize_gene_info(props) == {
+        'sid': '1', 'Symbol': 'A1BG', 'Synonyms': ['A1B', 'ABG', 'GAB'], 'chromosome': '19',
+        'dbXrefs': ['MIM:138670', 'HGNC:HGNC:5', 'Ensembl:ENSG00000121410']
+    }
+    assert split_dbxref('HGNC:HGNC:5') == ('HGNC', 'HGNC:5')
@@ -0,0 +1,98 @@
+import io
+import os
+
+from biomedgraph.parser.helper.obo import iter_clean_obo_lines, open_clean_obo, read_obo, parse_obo_term, \
+    iterate_obo_stanzas
+
+
+def test_iter_clean_obo_lines():
+    lines = [
+        'format-version: 1.2\n',
+        'remark: header [not cleaned: here]\n',
+        '[Term]\n',
+        'id: FAO:0000001\n',
+        'def: "A cell." [EC: 1.2.3.4, TAO:Arratia and Schultze_1992]\n',
+        'xref: Wikipedia:Fungal cell\n',
+    ]
+
+    assert list(iter_clean_obo_lines(lines)) == [
+        'format-version: 1.2\n',
+        'remark: header [not cleaned: here]\n',
+        '[Term]\n',
+        'id: FAO:0000001\n',
+        'def: "A cell." [EC:1.2.3.4, TAO:Arratia_and_Schultze_1992]\n',
+        'xref: Wikipedia:Fungal_cell\n',
+    ]
+
+
+def test_open_clean_obo(tmpdir):
+    obo_file = str(tmpdir.join('test.obo'))
+    lines = ['format-version: 1.2\n'] + ['[Term]\n', 'id: T:1\n', 'def: "A term." [EC: 1.2.3.4]\n'] * 1000
+    with open(obo_file, 'wt') as f:
+        f.writelines(lines)
+
+    with open_clean_obo(obo_file) as f:
+        assert f.read().decode() == ''.join(iter_clean_obo_lines(lines))
+
+
+def test_read_obo_qualified_xrefs(tmpdir):
+    obo_file = str(tmpdir.join('test.obo'))
+    with open(obo_file, 'wt') as f:
+        f.write('format-version: 1.2\n\n[Term]\nid: CHEBI:15377\nname: water\n'
+                'xref: HMDB:HMDB0002111 {source="KEGG COMPOUND"}\n'
+                'xref: Wikipedia:Water "The water article"\n'
+                'xref: EC: 1.2.3.4 ! enzyme\n')
+
+    with open_clean_obo(obo_file) as f:
+        _, terms = read_obo(io.TextIOWrapper(f, encoding='utf-8'))
+        terms = list(terms)
+
+    assert terms[0]['xrefs'] == ['HMDB:HMDB0002111', 'Wikipedia:Water', 'EC:1.2.3.4']
+
+
+def test_read_obo():
+    obo_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fao.obo')
+
+    with open_clean_obo(obo_file) as f:
+        header, terms = read_obo(io.TextIOWrapper(f, encoding='utf-8'))
+        terms = list(terms)
+
+    assert header['ontology'] == 'fao'
+    assert header['date'] == '2020-01-23 16:30:00'
+    assert header['data_version'] == 'releases/2020-05-07'
+    assert len(terms) == 114
+
+    term = terms[0]
+    assert term['id'] == 'FAO:0000001'
+    assert term['name'] == 'fungal structure'
+    assert term['definition'] == 'An anatomical structure that forms all or part of a fungus.'
+    assert term['definition_xrefs'] == ['FAO:mah']
+    assert term['synonyms'] == [('fungal structure ontology', 'RELATED', [])]
+    assert term['xrefs'] == ['BTO:0001494']
+    assert term['relationships'] == [('only_in_taxon', 'NCBITaxon:4751')]
+    assert terms[2]['is_a'] == ['FAO:0000052']
+    assert terms[4]['obsolete']
+
+
+def test_parse_obo_term():
+    lines = [
+        '[Term]',
+        'id: CHEBI:15377',
+        'name: water',
+        'def: "An oxygen hydride \\"H2O\\"." []',
+        'alt_id: CHEBI:5585',
+        'synonym: "H2O" EXACT IUPAC_NAME [IUPAC:, NIST:]',
+        'xref: HMDB:HMDB0002111 {source="KEGG COMPOUND"}',
+        'is_a: CHEBI:33693 {source="x"} ! oxygen hydride',
+        'relationship: has_role CHEBI:48360 ! amphiprotic solvent',
+    ]
+    (_, _), (stanza_type, tags) = iterate_obo_stanzas(lines)
+    term = parse_obo_term(tags)
+
+    assert stanza_type == 'Term'
+    assert term['definition'] == 'An oxygen hydride "H2O".'
+    assert term['alt_ids'] == ['CHEBI:5585']
+    assert term['synonyms'] == [('H2O', 'EXACT', ['IUPAC:', 'NIST:'])]
+    assert term['xrefs'] == ['HMDB:HMDB0002111']
+    assert term['is_a'] == ['CHEBI:33693']
+    assert term['relationships'] == [('has_role', 'CHEBI:48360')]
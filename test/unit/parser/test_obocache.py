@@ -0,0 +1,43 @@
+import io
+import os
+
+import pronto
+
+from biomedgraph.parser.helper.obo import read_obo
+from biomedgraph.parser.helper.obocache import cached_ontology, cache_key_prefix
+
+
+def _read(cleaned_file):
+    return read_obo(io.TextIOWrapper(cleaned_file, encoding='utf-8'))
+
+
+def test_cached_ontology(tmpdir):
+    this_path = os.path.dirname(os.path.abspath(__file__))
+    obo_file = os.path.join(tmpdir, 'fao.obo')
+    with open(os.path.join(this_path, 'fao.obo'), 'rt') as source, open(obo_file, 'wt') as target:
+        target.write(source.read())
+    cache_dir = os.path.join(tmpdir, 'cache')
+
+    header, terms = cached_ontology(cache_dir, obo_file, 'test', _read)
+    terms = list(terms)
+    assert len(os.listdir(cache_dir)) == 1
+
+    def fail(cleaned_file):
+        raise AssertionError("cached ontology parsed again")
+
+    cached_header, cached_terms = cached_ontology(cache_dir, obo_file, 'test', fail)
+    assert cached_header == header
+    assert list(cached_terms) == terms
+
+    # a changed file is parsed again
+    with open(obo_file, 'at') as f:
+        f.write('\n[Term]\nid: FAO:9999999\nname: new term\n')
+
+    _, changed_terms = cached_ontology(cache_dir, obo_file, 'test', _read)
+    assert [t['id'] for t in changed_terms][-1] == 'FAO:9999999'
+    assert len(os.listdir(cache_dir)) == 2
+
+
+def test_cache_key_prefix():
+    assert cache_key_prefix('ChebiParser', 'native') == 'ChebiParser-native'
+    assert cache_key_prefix('ChebiParser', 'pronto') == 'ChebiParser-pronto{}'.format(pronto.__version__)
@@ -1,7 +1,9 @@
 import pytest
 import os
+import json
 
 from biomedgraph.parser import OboFoundryParser
+from biomedgraph.parser.obofoundry import parse_ontologies_parallel, write_parser_shard
 
 
 class TestObofoundryParser:
@@ -10,3 +12,38 @@ class TestObofoundryParser:
         this_path = os.path.dirname(os.path.abspath(__file__))
         oboparser.parse_obo_file(os.path.join(this_path, 'fao.obo'))
 
+
+    def test_parse_ontologies_parallel(self, tmpdir):
+        this_path = os.path.dirname(os.path.abspath(__file__))
+        broken_file = os.path.join(tmpdir, 'broken.obo')
+        with open(broken_file, 'wb') as f:
+            f.write(b'format-version: 1.2\n\n[Term]\nid: BROKEN:1\nname: \xff\xfe\n')
+
+        obo_files = {'fao': os.path.join(this_path, 'fao.obo'), 'broken': broken_file}
+        shard_dir = os.path.join(tmpdir, 'shards')
+        # shard of a previous run
+        os.makedirs(os.path.join(shard_dir, 'broken'))
+
+        results = {ontology_name: (shard_path, error) for ontology_name, shard_path, error in
+                   parse_ontologies_parallel(obo_files, shard_dir, 2, obo_backend='native')}
+
+        assert results['fao'][1] is None
+        assert results['broken'][0] is None
+        assert results['broken'][1] is not None
+        assert os.listdir(shard_dir) == ['fao']
+
+        with open(os.path.join(results['fao'][0], 'terms.json')) as f:
+            terms = json.load(f)
+        assert terms['labels'] == ['Term']
+        assert len(terms['nodes']) == 114
+
+    def test_write_parser_shard_failure(self, tmpdir):
+        parser = OboFoundryParser()
+        # not JSON serializable
+        parser.terms.add_node({'sid': 'T:1', 'alt_ids': {'T:2'}})
+
+        with pytest.raises(TypeError):
+            write_parser_shard(parser, os.path.join(tmpdir, 'test'))
+
+        assert os.listdir(tmpdir) == []
+
@@ -0,0 +1,126 @@
+import pytest
+import gzip
+
+from biomedgraph.parser.uniprot import split_knowledgebase_file, read_idmapping_selected, explode_mapping
+from biomedgraph.parser.helper.uniprot import read_uniprot_records, write_secondary_accession_index, \
+    UniprotAccessionResolver, resolve_accessions
+
+
+@pytest.fixture(scope='session')
+def knowledgebase_file(tmpdir_factory):
+    """
+    Test knowledgebase file with three minimal records.
+    """
+    filename = tmpdir_factory.mktemp("parser").join("uniprot_sprot_human.dat.gz")
+
+    text = ''.join(
+        """ID   TEST{0}_HUMAN           Reviewed;         100 AA.
+AC   P0000{0};
+OS   Homo sapiens (Human).
+//
+""".format(i) for i in range(3)
+    )
+
+    with gzip.open(filename, 'wt') as f:
+        f.write(text)
+
+    return str(filename)
+
+
+def test_split_knowledgebase_file(knowledgebase_file):
+    with gzip.open(knowledgebase_file, 'rb') as f:
+        content = f.read()
+
+    chunks = list(split_knowledgebase_file(knowledgebase_file, chunk_size=100))
+
+    assert b''.join(chunks) == content
+    # each chunk contains complete records
+    for chunk in chunks:
+        assert chunk.startswith(b'ID   ')
+        assert chunk.endswith(b'\n//\n')
+
+
+def test_read_uniprot_records():
+    text = """ID   1433B_HUMAN             Reviewed;         246 AA.
+AC   P31946; A8K9K2;
+AC   E1P616;
+DT   01-JUL-1993, integrated into UniProtKB/Swiss-Prot.
+DE   RecName: Full=14-3-3 protein beta/alpha;
+DE            Short=Protein 1054;
+OS   Homo sapiens
+OS   (Human).
+OC   Eukaryota; Metazoa; Chordata; Craniata; Vertebrata; Euteleostomi.
+DR   EMBL; X57346; CAA40621.1; -; mRNA.
+DR   RefSeq; NP_003395.1; NM_003404.4. [P31946-1]
+DR   Ensembl; ENST00000353703; ENSP00000300161; ENSG00000166913. [P31946-1]
+SQ   SEQUENCE   246 AA;  28082 MW;  EC89EE2B57A6C44A CRC64;
+     MTMDKSELVQ KAKLAEQAER YDDMAAAMKA VTEQGHELSN EERNLLSVAY KNVVGARRSS
+//
+ID   1433B_MOUSE             Reviewed;         246 AA.
+AC   Q9CQV8;
+DE   RecName: Full=14-3-3 protein beta/alpha;
+OS   Mus musculus (Mouse).
+DR   RefSeq; NP_061223.2; NM_018753.6.
+//
+"""
+    records = list(read_uniprot_records(text.splitlines(True), os_string_id='Human',
+                                        dr_databases=['RefSeq', 'Ensembl']))
+
+    assert len(records) == 1
+    record = records[0]
+    assert record['AC'] == ['P31946', 'A8K9K2', 'E1P616']
+    assert record['DE'] == 'RecName: Full=14-3-3 protein beta/alpha; Short=Protein 1054;'
+    assert record['OS'] == 'Homo sapiens (Human).'
+    assert record['DR'] == [('RefSeq', ['NP_003395.1', 'NM_003404.4']),
+                            ('Ensembl', ['ENST00000353703', 'ENSP00000300161', 'ENSG00000166913'])]
+
+    # without filters all records and cross references are returned
+    records = list(read_uniprot_records(text.splitlines(True)))
+    assert [r['AC'][0] for r in records] == ['P31946', 'Q9CQV8']
+    assert records[0]['DR'][0][0] == 'EMBL'
+
+
+def test_read_idmapping_selected(tmpdir):
+    filename = str(tmpdir.join('idmapping_selected.tab.gz'))
+    lines = [
+        ['P31946', '1433B_HUMAN', '7529', 'NP_003395.1; NP_647539.1'] + [''] * 8 + ['9606'] + [''] * 5 +
+        ['ENSG00000166913', 'ENST00000353703; ENST00000372839', 'ENSP00000300161; ENSP00000361930', ''],
+        ['Q9CQV8', '1433B_MOUSE', '54401', 'NP_061223.2'] + [''] * 8 + ['10090'] + [''] * 9
+    ]
+    with gzip.open(filename, 'wt') as f:
+        for line in lines:
+            f.write('\t'.join(line) + '\n')
+
+    selected = read_idmapping_selected(filename, '9606')
+    assert list(selected['UniProtKB-AC']) == ['P31946']
+
+    refseq = explode_mapping(selected, 'RefSeq', remove_version=True)
+    assert list(refseq.itertuples(index=False, name=None)) == [('P31946', 'NP_003395'), ('P31946', 'NP_647539')]
+
+    ensembl = explode_mapping(selected, 'Ensembl_TRS')
+    assert list(ensembl['id']) == ['ENST00000353703', 'ENST00000372839']
+
+
+def test_uniprot_accession_resolver(tmpdir):
+    path = str(tmpdir.join('secondary_accessions'))
+    write_secondary_accession_index(path, [
+        ['P31946', 'A8K9K2', 'E1P616'],
+        ['P62258', 'B4DJF2'],
+        # B4DJF2 is secondary to two primary accessions, P31946 is primary and can not be secondary
+        ['Q04917', 'B4DJF2', 'P31946']
+    ])
+
+    resolver = UniprotAccessionResolver(path)
+    assert resolver.resolve(['E1P616', 'A8K9K2', 'P31946', 'B4DJF2', 'P00000', 'TOOLONGACCESSION', None]) == \
+        ['P31946', 'P31946', 'P31946', 'B4DJF2', 'P00000', 'TOOLONGACCESSION', None]
+
+
+def test_resolve_accessions_several_indexes(tmpdir):
+    human = str(tmpdir.join('9606'))
+    mouse = str(tmpdir.join('10090'))
+    write_secondary_accession_index(human, [['P31946', 'A8K9K2']])
+    write_secondary_accession_index(mouse, [['Q9CQV8', 'Q3TY33']])
+
+    assert resolve_accessions(human, ['A8K9K2', 'Q3TY33']) == ['P31946', 'Q3TY33']
+    assert resolve_accessions([human, mouse], ['A8K9K2', 'Q3TY33']) == ['P31946', 'Q9CQV8']
+    assert resolve_accessions(None, ['A8K9K2']) == ['A8K9K2']